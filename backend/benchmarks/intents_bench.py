@@ -0,0 +1,106 @@
+"""
+Microbenchmark da detecção de intenções
+
+Compara a varredura antiga (substring em cada palavra-chave, uma lista por
+vez) com o IntentMatcher (uma regex para todas as intenções) e mostra o
+custo por mensagem. Também confere casos de referência (flexões pegas pelos
+radicais `prefixo*`, falsos positivos que a palavra inteira evita). Uso,
+dentro de backend/:
+
+    python benchmarks/intents_bench.py [--mensagens 20000] [--extras 500]
+"""
+import argparse
+import random
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from intents import DEFAULT_INTENTS, IntentMatcher  # noqa: E402
+
+AMOSTRAS = [
+    "Oi, boa noite! Qual o horário de funcionamento?",
+    "Vocês entregam no Boqueirão? Quanto fica a taxa?",
+    "Quero 2 combos de salmão e um temaki, aceita cartão?",
+    "Isso é golpe? Já caí num site falso uma vez",
+    "Quero falar com um atendente de verdade, não com robô",
+    "Realmente gostei do botão novo do cardápio, muito bom mesmo 😋",
+    "Tem opção vegetariana? Minha namorada não come peixe",
+    "Oiii",
+    "Vc é bot? Nao e robo nao ne?",
+]
+
+# (mensagem, intenções esperadas com as listas padrão)
+CASOS = [
+    ("Isso é golpe?", {"desconfianca"}),
+    ("Já caí em vários golpes assim", {"desconfianca"}),
+    ("Tem muitas fraudes com pix por aí", {"desconfianca"}),
+    ("Esse site é confiável mesmo?", {"desconfianca"}),
+    ("Não quero ser enganado de novo", {"desconfianca"}),
+    ("Quero falar com um atendente", {"pedido_humano"}),
+    ("Não tem atendentes aí?", {"pedido_humano"}),
+    ("Prefiro falar com humanos", {"pedido_humano"}),
+    ("Tem alguma pessoa aí?", {"pedido_humano"}),
+    ("Chama a funcionária por favor", {"pedido_humano"}),
+    ("Realmente gostei do botão novo", set()),
+    ("Quero 2 combos de salmão", set()),
+]
+
+
+def varredura_antiga(intents):
+    def detectar(texto: str):
+        texto_lower = texto.lower()
+        return {
+            nome for nome, palavras in intents.items()
+            if any(palavra.rstrip("*") in texto_lower for palavra in palavras)
+        }
+    return detectar
+
+
+def com_extras(n: int):
+    """Listas padrão + `n` palavras-chave sintéticas (simula listas grandes no painel)"""
+    extras = [f"termo{i} extra{i % 7}" if i % 3 == 0 else f"palavra{i}" for i in range(n)]
+    return {**DEFAULT_INTENTS, "extras": extras}
+
+
+def medir(nome: str, fn, mensagens):
+    inicio = time.perf_counter()
+    for msg in mensagens:
+        fn(msg)
+    total = time.perf_counter() - inicio
+    print(f"{nome:<20} {total * 1e6 / len(mensagens):8.2f} µs/mensagem  ({total * 1000:.1f} ms no total)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--mensagens", type=int, default=20000)
+    parser.add_argument("--extras", type=int, default=500, help="palavras-chave sintéticas extras")
+    args = parser.parse_args()
+
+    random.seed(42)
+    mensagens = [random.choice(AMOSTRAS) for _ in range(args.mensagens)]
+
+    for extras in (0, args.extras):
+        intents = com_extras(extras)
+        print(f"\n{len(mensagens)} mensagens, {sum(map(len, intents.values()))} palavras-chave")
+        medir("substring (antigo)", varredura_antiga(intents), mensagens)
+        medir("IntentMatcher", IntentMatcher(intents).match, mensagens)
+
+    antiga, matcher = varredura_antiga(DEFAULT_INTENTS), IntentMatcher(DEFAULT_INTENTS)
+    print("\nMensagens em que os métodos discordam:")
+    for texto in AMOSTRAS:
+        antigo, novo = antiga(texto), matcher.match(texto)
+        if antigo != novo:
+            print(f"  {texto!r}: antigo={sorted(antigo)} novo={sorted(novo)}")
+
+    erros = [(texto, esperado, matcher.match(texto)) for texto, esperado in CASOS if matcher.match(texto) != esperado]
+    print(f"\nCasos de referência: {len(CASOS) - len(erros)}/{len(CASOS)} ok")
+    for texto, esperado, obtido in erros:
+        print(f"  {texto!r}: esperado={sorted(esperado)} obtido={sorted(obtido)}")
+    if erros:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
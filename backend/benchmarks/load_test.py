@@ -0,0 +1,462 @@
+"""
+Teste de carga offline do backend
+
+Sobe um mock da OpenRouter (latência log-normal, taxa de erro, streaming
+SSE) e um mock do bot Node.js (/send-message), inicia o server.py num
+subprocesso apontando para eles, conecta N painéis pelo WebSocket e manda
+tráfego de vários chats para /api/webhook/message. No fim mostra vazão,
+p50/p95/p99 e memória ao longo do tempo. Mesmo --seed, mesmo tráfego.
+
+Uso, dentro de backend/:
+
+    python benchmarks/load_test.py [--mensagens 2000] [--rps 40] [--chats 300]
+        [--paineis 5] [--llm-ms 800] [--llm-erros 0.02] [--saida relatorio.json]
+
+Nada sai da máquina: config.json e banco ficam numa pasta temporária.
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import aiohttp
+from aiohttp import web
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+
+AMOSTRAS = [
+    "Oi, boa noite! Qual o horário de funcionamento?",
+    "Vocês entregam no Boqueirão? Quanto fica a taxa?",
+    "Quero 2 combos de salmão e um temaki, aceita cartão?",
+    "Tem opção vegetariana? Minha namorada não come peixe",
+    "Quanto tempo demora a entrega pro Água Verde?",
+    "Aceita pix? Tem desconto pagando no pix?",
+    "Qual o combo mais pedido de vocês?",
+    "Isso é golpe? Já caí num site falso uma vez",
+    "Quero falar com um atendente",
+    "ok",
+    "Oiii",
+    "Vocês abrem domingo?",
+]
+
+RESPOSTA_MOCK = (
+    "Opa, tudo certo? 🍣 Hoje o combo de salmão está saindo muito! "
+    "Você faz o pedido direto no site e acompanha a entrega em tempo real. "
+    "Quer que eu te mande o link do cardápio completo?"
+)
+
+
+def porta_livre() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def percentis(valores: List[float]) -> Dict:
+    if not valores:
+        return {"n": 0}
+    ordenados = sorted(valores)
+
+    def p(q):
+        return round(ordenados[min(len(ordenados) - 1, int(len(ordenados) * q))], 1)
+
+    return {
+        "n": len(ordenados),
+        "p50": p(0.50),
+        "p95": p(0.95),
+        "p99": p(0.99),
+        "max": round(ordenados[-1], 1),
+    }
+
+
+def rss_mb(pid: int) -> Optional[float]:
+    """Memória residente do processo (Linux); None em outros sistemas"""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for linha in f:
+                if linha.startswith("VmRSS:"):
+                    return round(int(linha.split()[1]) / 1024, 1)
+    except OSError:
+        return None
+    return None
+
+
+# ==================== MOCKS ====================
+
+class MockOpenRouter:
+    """/api/v1/chat/completions com latência e erros sorteados"""
+
+    def __init__(self, rng: random.Random, latencia_ms: float, sigma: float, erros: float, token_ms: float):
+        self.rng = rng
+        self.latencia_ms = latencia_ms
+        self.sigma = sigma
+        self.erros = erros
+        self.token_ms = token_ms
+        self.chamadas = 0
+        self.falhas = 0
+        self.streams = 0
+
+    def _latencia(self) -> float:
+        # Log-normal com mediana latencia_ms: cauda longa como a de um LLM real
+        return self.latencia_ms * math.exp(self.rng.gauss(0, self.sigma)) / 1000
+
+    async def completions(self, request: web.Request) -> web.StreamResponse:
+        payload = await request.json()
+        self.chamadas += 1
+        await asyncio.sleep(self._latencia())
+        if self.rng.random() < self.erros:
+            self.falhas += 1
+            status = self.rng.choice([429, 500, 502])
+            return web.Response(status=status, text='{"error": "mock"}')
+
+        if not payload.get("stream"):
+            return web.json_response({"choices": [{"message": {"content": RESPOSTA_MOCK}}]})
+
+        self.streams += 1
+        resposta = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await resposta.prepare(request)
+        palavras = RESPOSTA_MOCK.split(" ")
+        for i in range(0, len(palavras), 3):
+            delta = " ".join(palavras[i:i + 3]) + " "
+            evento = {"choices": [{"delta": {"content": delta}}]}
+            await resposta.write(f"data: {json.dumps(evento)}\n\n".encode())
+            await asyncio.sleep(self.token_ms / 1000)
+        await resposta.write(b"data: [DONE]\n\n")
+        await resposta.write_eof()
+        return resposta
+
+
+class MockBot:
+    """/send-message do bot Node.js; anota quando cada chat recebeu resposta"""
+
+    def __init__(self, rng: random.Random, latencia_ms: float, on_envio):
+        self.rng = rng
+        self.latencia_ms = latencia_ms
+        self.on_envio = on_envio
+        self.envios = 0
+
+    async def send_message(self, request: web.Request) -> web.Response:
+        dados = await request.json()
+        self.envios += 1
+        self.on_envio(dados["chat_id"])
+        await asyncio.sleep(self.latencia_ms * self.rng.uniform(0.5, 1.5) / 1000)
+        return web.json_response({"success": True})
+
+
+async def iniciar_app(rotas, porta: int) -> web.AppRunner:
+    app = web.Application()
+    for metodo, caminho, handler in rotas:
+        app.router.add_route(metodo, caminho, handler)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", porta).start()
+    return runner
+
+
+# ==================== TESTE ====================
+
+class Medicoes:
+    def __init__(self):
+        self.webhook_ms: List[float] = []
+        self.resposta_ms: List[float] = []
+        self.painel_ms: List[float] = []
+        self.webhook_erros = 0
+        self.respostas_inline = 0
+        self.eventos_painel = 0
+        # chat_id -> instante da mensagem mais antiga ainda sem resposta
+        # (a resposta conta no primeiro envio ao bot; streaming manda vários)
+        self.pendentes: Dict[str, float] = {}
+        # (chat_id, texto) -> instantes de envio, para casar com message_received
+        self.enviadas: Dict[tuple, List[float]] = {}
+        self.amostras: List[Dict] = []
+
+    def resposta_recebida(self, chat_id: str):
+        inicio = self.pendentes.pop(chat_id, None)
+        if inicio is not None:
+            self.resposta_ms.append((time.perf_counter() - inicio) * 1000)
+
+
+async def painel(url: str, med: Medicoes, pronto: asyncio.Event, parar: asyncio.Event):
+    vistos: Dict[tuple, int] = {}  # mesmo texto repetido no chat: casa na ordem de envio
+    async with aiohttp.ClientSession() as session:
+        async with session.ws_connect(url, heartbeat=30) as ws:
+            pronto.set()
+            while not parar.is_set():
+                try:
+                    msg = await asyncio.wait_for(ws.receive(), timeout=0.5)
+                except asyncio.TimeoutError:
+                    continue
+                if msg.type != aiohttp.WSMsgType.TEXT:
+                    break
+                evento = json.loads(msg.data)
+                med.eventos_painel += 1
+                if evento.get("type") == "message_received":
+                    chave = (evento["chat_id"], evento["message"]["text"])
+                    envios = med.enviadas.get(chave, [])
+                    i = vistos.get(chave, 0)
+                    if i < len(envios):
+                        vistos[chave] = i + 1
+                        med.painel_ms.append((time.perf_counter() - envios[i]) * 1000)
+
+
+async def enviar(session, base: str, chat_id: str, texto: str, med: Medicoes):
+    agora = time.perf_counter()
+    med.pendentes.setdefault(chat_id, agora)
+    med.enviadas.setdefault((chat_id, texto), []).append(agora)
+    try:
+        async with session.post(f"{base}/api/webhook/message", json={"chat_id": chat_id, "message": texto}) as r:
+            corpo = await r.json()
+            if r.status != 200:
+                med.webhook_erros += 1
+                return
+    except aiohttp.ClientError:
+        med.webhook_erros += 1
+        return
+    med.webhook_ms.append((time.perf_counter() - agora) * 1000)
+    if corpo.get("response"):
+        # Mensagem inicial / sobrecarga: o bot Node.js envia o texto do retorno
+        med.respostas_inline += 1
+        med.resposta_recebida(chat_id)
+
+
+async def trafego(base: str, args, rng: random.Random, med: Medicoes):
+    """Chegadas Poisson; poucos chats concentram a maior parte das mensagens"""
+    chats = [f"55419{8000000 + i:07d}@c.us" for i in range(args.chats)]
+    pesos = [1 / (i + 1) ** 0.8 for i in range(args.chats)]
+    tarefas = []
+    async with aiohttp.ClientSession() as session:
+        enviadas = 0
+        while enviadas < args.mensagens:
+            await asyncio.sleep(rng.expovariate(args.rps))
+            chat_id = rng.choices(chats, pesos)[0]
+            # ~30% das vezes o cliente manda uma rajada de 2-3 mensagens seguidas
+            rajada = rng.choice([2, 3]) if rng.random() < 0.3 else 1
+            for i in range(min(rajada, args.mensagens - enviadas)):
+                texto = rng.choice(AMOSTRAS)
+                atraso = i * rng.uniform(0.2, 0.8)
+                tarefas.append(asyncio.create_task(_atrasado(atraso, enviar(session, base, chat_id, texto, med))))
+                enviadas += 1
+        await asyncio.gather(*tarefas)
+
+
+async def _atrasado(segundos: float, coro):
+    await asyncio.sleep(segundos)
+    await coro
+
+
+async def amostrar(base: str, pid: int, med: Medicoes, inicio: float, parar: asyncio.Event, intervalo: float):
+    async with aiohttp.ClientSession() as session:
+        while not parar.is_set():
+            try:
+                async with session.get(f"{base}/api/status") as r:
+                    status = await r.json()
+            except aiohttp.ClientError:
+                status = {}
+            fila = status.get("reply_queue", {})
+            med.amostras.append({
+                "t": round(time.perf_counter() - inicio, 1),
+                "rss_mb": rss_mb(pid),
+                "conversas": status.get("conversas_ativas"),
+                "fila": fila.get("depth"),
+                "ia_em_andamento": status.get("admission", {}).get("in_flight"),
+                "respostas": len(med.resposta_ms),
+            })
+            try:
+                await asyncio.wait_for(parar.wait(), timeout=intervalo)
+            except asyncio.TimeoutError:
+                pass
+
+
+def config_teste(args) -> Dict:
+    return {
+        "provider": "openrouter",
+        "openrouter_api_key": "mock",
+        "selected_model": "deepseek/deepseek-r1:free",
+        "auto_reply": True,
+        "debounce_ms": args.debounce_ms,
+        "fallback_enabled": True,
+        "fallback_max_attempts": 3,
+        "hedge_ms": args.hedge_ms,
+        "streaming": args.streaming,
+        "response_cache": args.cache,
+    }
+
+
+async def aguardar_backend(base: str, processo: subprocess.Popen, timeout: float = 30):
+    limite = time.monotonic() + timeout
+    async with aiohttp.ClientSession() as session:
+        while time.monotonic() < limite:
+            if processo.poll() is not None:
+                raise RuntimeError("server.py terminou durante a inicialização (veja o log)")
+            try:
+                async with session.get(f"{base}/api/health") as r:
+                    if r.status == 200:
+                        return
+            except aiohttp.ClientError:
+                pass
+            await asyncio.sleep(0.2)
+    raise RuntimeError("server.py não respondeu a /api/health")
+
+
+async def executar(args) -> Dict:
+    rng = random.Random(args.seed)
+    med = Medicoes()
+    pasta = Path(tempfile.mkdtemp(prefix="sushibot-load-"))
+    (pasta / "config.json").write_text(json.dumps(config_teste(args)))
+
+    porta_llm, porta_bot, porta_api = porta_livre(), porta_livre(), porta_livre()
+    llm = MockOpenRouter(random.Random(args.seed + 1), args.llm_ms, args.llm_sigma, args.llm_erros, args.token_ms)
+    bot = MockBot(random.Random(args.seed + 2), args.bot_ms, med.resposta_recebida)
+    runner_llm = await iniciar_app([("POST", "/api/v1/chat/completions", llm.completions)], porta_llm)
+    runner_bot = await iniciar_app([("POST", "/send-message", bot.send_message)], porta_bot)
+
+    env = {
+        **os.environ,
+        "CONFIG_FILE": str(pasta / "config.json"),
+        "OPENROUTER_URL": f"http://127.0.0.1:{porta_llm}/api/v1/chat/completions",
+        "WHATSAPP_BOT_URL": f"http://127.0.0.1:{porta_bot}",
+        "CONVERSAS_STORE": args.store,
+        "CONVERSAS_DB": str(pasta / "conversas.db"),
+        "PYTHONUNBUFFERED": "1",
+    }
+    if not args.limites:
+        # Mede a capacidade do backend, não as cotas dos provedores
+        env.update({"AI_RATE_OPENROUTER_PER_MIN": "0", "CHAT_RATE_PER_MIN": "0"})
+    log = open(pasta / "server.log", "w")
+    processo = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "server:app", "--host", "127.0.0.1", "--port", str(porta_api),
+         "--log-level", "warning"],
+        cwd=BACKEND_DIR, env=env, stdout=log, stderr=subprocess.STDOUT
+    )
+    base = f"http://127.0.0.1:{porta_api}"
+    parar = asyncio.Event()
+    try:
+        await aguardar_backend(base, processo)
+        prontos = [asyncio.Event() for _ in range(args.paineis)]
+        paineis = [
+            asyncio.create_task(painel(f"ws://127.0.0.1:{porta_api}/api/ws", med, pronto, parar))
+            for pronto in prontos
+        ]
+        await asyncio.gather(*(p.wait() for p in prontos))
+
+        inicio = time.perf_counter()
+        amostrador = asyncio.create_task(amostrar(base, processo.pid, med, inicio, parar, args.intervalo))
+        await trafego(base, args, rng, med)
+        fim_envio = time.perf_counter()
+        # Espera as respostas que ainda estão na fila
+        limite = time.monotonic() + args.espera
+        while med.pendentes and time.monotonic() < limite:
+            await asyncio.sleep(0.2)
+        duracao = time.perf_counter() - inicio
+
+        async with aiohttp.ClientSession() as session:
+            async with session.get(f"{base}/api/status") as r:
+                status_final = await r.json()
+        parar.set()
+        await asyncio.gather(amostrador, *paineis, return_exceptions=True)
+    finally:
+        parar.set()
+        processo.terminate()
+        try:
+            processo.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            processo.kill()
+        log.close()
+        await runner_llm.cleanup()
+        await runner_bot.cleanup()
+
+    return {
+        "parametros": vars(args),
+        "duracao_s": round(duracao, 1),
+        "envio_s": round(fim_envio - inicio, 1),
+        "vazao": {
+            "webhooks_por_s": round(len(med.webhook_ms) / (fim_envio - inicio), 1),
+            "respostas_por_s": round(len(med.resposta_ms) / duracao, 1),
+        },
+        "latencia_ms": {
+            "webhook": percentis(med.webhook_ms),
+            "resposta": percentis(med.resposta_ms),
+            "painel": percentis(med.painel_ms),
+        },
+        "contagens": {
+            "webhook_erros": med.webhook_erros,
+            "respostas_inline": med.respostas_inline,
+            "chats_sem_resposta": len(med.pendentes),
+            "eventos_painel": med.eventos_painel,
+            "llm_chamadas": llm.chamadas,
+            "llm_falhas": llm.falhas,
+            "llm_streams": llm.streams,
+            "bot_envios": bot.envios,
+        },
+        "backend": {
+            "reply_queue": status_final.get("reply_queue"),
+            "admission": status_final.get("admission"),
+            "response_cache": status_final.get("response_cache"),
+            "memory": status_final.get("memory"),
+        },
+        "memoria": med.amostras,
+        "log": str(pasta / "server.log"),
+    }
+
+
+def imprimir(relatorio: Dict):
+    print(f"Duração: {relatorio['duracao_s']}s (envio {relatorio['envio_s']}s)")
+    vazao = relatorio["vazao"]
+    print(f"Vazão: {vazao['webhooks_por_s']} webhooks/s, {vazao['respostas_por_s']} respostas/s")
+    print(f"{'latência (ms)':<16}{'n':>7}{'p50':>10}{'p95':>10}{'p99':>10}{'max':>10}")
+    for nome, p in relatorio["latencia_ms"].items():
+        if p["n"]:
+            print(f"{nome:<16}{p['n']:>7}{p['p50']:>10}{p['p95']:>10}{p['p99']:>10}{p['max']:>10}")
+        else:
+            print(f"{nome:<16}{0:>7}")
+    print("Contagens: " + ", ".join(f"{k}={v}" for k, v in relatorio["contagens"].items()))
+    print(f"\n{'t (s)':>7}{'RSS (MB)':>10}{'conversas':>11}{'fila':>6}{'IA':>4}{'respostas':>11}")
+    for a in relatorio["memoria"]:
+        rss = a["rss_mb"] if a["rss_mb"] is not None else "-"
+        print(f"{a['t']:>7}{rss:>10}{a['conversas'] or 0:>11}{a['fila'] or 0:>6}"
+              f"{a['ia_em_andamento'] or 0:>4}{a['respostas']:>11}")
+    print(f"\nLog do servidor: {relatorio['log']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mensagens", type=int, default=2000, help="mensagens enviadas ao webhook")
+    parser.add_argument("--rps", type=float, default=40, help="chegadas por segundo (média)")
+    parser.add_argument("--chats", type=int, default=300, help="clientes distintos")
+    parser.add_argument("--paineis", type=int, default=5, help="painéis conectados ao WebSocket")
+    parser.add_argument("--llm-ms", type=float, default=800, help="mediana da latência da IA")
+    parser.add_argument("--llm-sigma", type=float, default=0.5, help="dispersão log-normal da latência")
+    parser.add_argument("--llm-erros", type=float, default=0.02, help="fração de chamadas com erro 429/5xx")
+    parser.add_argument("--token-ms", type=float, default=30, help="intervalo entre trechos no streaming")
+    parser.add_argument("--bot-ms", type=float, default=50, help="latência média do /send-message")
+    parser.add_argument("--debounce-ms", type=int, default=1200)
+    parser.add_argument("--hedge-ms", type=int, default=0)
+    parser.add_argument("--streaming", action=argparse.BooleanOptionalAction, default=True)
+    parser.add_argument("--cache", action=argparse.BooleanOptionalAction, default=True,
+                        help="cache de respostas da IA")
+    parser.add_argument("--limites", action="store_true", help="mantém as cotas por provedor e por chat")
+    parser.add_argument("--store", default="memory", choices=["memory", "sqlite"])
+    parser.add_argument("--intervalo", type=float, default=2.0, help="segundos entre amostras de memória")
+    parser.add_argument("--espera", type=float, default=60.0, help="segundos aguardando respostas no fim")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--saida", help="grava o relatório completo em JSON")
+    args = parser.parse_args()
+
+    relatorio = asyncio.run(executar(args))
+    imprimir(relatorio)
+    if args.saida:
+        Path(args.saida).write_text(json.dumps(relatorio, indent=2, ensure_ascii=False))
+        print(f"Relatório: {args.saida}")
+
+
+if __name__ == "__main__":
+    main()
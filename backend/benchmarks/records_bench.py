@@ -0,0 +1,130 @@
+"""
+Microbenchmark da memória das conversas
+
+Monta o mesmo histórico sintético como dicts (formato antigo, igual ao JSON
+gravado) e como registros compactos (records.py) e compara a memória
+alocada, o tempo de conversão nas bordas e a checagem de `ultimo_humano`
+feita a cada mensagem recebida. Uso, dentro de backend/:
+
+    python benchmarks/records_bench.py [--conversas 2000] [--mensagens 50]
+"""
+import argparse
+import gc
+import json
+import random
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from records import Conversation  # noqa: E402
+
+FRASES = [
+    "Oi, boa noite! Qual o horário de funcionamento?",
+    "Vocês entregam no Boqueirão? Quanto fica a taxa de entrega?",
+    "Quero 2 combos de salmão e um temaki, aceita cartão?",
+    "Entregamos em toda Curitiba! A taxa depende do bairro.",
+    "Aceitamos Pix e cartão 💳 na entrega ou pelo site.",
+]
+
+
+def conversas_json(conversas: int, mensagens: int) -> list:
+    """Conversas como saem do banco: texto JSON (strings novas a cada leitura)"""
+    random.seed(42)
+    inicio = datetime(2024, 1, 1)
+    lista = []
+    for c in range(conversas):
+        chat_id = f"5541{c:08d}@s.whatsapp.net"
+        ts = inicio + timedelta(minutes=random.randint(0, 200000))
+        msgs = []
+        historico = []
+        for m in range(mensagens):
+            de_cliente = m % 2 == 0
+            texto = random.choice(FRASES)
+            ts += timedelta(seconds=random.randint(5, 600))
+            msg = {
+                "id": f"{'recv' if de_cliente else 'sent'}_{int(ts.timestamp() * 1e6)}",
+                "from": "cliente" if de_cliente else "bot",
+                "text": texto,
+                "timestamp": ts.isoformat(),
+            }
+            if de_cliente:
+                msg["whatsapp_id"] = f"3EB0{c:06d}{m:04d}"
+            msgs.append(msg)
+            historico.append({"role": "user" if de_cliente else "assistant", "content": texto, "tokens": 14})
+        lista.append(json.dumps({
+            "chat_id": chat_id,
+            "mensagens": msgs,
+            "humano_ativo": c % 10 == 0,
+            "modo_humanizado": False,
+            "ultimo_humano": ts.isoformat() if c % 10 == 0 else None,
+            "mensagem_inicial_enviada": True,
+            "objecoes_tratadas": [],
+            "historico_ia": historico[-60:],
+            "resumo_ia": None,
+            "nome_cliente": chat_id.split("@")[0],
+            "criado_em": inicio.isoformat(),
+        }, ensure_ascii=False))
+    return lista
+
+
+def medir_memoria(fabrica):
+    gc.collect()
+    tracemalloc.start()
+    objetos = fabrica()
+    atual, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return objetos, atual
+
+
+def medir_tempo(fn, repeticoes: int = 1) -> float:
+    inicio = time.perf_counter()
+    for _ in range(repeticoes):
+        fn()
+    return (time.perf_counter() - inicio) * 1000 / repeticoes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--conversas", type=int, default=2000)
+    parser.add_argument("--mensagens", type=int, default=50, help="mensagens por conversa")
+    args = parser.parse_args()
+
+    gravadas = conversas_json(args.conversas, args.mensagens)
+    total = args.conversas * args.mensagens
+
+    dicts, bytes_dicts = medir_memoria(lambda: [json.loads(g) for g in gravadas])
+    registros, bytes_registros = medir_memoria(
+        lambda: [Conversation.from_dict(json.loads(g)) for g in gravadas]
+    )
+    print(f"{args.conversas} conversas, {total} mensagens\n")
+    print(f"{'formato':<12} {'memória':>10} {'por mensagem':>14}")
+    for rotulo, tamanho in (("dicts", bytes_dicts), ("registros", bytes_registros)):
+        print(f"{rotulo:<12} {tamanho / 2**20:8.1f}MB {tamanho / total:12.0f}B")
+    print(f"economia: {(1 - bytes_registros / bytes_dicts) * 100:.0f}%\n")
+
+    igual = all(r.to_dict() == d for r, d in zip(registros, dicts))
+    print(f"to_dict() igual ao JSON gravado: {igual}")
+    print(f"from_dict (todas): {medir_tempo(lambda: [Conversation.from_dict(d) for d in dicts]):.0f}ms")
+    print(f"to_dict   (todas): {medir_tempo(lambda: [r.to_dict() for r in registros]):.0f}ms\n")
+
+    # Checagem do webhook: o atendente assumiu há mais de N minutos?
+    agora = datetime.now()
+    antigo = medir_tempo(lambda: [
+        (agora - datetime.fromisoformat(d["ultimo_humano"])).total_seconds() / 60 > 60
+        for d in dicts if d["ultimo_humano"]
+    ], 20)
+    agora_ts = agora.timestamp()
+    novo = medir_tempo(lambda: [
+        (agora_ts - r.ultimo_humano) / 60 > 60 for r in registros if r.ultimo_humano is not None
+    ], 20)
+    atendidas = sum(1 for r in registros if r.ultimo_humano is not None)
+    print(f"ultimo_humano ({atendidas} conversas): ISO {antigo * 1000 / atendidas:.2f}µs, "
+          f"epoch {novo * 1000 / atendidas:.2f}µs por checagem")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,174 @@
+"""
+Microbenchmark da busca nas mensagens
+
+Monta um histórico sintético (várias conversas, centenas de milhares de
+mensagens), indexa no SearchIndex (FTS5 num arquivo temporário) e compara
+o tempo de consulta com a varredura linear de todas as `mensagens`. Uso,
+dentro de backend/:
+
+    python benchmarks/search_bench.py [--conversas 5000] [--mensagens 60]
+"""
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from search import SearchIndex, parse_query, tokens  # noqa: E402
+
+FRASES_CLIENTE = [
+    "Oi, boa noite! Qual o horário de funcionamento?",
+    "Vocês entregam no Boqueirão? Quanto fica a taxa de entrega?",
+    "Quero 2 combos de salmão e um temaki, aceita cartão?",
+    "Isso é golpe? Já caí num site falso uma vez",
+    "Meu pedido ainda não chegou, já faz uma hora",
+    "Tem opção vegetariana? Minha namorada não come peixe",
+    "Pode mandar o cardápio de novo?",
+    "Qual o valor do combo família?",
+    "Vocês fazem hot roll sem cream cheese?",
+]
+FRASES_BOT = [
+    "Oi! 😊 Bem-vindo ao Sushi Aki 🍣 Confere o cardápio: https://sushiakicb.shop",
+    "Entregamos em toda Curitiba! A taxa depende do bairro.",
+    "Aceitamos Pix e cartão 💳 na entrega ou pelo site.",
+    "O combo família serve 3 pessoas e sai por R$ 129,90.",
+    "Seu pedido saiu para entrega, chega em até 40 minutos!",
+]
+CONSULTAS = [
+    "combo",
+    "salmão temaki",
+    '"taxa de entrega"',
+    "golp*",
+    "pedido chegou",
+    "vegetariana peixe",
+    "pix cartao",
+    "boqueirao",
+    "inexistente",
+]
+
+
+def historico(conversas: int, mensagens: int):
+    random.seed(42)
+    inicio = datetime(2024, 1, 1)
+    for c in range(conversas):
+        chat_id = f"5541{c:08d}@s.whatsapp.net"
+        ts = inicio + timedelta(minutes=random.randint(0, 200000))
+        lista = []
+        for m in range(mensagens):
+            de_cliente = m % 2 == 0
+            texto = random.choice(FRASES_CLIENTE if de_cliente else FRASES_BOT)
+            if random.random() < 0.3:
+                texto += f" pedido {random.randint(1000, 99999)}"
+            ts += timedelta(seconds=random.randint(5, 600))
+            lista.append({
+                "id": f"m{c}_{m}",
+                "from": "cliente" if de_cliente else "bot",
+                "text": texto,
+                "timestamp": ts.isoformat(),
+            })
+        yield {"chat_id": chat_id, "mensagens": lista}
+
+
+def varredura_linear(conversas, q: str, limit: int = 20):
+    """O que seria preciso sem índice: normalizar e conferir todas as mensagens"""
+    palavras, prefixos, frases = parse_query(q)
+    achados = []
+    for conversa in conversas:
+        for msg in conversa["mensagens"]:
+            partes = tokens(msg["text"])
+            conjunto = set(partes)
+            if not all(p in conjunto for p in palavras):
+                continue
+            if not all(any(t.startswith(p) for t in partes) for p in prefixos):
+                continue
+            texto = f" {' '.join(partes)} "
+            if all(f" {' '.join(f)} " in texto for f in frases):
+                achados.append(msg)
+    return achados[-limit:]
+
+
+def _p99(tempos):
+    tempos.sort()
+    return statistics.median(tempos), tempos[int(len(tempos) * 0.99) - 1 if len(tempos) > 1 else 0]
+
+
+def medir(fn, repeticoes: int):
+    tempos = []
+    for _ in range(repeticoes):
+        inicio = time.perf_counter()
+        fn()
+        tempos.append((time.perf_counter() - inicio) * 1000)
+    return _p99(tempos)
+
+
+async def medir_async(fn, repeticoes: int):
+    tempos = []
+    for _ in range(repeticoes):
+        inicio = time.perf_counter()
+        await fn()
+        tempos.append((time.perf_counter() - inicio) * 1000)
+    return _p99(tempos)
+
+
+async def rodar(args, path: str):
+    conversas = list(historico(args.conversas, args.mensagens))
+    total = args.conversas * args.mensagens
+
+    indice = SearchIndex(path)
+    inicio = time.perf_counter()
+    for conversa in conversas:
+        indice.add_conversa(conversa)
+        if len(indice._pendentes) >= 5000:
+            await indice.flush()
+    await indice.flush()
+    print(f"{total} mensagens indexadas em {time.perf_counter() - inicio:.2f}s "
+          f"({os.path.getsize(path) / 2**20:.0f}MB em disco)\n")
+
+    um_chat = conversas[len(conversas) // 2]["chat_id"]
+    print(f"{'consulta':<28} {'índice p50':>11} {'p99':>9} {'linear':>10}")
+    for q in CONSULTAS:
+        p50, p99 = await medir_async(lambda: indice.search(q, limit=20), args.repeticoes)
+        linear = medir(lambda: varredura_linear(conversas, q), 1)[0]
+        print(f"{q:<28} {p50:9.3f}ms {p99:7.3f}ms {linear:8.0f}ms")
+
+    print()
+    for rotulo, kwargs in (
+        ("combo + chat", {"q": "combo", "chat_id": um_chat}),
+        ("pedido + autor cliente", {"q": "pedido", "autor": "cliente"}),
+        ("pix + janela de datas", {
+            "q": "pix",
+            "desde": datetime(2024, 3, 1).timestamp(),
+            "ate": datetime(2024, 3, 8).timestamp(),
+        }),
+    ):
+        p50, p99 = await medir_async(lambda: indice.search(limit=20, **kwargs), args.repeticoes)
+        print(f"{rotulo:<28} {p50:9.3f}ms {p99:7.3f}ms")
+
+    pagina, cursor = await indice.search("combo", limit=20)
+    paginas = 1
+    while cursor and paginas < 50:
+        pagina, cursor = await indice.search("combo", limit=20, cursor=cursor)
+        paginas += 1
+    print(f"\n{paginas} páginas seguidas de 'combo' por cursor: ok")
+    await indice.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--conversas", type=int, default=5000)
+    parser.add_argument("--mensagens", type=int, default=60, help="mensagens por conversa")
+    parser.add_argument("--repeticoes", type=int, default=200)
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as pasta:
+        asyncio.run(rodar(args, os.path.join(pasta, "search.db")))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,470 @@
+"""
+Vários workers/servidores atendendo o mesmo bot
+
+Com `uvicorn --workers N` (ou várias máquinas atrás de um balanceador) cada
+processo tem seu cache de conversas, sua fila de respostas e seus painéis
+conectados. Este módulo liga os processos:
+
+- pub/sub: todo evento do painel publicado num worker chega aos painéis
+  conectados nos outros (cada worker numera os eventos no seu stream);
+- afinidade: cada chat_id tem um worker dono (rendezvous hashing sobre os
+  workers vivos); rotas que alteram uma conversa são executadas no dono,
+  então uma conversa nunca é modificada por dois processos ao mesmo tempo;
+- estado compartilhado: chave/valor pequeno (status do WhatsApp) para quem
+  acabou de subir.
+
+Backends (CLUSTER_BACKEND): `local` (padrão, um processo, custo zero),
+`sqlite` (arquivo compartilhado entre os workers da mesma máquina; também
+serve de stand-in para testes) e `redis` (várias máquinas; requer o pacote
+`redis`).
+"""
+import asyncio
+import hashlib
+import json
+import os
+import socket
+import sqlite3
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import suppress
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional
+from collections import deque
+
+Handler = Callable[[Dict], Awaitable[Any]]
+
+
+class ErroRemoto(Exception):
+    """A operação falhou no worker dono; `status` segue o HTTP da rota original"""
+
+    def __init__(self, status: int, detail: str):
+        super().__init__(detail)
+        self.status = status
+        self.detail = detail
+
+
+class ClusterBus:
+    """Interface dos backends + pedidos com resposta, comuns a todos"""
+
+    name = "base"
+
+    def __init__(self, heartbeat: float = 2.0, request_timeout: float = 15.0):
+        self.worker_id = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:4]}"
+        self.heartbeat = heartbeat
+        self.member_ttl = heartbeat * 3
+        self.request_timeout = request_timeout
+        self.membros: List[str] = [self.worker_id]
+        self._on_event: Optional[Handler] = None
+        self._on_request: Optional[Handler] = None
+        self._pendentes: Dict[str, asyncio.Future] = {}
+        self._saida: Deque[Dict] = deque()
+        self._tem_saida: Optional[asyncio.Event] = None
+        self._tasks: List[asyncio.Task] = []
+        self.stats_counters = {
+            "published": 0,
+            "received": 0,
+            "requests_sent": 0,
+            "requests_served": 0,
+            "request_timeouts": 0,
+            "errors": 0,
+        }
+
+    @property
+    def distribuido(self) -> bool:
+        return False
+
+    def dono(self, chave: str) -> str:
+        """Worker responsável pela chave (chat_id); estável enquanto os membros não mudam"""
+        if len(self.membros) == 1:
+            return self.membros[0]
+        return max(self.membros, key=lambda w: hashlib.sha1(f"{w}|{chave}".encode()).digest())
+
+    def sou_dono(self, chave: str) -> bool:
+        return self.dono(chave) == self.worker_id
+
+    async def start(self, on_event: Handler, on_request: Handler):
+        self._on_event = on_event
+        self._on_request = on_request
+
+    def publish(self, evento: Dict):
+        """Evento para os painéis dos outros workers (não bloqueia)"""
+
+    async def request(self, destino: str, corpo: Dict) -> Any:
+        """Executa `corpo` no worker `destino` e devolve o resultado"""
+        pedido_id = uuid.uuid4().hex
+        futuro = asyncio.get_running_loop().create_future()
+        self._pendentes[pedido_id] = futuro
+        self.stats_counters["requests_sent"] += 1
+        self._enfileirar({"kind": "request", "to": destino, "id": pedido_id, "body": corpo})
+        try:
+            return await asyncio.wait_for(futuro, self.request_timeout)
+        except asyncio.TimeoutError:
+            self.stats_counters["request_timeouts"] += 1
+            raise
+        finally:
+            self._pendentes.pop(pedido_id, None)
+
+    async def set_state(self, chave: str, valor: Any):
+        pass
+
+    async def get_state(self, chave: str) -> Any:
+        return None
+
+    async def close(self):
+        for tarefa in self._tasks:
+            tarefa.cancel()
+            with suppress(asyncio.CancelledError, Exception):
+                await tarefa
+        self._tasks.clear()
+
+    # ---- usado pelos backends distribuídos ----
+
+    def _enfileirar(self, envelope: Dict):
+        envelope["from"] = self.worker_id
+        self._saida.append(envelope)
+        if self._tem_saida is not None:
+            self._tem_saida.set()
+
+    async def _enviar_lote(self, envelopes: List[Dict]):
+        raise NotImplementedError
+
+    async def _escritor(self):
+        """Agrupa o que foi publicado enquanto o envio anterior estava em andamento"""
+        while True:
+            await self._tem_saida.wait()
+            self._tem_saida.clear()
+            while self._saida:
+                lote = list(self._saida)
+                self._saida.clear()
+                try:
+                    await self._enviar_lote(lote)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    self.stats_counters["errors"] += 1
+                    print(f"Erro ao publicar no cluster ({self.name}): {e}")
+
+    async def _receber(self, envelope: Dict):
+        tipo = envelope.get("kind")
+        if envelope.get("from") == self.worker_id:
+            return
+        self.stats_counters["received"] += 1
+        if tipo == "event":
+            await self._on_event(envelope["body"])
+        elif tipo == "request":
+            asyncio.create_task(self._atender(envelope))
+        elif tipo == "reply":
+            futuro = self._pendentes.get(envelope.get("id"))
+            if futuro is not None and not futuro.done():
+                erro = envelope.get("error")
+                if erro:
+                    futuro.set_exception(ErroRemoto(erro.get("status", 500), erro.get("detail", "")))
+                else:
+                    futuro.set_result(envelope.get("body"))
+
+    async def _atender(self, envelope: Dict):
+        resposta = {"kind": "reply", "to": envelope["from"], "id": envelope["id"]}
+        try:
+            resposta["body"] = await self._on_request(envelope["body"])
+        except ErroRemoto as e:
+            resposta["error"] = {"status": e.status, "detail": e.detail}
+        except Exception as e:
+            resposta["error"] = {"status": getattr(e, "status_code", 500), "detail": str(getattr(e, "detail", e))}
+        self.stats_counters["requests_served"] += 1
+        self._enfileirar(resposta)
+
+    def _iniciar_escritor(self):
+        self._tem_saida = asyncio.Event()
+        self._tasks.append(asyncio.create_task(self._escritor()))
+
+    def stats(self) -> Dict:
+        return {
+            "backend": self.name,
+            "worker_id": self.worker_id,
+            "workers": len(self.membros),
+            "members": list(self.membros),
+            **self.stats_counters,
+        }
+
+
+class LocalBus(ClusterBus):
+    """Um processo só: nada a sincronizar"""
+
+    name = "local"
+
+
+class SQLiteBus(ClusterBus):
+    """Tabelas num arquivo SQLite compartilhado, lidas por polling
+
+    Serve para `uvicorn --workers N` numa máquina e como stand-in de um
+    broker em testes. As linhas de mensagens vivem poucos segundos.
+    """
+
+    name = "sqlite"
+    RETENCAO = 60.0
+
+    def __init__(self, path: Path, poll_interval: float = 0.05, **kwargs):
+        super().__init__(**kwargs)
+        self.path = Path(path)
+        self.poll_interval = poll_interval
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._db: Optional[sqlite3.Connection] = None
+        self._ultimo_id = 0
+
+    @property
+    def distribuido(self) -> bool:
+        return True
+
+    def _conn(self) -> sqlite3.Connection:
+        if self._db is None:
+            self._db = sqlite3.connect(str(self.path), check_same_thread=False, timeout=5)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS cluster_mensagens ("
+                " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+                " origem TEXT NOT NULL,"
+                " destino TEXT,"
+                " corpo TEXT NOT NULL,"
+                " criado_em REAL NOT NULL)"
+            )
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS cluster_membros (worker_id TEXT PRIMARY KEY, visto_em REAL NOT NULL)"
+            )
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS cluster_estado (chave TEXT PRIMARY KEY, valor TEXT NOT NULL)"
+            )
+            self._db.commit()
+        return self._db
+
+    async def _run(self, fn, *args):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="cluster")
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, fn, *args)
+
+    def _inicio(self):
+        db = self._conn()
+        self._ultimo_id = db.execute("SELECT COALESCE(MAX(id), 0) FROM cluster_mensagens").fetchone()[0]
+        self._registrar()
+
+    def _registrar(self) -> List[str]:
+        db = self._conn()
+        agora = time.time()
+        with db:
+            db.execute(
+                "INSERT INTO cluster_membros (worker_id, visto_em) VALUES (?, ?) "
+                "ON CONFLICT(worker_id) DO UPDATE SET visto_em = excluded.visto_em",
+                (self.worker_id, agora),
+            )
+            db.execute("DELETE FROM cluster_membros WHERE visto_em < ?", (agora - self.member_ttl,))
+            db.execute("DELETE FROM cluster_mensagens WHERE criado_em < ?", (agora - self.RETENCAO,))
+        return sorted(r[0] for r in db.execute("SELECT worker_id FROM cluster_membros"))
+
+    def _inserir(self, envelopes: List[Dict]):
+        db = self._conn()
+        agora = time.time()
+        with db:
+            db.executemany(
+                "INSERT INTO cluster_mensagens (origem, destino, corpo, criado_em) VALUES (?, ?, ?, ?)",
+                [(self.worker_id, e.get("to"), json.dumps(e, ensure_ascii=False), agora) for e in envelopes],
+            )
+
+    def _novas(self) -> List[Dict]:
+        rows = self._conn().execute(
+            "SELECT id, corpo FROM cluster_mensagens WHERE id > ? AND origem != ? "
+            "AND (destino IS NULL OR destino = ?) ORDER BY id",
+            (self._ultimo_id, self.worker_id, self.worker_id),
+        ).fetchall()
+        if rows:
+            self._ultimo_id = rows[-1][0]
+        return [json.loads(corpo) for _, corpo in rows]
+
+    def _sair(self):
+        db = self._conn()
+        with db:
+            db.execute("DELETE FROM cluster_membros WHERE worker_id = ?", (self.worker_id,))
+        db.close()
+        self._db = None
+
+    def _gravar_estado(self, chave: str, valor: str):
+        db = self._conn()
+        with db:
+            db.execute(
+                "INSERT INTO cluster_estado (chave, valor) VALUES (?, ?) "
+                "ON CONFLICT(chave) DO UPDATE SET valor = excluded.valor",
+                (chave, valor),
+            )
+
+    def _ler_estado(self, chave: str) -> Optional[str]:
+        row = self._conn().execute("SELECT valor FROM cluster_estado WHERE chave = ?", (chave,)).fetchone()
+        return row[0] if row else None
+
+    async def start(self, on_event: Handler, on_request: Handler):
+        await super().start(on_event, on_request)
+        await self._run(self._inicio)
+        self.membros = await self._run(self._registrar)
+        self._iniciar_escritor()
+        self._tasks.append(asyncio.create_task(self._leitor()))
+        self._tasks.append(asyncio.create_task(self._batimentos()))
+
+    async def _leitor(self):
+        while True:
+            try:
+                for envelope in await self._run(self._novas):
+                    try:
+                        await self._receber(envelope)
+                    except Exception as e:
+                        self.stats_counters["errors"] += 1
+                        print(f"Erro ao tratar mensagem do cluster: {e}")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.stats_counters["errors"] += 1
+                print(f"Erro ao ler o cluster: {e}")
+            await asyncio.sleep(self.poll_interval)
+
+    async def _batimentos(self):
+        while True:
+            await asyncio.sleep(self.heartbeat)
+            try:
+                self.membros = await self._run(self._registrar) or [self.worker_id]
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.stats_counters["errors"] += 1
+                print(f"Erro no heartbeat do cluster: {e}")
+
+    def publish(self, evento: Dict):
+        self.stats_counters["published"] += 1
+        self._enfileirar({"kind": "event", "to": None, "body": evento})
+
+    async def _enviar_lote(self, envelopes: List[Dict]):
+        await self._run(self._inserir, envelopes)
+
+    async def set_state(self, chave: str, valor: Any):
+        await self._run(self._gravar_estado, chave, json.dumps(valor, ensure_ascii=False))
+
+    async def get_state(self, chave: str) -> Any:
+        valor = await self._run(self._ler_estado, chave)
+        return json.loads(valor) if valor is not None else None
+
+    async def close(self):
+        await super().close()
+        if self._executor is not None:
+            with suppress(Exception):
+                await self._run(self._sair)
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+
+class RedisBus(ClusterBus):
+    """Redis pub/sub (dependência opcional: pip install redis)"""
+
+    name = "redis"
+    PREFIXO = "sushibot"
+
+    def __init__(self, url: str, **kwargs):
+        super().__init__(**kwargs)
+        try:
+            import redis.asyncio as aioredis
+        except ImportError as e:
+            raise RuntimeError("CLUSTER_BACKEND=redis requer o pacote 'redis' (pip install redis)") from e
+        self._redis = aioredis.from_url(url, decode_responses=True)
+        self._pubsub = None
+
+    @property
+    def distribuido(self) -> bool:
+        return True
+
+    def _canal(self, destino: Optional[str]) -> str:
+        return f"{self.PREFIXO}:w:{destino}" if destino else f"{self.PREFIXO}:todos"
+
+    async def _registrar(self) -> List[str]:
+        chave = f"{self.PREFIXO}:membros"
+        agora = time.time()
+        await self._redis.zadd(chave, {self.worker_id: agora})
+        await self._redis.zremrangebyscore(chave, "-inf", agora - self.member_ttl)
+        return sorted(await self._redis.zrangebyscore(chave, agora - self.member_ttl, "+inf"))
+
+    async def start(self, on_event: Handler, on_request: Handler):
+        await super().start(on_event, on_request)
+        self._pubsub = self._redis.pubsub()
+        await self._pubsub.subscribe(self._canal(None), self._canal(self.worker_id))
+        self.membros = await self._registrar()
+        self._iniciar_escritor()
+        self._tasks.append(asyncio.create_task(self._leitor()))
+        self._tasks.append(asyncio.create_task(self._batimentos()))
+
+    async def _leitor(self):
+        while True:
+            try:
+                msg = await self._pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+                if msg is not None:
+                    await self._receber(json.loads(msg["data"]))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.stats_counters["errors"] += 1
+                print(f"Erro ao ler o cluster: {e}")
+                await asyncio.sleep(1.0)
+
+    async def _batimentos(self):
+        while True:
+            await asyncio.sleep(self.heartbeat)
+            try:
+                self.membros = await self._registrar() or [self.worker_id]
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.stats_counters["errors"] += 1
+                print(f"Erro no heartbeat do cluster: {e}")
+
+    def publish(self, evento: Dict):
+        self.stats_counters["published"] += 1
+        self._enfileirar({"kind": "event", "to": None, "body": evento})
+
+    async def _enviar_lote(self, envelopes: List[Dict]):
+        async with self._redis.pipeline(transaction=False) as pipe:
+            for envelope in envelopes:
+                pipe.publish(self._canal(envelope.get("to")), json.dumps(envelope, ensure_ascii=False))
+            await pipe.execute()
+
+    async def set_state(self, chave: str, valor: Any):
+        await self._redis.hset(f"{self.PREFIXO}:estado", chave, json.dumps(valor, ensure_ascii=False))
+
+    async def get_state(self, chave: str) -> Any:
+        valor = await self._redis.hget(f"{self.PREFIXO}:estado", chave)
+        return json.loads(valor) if valor is not None else None
+
+    async def close(self):
+        await super().close()
+        with suppress(Exception):
+            await self._redis.zrem(f"{self.PREFIXO}:membros", self.worker_id)
+            await self._pubsub.aclose()
+            await self._redis.aclose()
+
+
+def create_bus(kind: Optional[str] = None, base_dir: Optional[Path] = None) -> ClusterBus:
+    """Cria o backend a partir de CLUSTER_BACKEND (local | sqlite | redis)"""
+    kind = (kind or os.getenv("CLUSTER_BACKEND", "local")).lower()
+    opcoes = {
+        "heartbeat": float(os.getenv("CLUSTER_HEARTBEAT", "2")),
+        "request_timeout": float(os.getenv("CLUSTER_REQUEST_TIMEOUT", "15")),
+    }
+    if kind == "local":
+        return LocalBus(**opcoes)
+    if kind == "sqlite":
+        default_path = Path(base_dir or Path(__file__).parent) / "cluster.db"
+        return SQLiteBus(
+            Path(os.getenv("CLUSTER_DB", default_path)),
+            poll_interval=float(os.getenv("CLUSTER_POLL_MS", "50")) / 1000,
+            **opcoes,
+        )
+    if kind == "redis":
+        url = os.getenv("REDIS_URL")
+        if not url:
+            raise RuntimeError("CLUSTER_BACKEND=redis requer REDIS_URL")
+        return RedisBus(url, **opcoes)
+    raise RuntimeError(f"CLUSTER_BACKEND desconhecido: {kind}")
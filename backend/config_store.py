@@ -0,0 +1,203 @@
+"""
+Configuração persistida em config.json
+
+A configuração em uso é um snapshot imutável (MappingProxyType) com número
+de versão; cada alteração monta um snapshot novo e troca a referência de uma
+vez, então quem está no meio de uma mensagem nunca vê metade de um update.
+A gravação sai do event loop, é agrupada (várias alterações seguidas viram
+uma escrita só) e atômica: arquivo temporário na mesma pasta + rename, para
+uma queda no meio não deixar o JSON truncado.
+
+Editar config.json à mão vale sem reiniciar: o arquivo é conferido a cada
+`check_interval` segundos e, se mudou e é um JSON válido, vira o snapshot
+atual (a edição no arquivo vence alterações ainda não gravadas).
+"""
+import asyncio
+import copy
+import json
+import os
+import stat
+import tempfile
+from contextlib import suppress
+from pathlib import Path
+from types import MappingProxyType
+from typing import Any, Awaitable, Callable, Dict, Mapping, Optional, Tuple
+
+Assinatura = Optional[Tuple[int, int]]  # (mtime_ns, tamanho) do arquivo
+
+
+def _assinatura(path: Path) -> Assinatura:
+    try:
+        st = path.stat()
+    except OSError:
+        return None
+    return st.st_mtime_ns, st.st_size
+
+
+class ConfigStore:
+    """Snapshot versionado da configuração + gravação agrupada e recarga do arquivo"""
+
+    def __init__(
+        self,
+        path: Path,
+        defaults: Dict[str, Any],
+        debounce: float = 0.5,
+        check_interval: float = 2.0,
+        on_change: Optional[Callable[[Optional[Mapping], Mapping], None]] = None,
+        on_reload: Optional[Callable[[], Awaitable[None]]] = None,
+    ):
+        self.path = Path(path)
+        self.defaults = defaults
+        self.debounce = debounce
+        self.check_interval = check_interval
+        # on_change(anterior, nova) a cada troca; on_reload depois de recarregar do arquivo
+        self.on_change = on_change
+        self.on_reload = on_reload
+        self.versao = 0
+        self.atual: Mapping[str, Any] = MappingProxyType(copy.deepcopy(defaults))
+        self._assinatura: Assinatura = None
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._lock: Optional[asyncio.Lock] = None
+        self._pendente = False
+        self._watcher: Optional[asyncio.Task] = None
+        self.stats_counters = {"updates": 0, "saves": 0, "save_errors": 0, "reloads": 0, "reload_errors": 0}
+
+    def carregar(self) -> Mapping[str, Any]:
+        """Leitura inicial (síncrona, antes do event loop)"""
+        salvo = self._ler() or {}
+        self._trocar({**copy.deepcopy(self.defaults), **salvo})
+        return self.atual
+
+    def _ler(self) -> Optional[Dict[str, Any]]:
+        """Conteúdo do arquivo; None se não existe ou está inválido"""
+        self._assinatura = _assinatura(self.path)
+        if self._assinatura is None:
+            return None
+        try:
+            with open(self.path) as f:
+                dados = json.load(f)
+        except (OSError, ValueError) as e:
+            self.stats_counters["reload_errors"] += 1
+            print(f"⚠️ {self.path.name} inválido, mantendo a configuração atual: {e}")
+            return None
+        if not isinstance(dados, dict):
+            self.stats_counters["reload_errors"] += 1
+            return None
+        return dados
+
+    def _trocar(self, dados: Dict[str, Any]):
+        anterior = self.atual if self.versao else None
+        self.atual = MappingProxyType(dados)
+        self.versao += 1
+        if self.on_change is not None:
+            self.on_change(anterior, self.atual)
+
+    def update(self, mudancas: Dict[str, Any]) -> Mapping[str, Any]:
+        """Novo snapshot com as mudanças; a gravação fica agendada"""
+        if not mudancas:
+            return self.atual
+        self._trocar({**self.atual, **copy.deepcopy(mudancas)})
+        self.stats_counters["updates"] += 1
+        self._agendar_gravacao()
+        return self.atual
+
+    def _agendar_gravacao(self):
+        self._pendente = True
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # Fora do event loop (scripts, testes): grava na hora
+            self._pendente = False
+            self._gravar_agora(dict(self.atual))
+            return
+        if self._timer is not None:
+            self._timer.cancel()
+        self._timer = loop.call_later(self.debounce, lambda: asyncio.ensure_future(self.flush()))
+
+    async def flush(self):
+        """Grava o snapshot atual se houver alteração pendente"""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            if not self._pendente:
+                return
+            self._pendente = False
+            dados = dict(self.atual)
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(None, self._gravar_agora, dados)
+
+    def _gravar_agora(self, dados: Dict[str, Any]):
+        try:
+            self._assinatura = self._gravar_atomico(dados)
+            self.stats_counters["saves"] += 1
+        except Exception as e:
+            self.stats_counters["save_errors"] += 1
+            print(f"Erro ao salvar config: {e}")
+
+    def _gravar_atomico(self, dados: Dict[str, Any]) -> Assinatura:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        fd, temporario = tempfile.mkstemp(dir=self.path.parent, prefix=f".{self.path.name}.", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(dados, f, indent=2)
+                f.flush()
+                os.fsync(f.fileno())
+            if self.path.exists():
+                # Mantém as permissões do original (o arquivo guarda API keys)
+                os.chmod(temporario, stat.S_IMODE(self.path.stat().st_mode))
+            os.replace(temporario, self.path)
+        except BaseException:
+            with suppress(OSError):
+                os.unlink(temporario)
+            raise
+        return _assinatura(self.path)
+
+    async def recarregar_se_mudou(self) -> bool:
+        """Arquivo alterado por fora desde a última leitura/gravação: recarrega"""
+        if self._lock is not None and self._lock.locked():
+            return False  # a mudança é a nossa própria gravação em andamento
+        if _assinatura(self.path) == self._assinatura:
+            return False
+        salvo = self._ler()
+        if salvo is None:
+            return False
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        self._pendente = False
+        self._trocar({**copy.deepcopy(self.defaults), **salvo})
+        self.stats_counters["reloads"] += 1
+        print(f"🔄 {self.path.name} alterado no disco, configuração recarregada (versão {self.versao})")
+        if self.on_reload is not None:
+            await self.on_reload()
+        return True
+
+    async def _vigiar(self):
+        while True:
+            await asyncio.sleep(self.check_interval)
+            try:
+                await self.recarregar_se_mudou()
+            except Exception as e:
+                print(f"Erro ao recarregar config: {e}")
+
+    def start(self):
+        if self._watcher is None and self.check_interval > 0:
+            self._watcher = asyncio.create_task(self._vigiar())
+
+    async def stop(self):
+        if self._watcher is not None:
+            self._watcher.cancel()
+            with suppress(asyncio.CancelledError):
+                await self._watcher
+            self._watcher = None
+        await self.flush()
+
+    def stats(self) -> Dict:
+        return {
+            "versao": self.versao,
+            "pending_save": self._pendente,
+            **self.stats_counters,
+        }
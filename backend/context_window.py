@@ -0,0 +1,78 @@
+"""
+Janela de contexto por orçamento de tokens
+
+Em vez de um número fixo de mensagens, o histórico enviado à IA é escolhido
+do mais recente para o mais antigo até encher o orçamento (limitado também
+pela janela de contexto do modelo). O que fica de fora entra como resumo
+acumulado no prompt de sistema; o resumo é gerado em segundo plano.
+"""
+from typing import Dict, List, Optional
+
+from prompt_registry import estimar_tokens
+
+# max_tokens pedido aos provedores: espaço reservado para a resposta
+RESERVA_RESPOSTA = 500
+# Papel/separadores de cada mensagem no formato de chat
+TOKENS_POR_MENSAGEM = 4
+CONTEXTO_PADRAO = 8192
+
+
+def tokens_mensagem(msg: Dict) -> int:
+    """Tokens de uma entrada do historico_ia (usa o valor gravado, se houver)"""
+    tokens = msg.get("tokens")
+    if tokens is None:
+        tokens = estimar_tokens(msg.get("content") or "")
+    return tokens + TOKENS_POR_MENSAGEM
+
+
+def entrada_historico(role: str, content: str) -> Dict:
+    return {"role": role, "content": content, "tokens": estimar_tokens(content)}
+
+
+def tokens_historico(historico: List[Dict]) -> int:
+    return sum(tokens_mensagem(m) for m in historico)
+
+
+def prompt_com_resumo(system_prompt: str, resumo: Optional[str]) -> str:
+    if not resumo:
+        return system_prompt
+    return f"{system_prompt}\n\n📋 RESUMO DA CONVERSA ATÉ AQUI (mensagens mais antigas):\n{resumo}"
+
+
+def montar_mensagens(
+    system_prompt: str,
+    historico: List[Dict],
+    mensagem: str,
+    contexto_modelo: Optional[int],
+    orcamento: int,
+) -> List[Dict]:
+    """Mensagens no formato de chat cabendo no orçamento e na janela do modelo"""
+    limite = (contexto_modelo or CONTEXTO_PADRAO) - RESERVA_RESPOSTA
+    livre = limite - estimar_tokens(system_prompt) - TOKENS_POR_MENSAGEM
+
+    # A mensagem atual sempre vai; se sozinha estoura a janela, é cortada
+    tokens_atual = estimar_tokens(mensagem) + TOKENS_POR_MENSAGEM
+    if tokens_atual > livre:
+        mensagem = mensagem[:max(0, int((livre - TOKENS_POR_MENSAGEM) * 3.5))]
+        tokens_atual = livre
+    disponivel = max(0, min(orcamento, livre - tokens_atual))
+
+    selecionadas: List[Dict] = []
+    usado = 0
+    for msg in reversed(historico):
+        tokens = tokens_mensagem(msg)
+        if usado + tokens > disponivel:
+            break
+        usado += tokens
+        selecionadas.append(msg)
+    selecionadas.reverse()
+    # Não começa com uma resposta do bot sem a pergunta que a originou
+    if selecionadas and selecionadas[0]["role"] != "user":
+        selecionadas = selecionadas[1:]
+
+    mensagens = [{"role": "system", "content": system_prompt}]
+    for msg in selecionadas:
+        role = "user" if msg["role"] == "user" else "assistant"
+        mensagens.append({"role": role, "content": msg["content"]})
+    mensagens.append({"role": "user", "content": mensagem})
+    return mensagens
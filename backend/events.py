@@ -0,0 +1,233 @@
+"""
+Stream de eventos do painel (WebSocket)
+
+Cada evento recebe um número de sequência monotônico e fica num ring
+buffer limitado. Um painel que reconecta informa a última sequência vista
+(`resume`) e recebe só os eventos perdidos; se eles já saíram do buffer
+(ou o servidor reiniciou), recebe um snapshot compacto novo.
+
+O envio passa pelo BroadcastHub: cada cliente tem fila limitada e task
+escritora própria, então um celular lento não atrasa o webhook nem os
+outros painéis.
+"""
+import asyncio
+import json
+import time
+import uuid
+from collections import deque
+from typing import Callable, Deque, Dict, List, Optional, Tuple
+
+# 2: status_update traz só os campos do status que mudaram
+PROTOCOL_VERSION = 2
+
+
+class EventStream:
+    """Sequencia eventos e guarda os últimos `replay_size` para resume"""
+
+    def __init__(self, replay_size: int = 1000):
+        self.epoch = uuid.uuid4().hex[:8]
+        self.seq = 0
+        self._buffer: Deque[Dict] = deque(maxlen=replay_size)
+
+    def publish(self, message: Dict) -> Dict:
+        """Numera o evento e guarda no buffer de replay"""
+        self.seq += 1
+        event = {**message, "seq": self.seq}
+        self._buffer.append(event)
+        return event
+
+    def since(self, seq: int) -> Optional[List[Dict]]:
+        """Eventos depois de `seq`, ou None se algum já foi descartado"""
+        if seq > self.seq:
+            return None
+        if seq == self.seq:
+            return []
+        if not self._buffer or self._buffer[0]["seq"] > seq + 1:
+            return None
+        # O buffer é contíguo: o evento seq+1 está numa posição conhecida
+        inicio = seq + 1 - self._buffer[0]["seq"]
+        return list(self._buffer)[inicio:]
+
+    def parse_resume(self, epoch: Optional[str], seq: Optional[int]) -> Optional[int]:
+        """Sequência de resume válida para esta instância, ou None"""
+        if epoch != self.epoch or seq is None or seq < 0:
+            return None
+        return seq
+
+    def stats(self) -> Dict:
+        return {
+            "epoch": self.epoch,
+            "seq": self.seq,
+            "buffered": len(self._buffer),
+            "replay_size": self._buffer.maxlen,
+        }
+
+
+def dumps_event(message: Dict) -> str:
+    """Serializa um evento uma única vez (mesmo formato do send_json)"""
+    return json.dumps(message, ensure_ascii=False, separators=(",", ":"))
+
+
+class ClientConnection:
+    """Um painel conectado: fila de saída própria e task escritora dedicada"""
+
+    def __init__(self, websocket, max_queue: int, hub: "BroadcastHub", send_timeout: float = 10.0):
+        self.websocket = websocket
+        self.max_queue = max_queue
+        self.send_timeout = send_timeout
+        self.hub = hub
+        self._queue: Deque[Tuple[str, float]] = deque()
+        # Itens do backlog inicial ainda na frente da fila (fora do limite)
+        self._backlog = 0
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self.overflowed = False
+        self.closed = False
+        self.sent = 0
+        self.latency_ms_avg = 0.0
+        self.latency_ms_max = 0.0
+
+    def start(self, backlog: List[str]):
+        # O backlog inicial (snapshot/replay) entra sem contar no limite
+        agora = time.perf_counter()
+        self._queue.extend((text, agora) for text in backlog)
+        self._backlog = len(backlog)
+        self._wakeup.set()
+        self._task = asyncio.create_task(self._writer())
+
+    def offer(self, text: str, enqueued_at: float) -> bool:
+        """Enfileira sem bloquear; False se o cliente estourou a fila"""
+        if self.closed or self.overflowed:
+            return False
+        if len(self._queue) - self._backlog >= self.max_queue:
+            # Cliente lento: descarta o acumulado; ele reconecta com resume
+            # e recebe de uma vez o replay (ou um snapshot novo)
+            self.overflowed = True
+            self._queue.clear()
+            self._backlog = 0
+            self._wakeup.set()
+            self.hub.unregister(self)
+            return False
+        self._queue.append((text, enqueued_at))
+        self._wakeup.set()
+        return True
+
+    async def _writer(self):
+        try:
+            while True:
+                await self._wakeup.wait()
+                self._wakeup.clear()
+                if self.overflowed:
+                    await self._send(dumps_event({"type": "overflow"}))
+                    await self.websocket.close(code=4000)
+                    return
+                while self._queue and not self.overflowed:
+                    text, enqueued_at = self._queue.popleft()
+                    if self._backlog:
+                        self._backlog -= 1
+                    await self._send(text)
+                    self._record(time.perf_counter() - enqueued_at)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            pass
+        finally:
+            self.closed = True
+            self.hub.unregister(self)
+
+    async def _send(self, text: str):
+        # Socket travado (celular sem sinal) não pode prender a task para sempre
+        await asyncio.wait_for(self.websocket.send_text(text), timeout=self.send_timeout)
+
+    def _record(self, seconds: float):
+        ms = seconds * 1000
+        self.sent += 1
+        self.latency_ms_avg += (ms - self.latency_ms_avg) * 0.1
+        self.latency_ms_max = max(self.latency_ms_max, ms)
+        self.hub._latencias.append(ms)
+        if self.hub.on_delivery is not None:
+            self.hub.on_delivery(seconds)
+
+    async def stop(self):
+        self.closed = True
+        if self._task is not None and self._task is not asyncio.current_task():
+            self._task.cancel()
+            try:
+                await self._task
+            except (asyncio.CancelledError, Exception):
+                pass
+
+    def stats(self) -> Dict:
+        return {
+            "queued": len(self._queue),
+            "sent": self.sent,
+            "latency_ms_avg": round(self.latency_ms_avg, 2),
+            "latency_ms_max": round(self.latency_ms_max, 2),
+        }
+
+
+class BroadcastHub:
+    """Fan-out não bloqueante: publish só enfileira; cada cliente escreve no seu ritmo"""
+
+    def __init__(self, max_queue: int = 256, send_timeout: float = 10.0):
+        self.max_queue = max_queue
+        self.send_timeout = send_timeout
+        self.clients: List[ClientConnection] = []
+        self._latencias: Deque[float] = deque(maxlen=2000)
+        self.published = 0
+        self.dropped_clients = 0
+        # Chamado com a latência (segundos) de cada entrega; usado pelas métricas
+        self.on_delivery: Optional[Callable[[float], None]] = None
+
+    def __len__(self):
+        return len(self.clients)
+
+    def register(self, websocket, backlog: List[Dict]) -> ClientConnection:
+        client = ClientConnection(websocket, self.max_queue, self, self.send_timeout)
+        self.clients.append(client)
+        client.start([dumps_event(m) for m in backlog])
+        return client
+
+    def unregister(self, client: ClientConnection):
+        try:
+            self.clients.remove(client)
+        except ValueError:
+            pass
+
+    def publish(self, message: Dict):
+        """Serializa uma vez e enfileira para todos os clientes"""
+        text = dumps_event(message)
+        agora = time.perf_counter()
+        self.published += 1
+        for client in list(self.clients):
+            if client.overflowed:
+                continue
+            if not client.offer(text, agora) and client.overflowed:
+                self.dropped_clients += 1
+
+    def send_to(self, client: ClientConnection, message: Dict):
+        client.offer(dumps_event(message), time.perf_counter())
+
+    async def close(self):
+        for client in list(self.clients):
+            await client.stop()
+        self.clients.clear()
+
+    def stats(self) -> Dict:
+        latencias = sorted(self._latencias)
+
+        def pct(p):
+            if not latencias:
+                return 0.0
+            return round(latencias[min(len(latencias) - 1, int(len(latencias) * p))], 2)
+
+        return {
+            "clients": len(self.clients),
+            "published": self.published,
+            "dropped_slow_clients": self.dropped_clients,
+            "fanout_latency_ms_p50": pct(0.50),
+            "fanout_latency_ms_p95": pct(0.95),
+            "fanout_latency_ms_max": round(latencias[-1], 2) if latencias else 0.0,
+            "max_queue": self.max_queue,
+            "per_client": [c.stats() for c in self.clients],
+        }
@@ -0,0 +1,141 @@
+"""
+Pool HTTP compartilhado do backend (aiohttp)
+
+Uma única ClientSession vive enquanto o app estiver de pé: é criada no
+startup, fechada no shutdown e reaproveita conexões keep-alive para a
+OpenRouter e para o bot Node.js em vez de abrir TCP+TLS a cada mensagem.
+"""
+import os
+from typing import Optional
+
+import aiohttp
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+class HttpPool:
+    """Sessão aiohttp de longa duração com contadores de reuso de conexão"""
+
+    def __init__(
+        self,
+        limit: int = 100,
+        limit_per_host: int = 20,
+        keepalive_timeout: float = 30.0,
+        dns_ttl: int = 300,
+        connect_timeout: float = 5.0,
+    ):
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.keepalive_timeout = keepalive_timeout
+        self.dns_ttl = dns_ttl
+        self.connect_timeout = connect_timeout
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._stats = {
+            "requests": 0,
+            "errors": 0,
+            "pool_hits": 0,       # conexão keep-alive reaproveitada
+            "pool_misses": 0,     # nova conexão TCP(+TLS) aberta
+            "dns_cache_hits": 0,
+            "dns_cache_misses": 0,
+        }
+
+    @classmethod
+    def from_env(cls) -> "HttpPool":
+        """Cria o pool lendo limites e timeouts das variáveis HTTP_*"""
+        return cls(
+            limit=_env_int("HTTP_POOL_LIMIT", 100),
+            limit_per_host=_env_int("HTTP_POOL_LIMIT_PER_HOST", 20),
+            keepalive_timeout=_env_float("HTTP_KEEPALIVE_TIMEOUT", 30.0),
+            dns_ttl=_env_int("HTTP_DNS_TTL", 300),
+            connect_timeout=_env_float("HTTP_CONNECT_TIMEOUT", 5.0),
+        )
+
+    def _trace_config(self) -> aiohttp.TraceConfig:
+        trace = aiohttp.TraceConfig()
+
+        async def on_request_start(session, ctx, params):
+            self._stats["requests"] += 1
+
+        async def on_request_exception(session, ctx, params):
+            self._stats["errors"] += 1
+
+        async def on_connection_create_start(session, ctx, params):
+            self._stats["pool_misses"] += 1
+
+        async def on_connection_reuseconn(session, ctx, params):
+            self._stats["pool_hits"] += 1
+
+        async def on_dns_cache_hit(session, ctx, params):
+            self._stats["dns_cache_hits"] += 1
+
+        async def on_dns_cache_miss(session, ctx, params):
+            self._stats["dns_cache_misses"] += 1
+
+        trace.on_request_start.append(on_request_start)
+        trace.on_request_exception.append(on_request_exception)
+        trace.on_connection_create_start.append(on_connection_create_start)
+        trace.on_connection_reuseconn.append(on_connection_reuseconn)
+        trace.on_dns_cache_hit.append(on_dns_cache_hit)
+        trace.on_dns_cache_miss.append(on_dns_cache_miss)
+        return trace
+
+    async def start(self):
+        """Abre a sessão (idempotente)"""
+        if self._session is not None and not self._session.closed:
+            return
+        connector = aiohttp.TCPConnector(
+            limit=self.limit,
+            limit_per_host=self.limit_per_host,
+            keepalive_timeout=self.keepalive_timeout,
+            ttl_dns_cache=self.dns_ttl,
+            use_dns_cache=True,
+        )
+        self._session = aiohttp.ClientSession(
+            connector=connector,
+            timeout=aiohttp.ClientTimeout(total=None, sock_connect=self.connect_timeout),
+            trace_configs=[self._trace_config()],
+        )
+
+    async def close(self):
+        """Fecha a sessão e todas as conexões abertas"""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    async def session(self) -> aiohttp.ClientSession:
+        """Retorna a sessão compartilhada, abrindo-a se ainda não existir"""
+        if self._session is None or self._session.closed:
+            await self.start()
+        return self._session
+
+    def timeout(self, total: float) -> aiohttp.ClientTimeout:
+        """Timeout por requisição respeitando o connect timeout do pool"""
+        return aiohttp.ClientTimeout(total=total, sock_connect=self.connect_timeout)
+
+    def stream_timeout(self, idle: float) -> aiohttp.ClientTimeout:
+        """Timeout para respostas em streaming: sem limite total, só entre leituras"""
+        return aiohttp.ClientTimeout(total=None, sock_connect=self.connect_timeout, sock_read=idle)
+
+    def stats(self) -> dict:
+        hits = self._stats["pool_hits"]
+        misses = self._stats["pool_misses"]
+        total = hits + misses
+        return {
+            **self._stats,
+            "pool_hit_rate": round(hits / total, 3) if total else 0.0,
+            "open": self._session is not None and not self._session.closed,
+            "limit": self.limit,
+            "limit_per_host": self.limit_per_host,
+        }
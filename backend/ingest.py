@@ -0,0 +1,90 @@
+"""
+Entrada idempotente de mensagens do WhatsApp
+
+O bot Node.js reenvia o webhook quando o backend demora (timeout do axios).
+Sem deduplicação cada reenvio virava mensagem repetida no histórico, outra
+chamada à IA e outra resposta para o cliente. Aqui cada mensagem é
+identificada pelo ID do WhatsApp: um reenvio durante o processamento espera
+o resultado do original, e um reenvio depois recebe o mesmo resultado,
+guardado por uma janela de tempo (índice limitado em tamanho).
+
+Também gera os IDs das mensagens gravadas: crescentes e sem colisão mesmo
+com várias mensagens no mesmo microssegundo ou vários workers.
+"""
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict
+
+
+class IdGenerator:
+    """IDs `<prefixo>_<microssegundos>[_<nó>]` estritamente crescentes no processo"""
+
+    def __init__(self, node: str = ""):
+        self.node = node
+        self._ultimo = 0
+        self._lock = threading.Lock()
+
+    def next(self, prefixo: str) -> str:
+        with self._lock:
+            # Relógio andou para trás (NTP) ou mesma marca: segue do último
+            self._ultimo = max(self._ultimo + 1, time.time_ns() // 1000)
+            valor = self._ultimo
+        return f"{prefixo}_{valor}_{self.node}" if self.node else f"{prefixo}_{valor}"
+
+
+class DedupIndex:
+    """Resultado por chave durante `ttl` segundos; no máximo `max_size` chaves"""
+
+    def __init__(self, ttl: float = 600.0, max_size: int = 10000):
+        self.ttl = ttl
+        self.max_size = max_size
+        # chave -> (expira_em, futuro com o resultado)
+        self._entradas: "OrderedDict[str, tuple]" = OrderedDict()
+        self.stats_counters = {"processed": 0, "replayed": 0, "joined": 0, "failed": 0, "evicted": 0}
+
+    def __len__(self):
+        return len(self._entradas)
+
+    def _expirar(self, agora: float):
+        for chave in list(self._entradas):
+            expira_em, futuro = self._entradas[chave]
+            if expira_em > agora and len(self._entradas) <= self.max_size:
+                break
+            if not futuro.done():
+                continue  # em andamento: os reenvios ainda precisam encontrá-la
+            del self._entradas[chave]
+            self.stats_counters["evicted"] += 1
+
+    async def run(self, chave: str, fn: Callable[[], Awaitable[Any]]) -> tuple:
+        """(resultado, é_repetição); exceções não ficam guardadas (o reenvio tenta de novo)"""
+        agora = time.monotonic()
+        entrada = self._entradas.get(chave)
+        if entrada is not None and entrada[0] > agora:
+            futuro = entrada[1]
+            self.stats_counters["joined" if not futuro.done() else "replayed"] += 1
+            return await asyncio.shield(futuro), True
+
+        futuro = asyncio.get_running_loop().create_future()
+        self._entradas[chave] = (agora + self.ttl, futuro)
+        self._entradas.move_to_end(chave)
+        self._expirar(agora)
+        try:
+            resultado = await fn()
+        except BaseException as e:
+            self.stats_counters["failed"] += 1
+            if self._entradas.get(chave, (None, None))[1] is futuro:
+                del self._entradas[chave]
+            if isinstance(e, asyncio.CancelledError):
+                futuro.cancel()
+            else:
+                futuro.set_exception(e)
+                futuro.exception()  # sem ninguém esperando não gera aviso
+            raise
+        self.stats_counters["processed"] += 1
+        futuro.set_result(resultado)
+        return resultado, False
+
+    def stats(self) -> Dict:
+        return {"size": len(self._entradas), "ttl": self.ttl, **self.stats_counters}
@@ -0,0 +1,119 @@
+"""
+Detecção de intenções por palavras-chave
+
+Todas as listas (desconfiança, pedido de atendente...) são compiladas num
+único índice de frases, consultado uma vez por mensagem sobre o texto sem
+acentos e por palavras inteiras. Assim "bot" não casa com "botão" nem
+"real" com "realmente", e a lista pode ser trocada pelo painel sem
+reiniciar.
+
+Palavra terminada em `*` casa como prefixo: "golp*" pega "golpes" e
+"golpista". As listas padrão usam radicais assim para não perder plurais
+e flexões ("fraudes", "atendentes", "humanos").
+"""
+import unicodedata
+from typing import Dict, Iterable, List, Set, Tuple
+
+DEFAULT_INTENTS: Dict[str, List[str]] = {
+    "desconfianca": [
+        "golp*", "confia*", "fake*", "pix antes", "site seguro", "fraud*", "verdade*",
+        "mentir*", "engana*", "roub*", "fals*", "scam*",
+    ],
+    "pedido_humano": [
+        "atendent*", "human*", "pessoa*", "real", "alguém", "funcionári*", "gerent*",
+        "falar com alguém", "não é robô", "bot", "bots", "robozinho", "máquina*", "quero falar",
+    ],
+}
+
+# Tabela de bytes: a-z e 0-9 ficam, o resto vira espaço
+_SO_ALFANUMERICO = bytes(c if 48 <= c <= 57 or 97 <= c <= 122 else 32 for c in range(256))
+_VAZIO: Set[str] = frozenset()
+
+
+def fold(texto: str) -> str:
+    """Minúsculas, sem acentos e com pontuação trocada por espaço"""
+    texto = texto.lower()
+    if not texto.isascii():
+        # NFKD separa letra e acento; o encode abaixo descarta acentos e emojis
+        texto = unicodedata.normalize("NFKD", texto)
+    return texto.encode("ascii", "ignore").translate(_SO_ALFANUMERICO).decode("ascii")
+
+
+class IntentMatcher:
+    """Índice de palavras e frases -> intenções
+
+    Palavras soltas saem de uma interseção de conjuntos; frases só são
+    conferidas nas posições onde aparece a primeira palavra delas. O custo
+    depende do tamanho da mensagem, não de quantas palavras-chave existem.
+    """
+
+    def __init__(self, intents: Dict[str, Iterable[str]]):
+        self.versao = 0
+        self.reload(intents)
+
+    def reload(self, intents: Dict[str, Iterable[str]]):
+        simples: Dict[str, Set[str]] = {}
+        frases: Dict[Tuple[str, ...], Set[str]] = {}
+        prefixos: Dict[Tuple[str, ...], Set[str]] = {}
+        keywords: Dict[str, List[str]] = {}
+        for intencao, palavras in intents.items():
+            palavras = [p.strip() for p in palavras if p and p.strip()]
+            keywords[intencao] = palavras
+            for palavra in palavras:
+                termos = tuple(fold(palavra.rstrip("*")).split())
+                if not termos:
+                    continue
+                if palavra.endswith("*"):
+                    destino = prefixos  # último termo casa como prefixo
+                elif len(termos) == 1:
+                    destino, termos = simples, termos[0]
+                else:
+                    destino = frases
+                destino.setdefault(termos, set()).add(intencao)
+        # Monta tudo antes de trocar: quem está no meio de um match vê o índice antigo inteiro
+        self._simples = simples
+        self._frases = frases
+        self._primeiras = {t[0] for t in frases}
+        self._tamanhos = sorted({len(t) for t in frases})
+        # Radicais de uma palavra (o caso comum) vão por um dict só; os de frase
+        # ("quero fal*") conferem a janela de palavras como antes
+        self._radicais = {t[0]: i for t, i in prefixos.items() if len(t) == 1}
+        self._tamanhos_radical = sorted({len(r) for r in self._radicais})
+        # Filtro barato: a maioria das palavras não começa como nenhum radical
+        menor = self._tamanhos_radical[0] if self._radicais else 0
+        self._inicios = {r[:menor] for r in self._radicais}
+        self._prefixos = {t: i for t, i in prefixos.items() if len(t) > 1}
+        self._tamanhos_prefixo = sorted({(len(t), len(t[-1])) for t in self._prefixos})
+        self.keywords = keywords
+        self.versao += 1
+
+    def match(self, texto: str) -> Set[str]:
+        """Intenções presentes na mensagem (uma passada só)"""
+        palavras = fold(texto).split()
+        encontradas: Set[str] = set()
+        for palavra in self._simples.keys() & palavras:
+            encontradas |= self._simples[palavra]
+        if self._primeiras:
+            for i, palavra in enumerate(palavras):
+                if palavra in self._primeiras:
+                    for n in self._tamanhos:
+                        encontradas |= self._frases.get(tuple(palavras[i:i + n]), _VAZIO)
+        if self._radicais:
+            menor = self._tamanhos_radical[0]
+            for palavra in set(palavras):
+                if palavra[:menor] not in self._inicios:
+                    continue
+                for k in self._tamanhos_radical:
+                    if k > len(palavra):
+                        break
+                    intencoes = self._radicais.get(palavra[:k])
+                    if intencoes is not None:
+                        encontradas |= intencoes
+        if self._prefixos:
+            for i in range(len(palavras)):
+                for n, k in self._tamanhos_prefixo:
+                    janela = palavras[i:i + n]
+                    if len(janela) == n:
+                        chave = (*janela[:-1], janela[-1][:k])
+                        encontradas |= self._prefixos.get(chave, _VAZIO)
+        return encontradas
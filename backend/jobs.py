@@ -0,0 +1,219 @@
+"""
+Fila de jobs com pool de workers
+
+O webhook só enfileira e responde na hora; os workers executam o handler
+(gerar resposta com IA e enviar pelo bot) em segundo plano. Jobs com
+prioridade menor saem primeiro (ex.: primeiro contato de um cliente).
+"""
+import asyncio
+import itertools
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional
+
+PRIORIDADE_ALTA = 0
+PRIORIDADE_NORMAL = 1
+
+
+def _percentil(valores: Deque[float], p: float) -> float:
+    if not valores:
+        return 0.0
+    ordenados = sorted(valores)
+    return round(ordenados[min(len(ordenados) - 1, int(len(ordenados) * p))], 2)
+
+
+class JobQueue:
+    """asyncio.PriorityQueue limitada + N workers, com métricas de espera e execução"""
+
+    def __init__(
+        self,
+        handler: Callable[[Dict], Awaitable[Any]],
+        workers: int = 4,
+        max_size: int = 1000,
+        name: str = "jobs",
+    ):
+        self.handler = handler
+        self.workers = workers
+        self.max_size = max_size
+        self.name = name
+        self._queue: Optional[asyncio.PriorityQueue] = None
+        self._ordem = itertools.count()  # FIFO dentro da mesma prioridade
+        self._tasks: List[asyncio.Task] = []
+        self._espera_ms: Deque[float] = deque(maxlen=1000)
+        self._execucao_ms: Deque[float] = deque(maxlen=1000)
+        self.in_flight = 0
+        self.stats_counters = {"submitted": 0, "processed": 0, "failed": 0, "rejected": 0}
+
+    @property
+    def depth(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def start(self):
+        if self._queue is None:
+            self._queue = asyncio.PriorityQueue(maxsize=self.max_size)
+        while len(self._tasks) < self.workers:
+            self._tasks.append(asyncio.create_task(self._worker(len(self._tasks))))
+
+    def submit(self, job: Dict, priority: int = PRIORIDADE_NORMAL) -> bool:
+        """Enfileira sem bloquear; False se a fila estiver cheia"""
+        if self._queue is None:
+            self.start()
+        try:
+            self._queue.put_nowait((priority, next(self._ordem), time.perf_counter(), job))
+        except asyncio.QueueFull:
+            self.stats_counters["rejected"] += 1
+            return False
+        self.stats_counters["submitted"] += 1
+        return True
+
+    async def _worker(self, indice: int):
+        while True:
+            _, _, enfileirado_em, job = await self._queue.get()
+            inicio = time.perf_counter()
+            self._espera_ms.append((inicio - enfileirado_em) * 1000)
+            self.in_flight += 1
+            try:
+                await self.handler(job)
+                self.stats_counters["processed"] += 1
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.stats_counters["failed"] += 1
+                print(f"Erro no worker {self.name}#{indice}: {e}")
+            finally:
+                self.in_flight -= 1
+                self._execucao_ms.append((time.perf_counter() - inicio) * 1000)
+                self._queue.task_done()
+
+    async def stop(self, timeout: float = 5.0):
+        """Espera a fila esvaziar (até `timeout`) e encerra os workers"""
+        if self._queue is not None and self._tasks:
+            try:
+                await asyncio.wait_for(self._queue.join(), timeout=timeout)
+            except asyncio.TimeoutError:
+                print(f"⚠️ {self.name}: {self.depth} jobs descartados no shutdown")
+        for task in self._tasks:
+            task.cancel()
+        for task in self._tasks:
+            try:
+                await task
+            except (asyncio.CancelledError, Exception):
+                pass
+        self._tasks.clear()
+        self._queue = None
+
+    def stats(self) -> Dict:
+        return {
+            "workers": self.workers,
+            "depth": self.depth,
+            "max_size": self.max_size,
+            "in_flight": self.in_flight,
+            **self.stats_counters,
+            "wait_ms_p50": _percentil(self._espera_ms, 0.50),
+            "wait_ms_p95": _percentil(self._espera_ms, 0.95),
+            "run_ms_p50": _percentil(self._execucao_ms, 0.50),
+            "run_ms_p95": _percentil(self._execucao_ms, 0.95),
+        }
+
+
+class ChatCoalescer:
+    """Junta rajadas de mensagens do mesmo chat em um único job
+
+    Cada chat tem no máximo um job na fila ou em execução, então o histórico
+    nunca é atualizado em paralelo. Mensagens que chegam durante a geração
+    esperam o job atual terminar e formam a próxima rajada.
+    """
+
+    def __init__(self, queue: JobQueue, window: Callable[[], float], max_wait_factor: float = 3.0):
+        self.queue = queue
+        self.window = window  # segundos; lido a cada mensagem (config pode mudar)
+        self.max_wait_factor = max_wait_factor
+        self._pendentes: Dict[str, List[str]] = {}
+        self._inicio_rajada: Dict[str, float] = {}
+        self._prioridade: Dict[str, int] = {}
+        self._timers: Dict[str, asyncio.TimerHandle] = {}
+        self._ativos: set = set()
+        self._adiados: Dict[str, float] = {}  # chat_id -> quando pode disparar de novo
+        self.stats_counters = {"messages": 0, "jobs": 0, "coalesced": 0, "rejected": 0, "deferred": 0}
+
+    def add(self, chat_id: str, mensagem: str, priority: int = PRIORIDADE_NORMAL):
+        self.stats_counters["messages"] += 1
+        self._pendentes.setdefault(chat_id, []).append(mensagem)
+        self._inicio_rajada.setdefault(chat_id, time.monotonic())
+        self._prioridade[chat_id] = min(priority, self._prioridade.get(chat_id, priority))
+        if chat_id not in self._ativos and chat_id not in self._adiados:
+            self._agendar(chat_id)
+
+    def _agendar(self, chat_id: str):
+        timer = self._timers.pop(chat_id, None)
+        if timer is not None:
+            timer.cancel()
+        janela = max(0.0, self.window())
+        # Quem manda mensagens sem parar também recebe resposta: limite de espera
+        limite = self._inicio_rajada[chat_id] + janela * self.max_wait_factor
+        atraso = min(janela, limite - time.monotonic())
+        if atraso <= 0:
+            self._disparar(chat_id)
+        else:
+            self._timers[chat_id] = asyncio.get_running_loop().call_later(atraso, self._disparar, chat_id)
+
+    def _disparar(self, chat_id: str):
+        self._timers.pop(chat_id, None)
+        self._adiados.pop(chat_id, None)
+        if chat_id in self._ativos or not self._pendentes.get(chat_id):
+            return
+        self._ativos.add(chat_id)
+        prioridade = self._prioridade.pop(chat_id, PRIORIDADE_NORMAL)
+        if not self.queue.submit({"chat_id": chat_id}, priority=prioridade):
+            self._ativos.discard(chat_id)
+            descartadas = self._pendentes.pop(chat_id, [])
+            self._inicio_rajada.pop(chat_id, None)
+            self.stats_counters["rejected"] += len(descartadas)
+            print(f"⚠️ Fila de respostas cheia, {len(descartadas)} mensagem(ns) de {chat_id} sem resposta")
+            return
+        self.stats_counters["jobs"] += 1
+
+    def take(self, chat_id: str) -> List[str]:
+        """Chamado pelo worker: pega a rajada acumulada do chat"""
+        mensagens = self._pendentes.pop(chat_id, [])
+        self._inicio_rajada.pop(chat_id, None)
+        if len(mensagens) > 1:
+            self.stats_counters["coalesced"] += len(mensagens) - 1
+        return mensagens
+
+    def is_busy(self, chat_id: str) -> bool:
+        """Rajada esperando a janela, na fila ou em execução"""
+        return chat_id in self._ativos or chat_id in self._pendentes
+
+    def defer(self, chat_id: str, mensagens: List[str], atraso: float):
+        """Chamado pelo worker: devolve a rajada sem resposta para daqui a `atraso` s
+
+        O que chegar nesse meio tempo se junta a ela; sai tudo numa geração só.
+        """
+        self._pendentes[chat_id] = mensagens + self._pendentes.get(chat_id, [])
+        self._inicio_rajada.setdefault(chat_id, time.monotonic())
+        self._adiados[chat_id] = time.monotonic() + atraso
+        self.stats_counters["deferred"] += 1
+
+    def done(self, chat_id: str):
+        """Chamado pelo worker ao terminar: agenda a próxima rajada, se houver"""
+        self._ativos.discard(chat_id)
+        if chat_id in self._adiados:
+            atraso = max(0.0, self._adiados[chat_id] - time.monotonic())
+            self._timers[chat_id] = asyncio.get_running_loop().call_later(atraso, self._disparar, chat_id)
+        elif self._pendentes.get(chat_id):
+            self._agendar(chat_id)
+
+    def cancel(self):
+        for timer in self._timers.values():
+            timer.cancel()
+        self._timers.clear()
+
+    def stats(self) -> Dict:
+        return {
+            "window_ms": round(self.window() * 1000),
+            "waiting_chats": len(self._pendentes),
+            "deferred_chats": len(self._adiados),
+            "active_chats": len(self._ativos),
+            **self.stats_counters,
+        }
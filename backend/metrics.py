@@ -0,0 +1,171 @@
+"""
+Métricas no formato texto do Prometheus
+
+Implementação mínima (contadores, histogramas e gauges calculados na
+hora da coleta) para não depender do prometheus_client. O decorator
+`timed` mede funções async do caminho quente com um perf_counter e um
+bisect por chamada.
+"""
+import functools
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, List, Optional, Tuple, Union
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+Labels = Dict[str, str]
+
+
+def _escape(valor) -> str:
+    return str(valor).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _formatar_labels(nomes: Tuple[str, ...], valores: Tuple, extra: str = "") -> str:
+    pares = [f'{n}="{_escape(v)}"' for n, v in zip(nomes, valores)]
+    if extra:
+        pares.append(extra)
+    return "{" + ",".join(pares) + "}" if pares else ""
+
+
+def _numero(valor: float) -> str:
+    if valor == float("inf"):
+        return "+Inf"
+    return repr(float(valor)) if isinstance(valor, float) else str(valor)
+
+
+class _Metrica:
+    tipo = "untyped"
+
+    def __init__(self, registry: "Registry", name: str, documentation: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        registry.register(self)
+
+    def _chave(self, labels: Labels) -> Tuple:
+        return tuple(labels.get(n, "") for n in self.labelnames)
+
+    def cabecalho(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.tipo}"]
+
+
+class Counter(_Metrica):
+    tipo = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._valores: Dict[Tuple, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels):
+        chave = self._chave(labels)
+        self._valores[chave] = self._valores.get(chave, 0.0) + amount
+
+    def collect(self) -> List[str]:
+        return self.cabecalho() + [
+            f"{self.name}{_formatar_labels(self.labelnames, chave)} {_numero(valor)}"
+            for chave, valor in self._valores.items()
+        ]
+
+
+class Histogram(_Metrica):
+    tipo = "histogram"
+
+    def __init__(self, *args, buckets: Tuple[float, ...] = LATENCY_BUCKETS, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.buckets = tuple(sorted(buckets))
+        # chave -> [contagem por bucket (não cumulativa) + overflow, soma]
+        self._series: Dict[Tuple, list] = {}
+
+    def observe(self, valor: float, **labels):
+        chave = self._chave(labels)
+        serie = self._series.get(chave)
+        if serie is None:
+            serie = [[0] * (len(self.buckets) + 1), 0.0]
+            self._series[chave] = serie
+        serie[0][bisect_left(self.buckets, valor)] += 1
+        serie[1] += valor
+
+    def time(self, **labels) -> "_Cronometro":
+        return _Cronometro(self, labels)
+
+    def collect(self) -> List[str]:
+        linhas = self.cabecalho()
+        for chave, (contagens, soma) in self._series.items():
+            acumulado = 0
+            for limite, n in zip(self.buckets + (float("inf"),), contagens):
+                acumulado += n
+                le = 'le="' + _numero(limite) + '"'
+                linhas.append(f"{self.name}_bucket{_formatar_labels(self.labelnames, chave, le)} {acumulado}")
+            rotulos = _formatar_labels(self.labelnames, chave)
+            linhas.append(f"{self.name}_sum{rotulos} {_numero(soma)}")
+            linhas.append(f"{self.name}_count{rotulos} {acumulado}")
+        return linhas
+
+
+class GaugeFunc(_Metrica):
+    """Gauge lido na coleta: `fn` devolve um número ou {valores dos labels: número}"""
+
+    tipo = "gauge"
+
+    def __init__(self, registry, name, documentation, fn: Callable, labelnames: Iterable[str] = (), tipo: str = "gauge"):
+        super().__init__(registry, name, documentation, labelnames)
+        self.fn = fn
+        self.tipo = tipo
+
+    def collect(self) -> List[str]:
+        try:
+            valor = self.fn()
+        except Exception:
+            return []
+        if not isinstance(valor, dict):
+            valor = {(): valor}
+        linhas = self.cabecalho()
+        for chave, v in valor.items():
+            chave = chave if isinstance(chave, tuple) else (chave,)
+            linhas.append(f"{self.name}{_formatar_labels(self.labelnames, chave)} {_numero(v)}")
+        return linhas
+
+
+class _Cronometro:
+    __slots__ = ("histograma", "labels", "inicio")
+
+    def __init__(self, histograma: Histogram, labels: Labels):
+        self.histograma = histograma
+        self.labels = labels
+
+    def __enter__(self):
+        self.inicio = time.perf_counter()
+        return self
+
+    def __exit__(self, tipo, *_):
+        labels = self.labels
+        if "outcome" in self.histograma.labelnames:
+            labels = {**labels, "outcome": "error" if tipo else "ok"}
+        self.histograma.observe(time.perf_counter() - self.inicio, **labels)
+        return False
+
+
+def timed(histograma: Histogram, labels: Optional[Union[Labels, Callable[..., Labels]]] = None):
+    """Decorator para funções async; `labels` pode ser função dos argumentos"""
+    def decorador(fn):
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            rotulos = labels(*args, **kwargs) if callable(labels) else (labels or {})
+            with _Cronometro(histograma, rotulos):
+                return await fn(*args, **kwargs)
+        return wrapper
+    return decorador
+
+
+class Registry:
+    def __init__(self):
+        self._metricas: List[_Metrica] = []
+
+    def register(self, metrica: _Metrica):
+        self._metricas.append(metrica)
+
+    def render(self) -> str:
+        linhas: List[str] = []
+        for metrica in self._metricas:
+            linhas.extend(metrica.collect())
+        return "\n".join(linhas) + "\n"
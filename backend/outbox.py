@@ -0,0 +1,451 @@
+"""
+Fila de saída para o WhatsApp
+
+Toda mensagem para o cliente (resposta do bot ou do atendente) entra aqui
+antes de ir ao bot Node.js. A fila:
+
+- mantém a ordem por chat: a próxima mensagem de um cliente só sai depois
+  que a anterior foi entregue (ou desistida);
+- reenvia com backoff exponencial quando o bot está fora, responde 5xx ou
+  o WhatsApp está desconectado; erro 4xx não é reenviado;
+- para de tentar enquanto o circuit breaker do bot está aberto, em vez de
+  gastar as tentativas de cada mensagem;
+- limita a vazão total (mensagens por minuto) para não disparar os limites
+  anti-spam do WhatsApp;
+- grava as mensagens pendentes: o que não saiu antes de um restart sai
+  depois dele.
+
+Com vários workers no mesmo arquivo cada linha tem dono: o worker só envia
+as que reivindicou (numa transação), e as de um worker que parou de dar
+sinal de vida são adotadas por outro. Assim nenhuma mensagem sai duas vezes.
+"""
+import asyncio
+import json
+import random
+import sqlite3
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import suppress
+from pathlib import Path
+from typing import Awaitable, Callable, Deque, Dict, List, Optional, Set
+
+from ratelimit import TokenBucket
+from routing import ModelHealth
+
+# sender(chat_id, texto, message_id) -> {"success", "error", "status", "messageId"}
+Sender = Callable[[str, str, str], Awaitable[Dict]]
+# on_result(item, resultado) quando a mensagem sai ou é desistida
+OnResult = Callable[[Dict, Dict], Awaitable[None]]
+
+
+class OutboxStore:
+    """Mensagens pendentes (uma linha por mensagem, na ordem de chegada)"""
+
+    name = "base"
+
+    async def add(self, item: Dict):
+        raise NotImplementedError
+
+    async def update(self, item: Dict):
+        raise NotImplementedError
+
+    async def remove(self, message_id: str):
+        raise NotImplementedError
+
+    async def claim(self) -> List[Dict]:
+        """Reivindica as linhas sem dono (ou de dono morto) e devolve todas as deste worker"""
+        raise NotImplementedError
+
+    async def release(self):
+        """Devolve as linhas deste worker (parada limpa: outro worker pode assumir)"""
+
+    async def close(self):
+        pass
+
+
+class MemoryOutboxStore(OutboxStore):
+    name = "memory"
+
+    def __init__(self):
+        self._itens: Dict[str, Dict] = {}
+
+    async def add(self, item):
+        self._itens[item["id"]] = dict(item)
+
+    async def update(self, item):
+        if item["id"] in self._itens:
+            self._itens[item["id"]] = dict(item)
+
+    async def remove(self, message_id):
+        self._itens.pop(message_id, None)
+
+    async def claim(self):
+        return [dict(item) for item in self._itens.values()]
+
+
+class SQLiteOutboxStore(OutboxStore):
+    """SQLite local; como no SQLiteStore, o arquivo só é usado por uma thread
+
+    `owner` identifica o worker; `owner_ttl` é quanto tempo sem sinal de vida
+    até as linhas dele poderem ser adotadas (0: na hora, um worker só).
+    """
+
+    name = "sqlite"
+
+    def __init__(self, path: Path, owner: str = "", owner_ttl: float = 0.0):
+        self.path = Path(path)
+        self.owner = owner
+        self.owner_ttl = owner_ttl
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._db: Optional[sqlite3.Connection] = None
+
+    def _conn(self) -> sqlite3.Connection:
+        if self._db is None:
+            # isolation_level=None: as transações são abertas à mão (BEGIN IMMEDIATE)
+            self._db = sqlite3.connect(str(self.path), check_same_thread=False, isolation_level=None, timeout=10)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS saida ("
+                " seq INTEGER PRIMARY KEY AUTOINCREMENT,"
+                " id TEXT UNIQUE NOT NULL,"
+                " chat_id TEXT NOT NULL,"
+                " data TEXT NOT NULL,"
+                " owner TEXT)"
+            )
+            colunas = {linha[1] for linha in self._db.execute("PRAGMA table_info(saida)")}
+            if "owner" not in colunas:  # arquivo de antes dos donos
+                self._db.execute("ALTER TABLE saida ADD COLUMN owner TEXT")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS saida_donos (owner TEXT PRIMARY KEY, visto_em REAL NOT NULL)"
+            )
+        return self._db
+
+    async def _run(self, fn, *args):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="outbox")
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, fn, *args)
+
+    def _add(self, item):
+        self._conn().execute(
+            "INSERT OR REPLACE INTO saida (id, chat_id, data, owner) VALUES (?, ?, ?, ?)",
+            (item["id"], item["chat_id"], json.dumps(item, ensure_ascii=False), self.owner),
+        )
+
+    def _update(self, item):
+        self._conn().execute(
+            "UPDATE saida SET data = ? WHERE id = ?", (json.dumps(item, ensure_ascii=False), item["id"])
+        )
+
+    def _remove(self, message_id):
+        self._conn().execute("DELETE FROM saida WHERE id = ?", (message_id,))
+
+    def _claim(self):
+        db = self._conn()
+        agora = time.time()
+        db.execute("BEGIN IMMEDIATE")  # outro worker reivindicando espera este terminar
+        try:
+            db.execute(
+                "INSERT INTO saida_donos (owner, visto_em) VALUES (?, ?) "
+                "ON CONFLICT(owner) DO UPDATE SET visto_em = excluded.visto_em",
+                (self.owner, agora),
+            )
+            db.execute("DELETE FROM saida_donos WHERE visto_em < ? AND owner != ?", (agora - self.owner_ttl, self.owner))
+            db.execute(
+                "UPDATE saida SET owner = ? WHERE owner IS NULL OR owner NOT IN (SELECT owner FROM saida_donos)",
+                (self.owner,),
+            )
+            linhas = db.execute("SELECT data FROM saida WHERE owner = ? ORDER BY seq", (self.owner,)).fetchall()
+            db.execute("COMMIT")
+        except Exception:
+            db.execute("ROLLBACK")
+            raise
+        return [json.loads(data) for (data,) in linhas]
+
+    def _release(self):
+        db = self._conn()
+        db.execute("BEGIN IMMEDIATE")
+        db.execute("UPDATE saida SET owner = NULL WHERE owner = ?", (self.owner,))
+        db.execute("DELETE FROM saida_donos WHERE owner = ?", (self.owner,))
+        db.execute("COMMIT")
+
+    def _close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+    async def add(self, item):
+        await self._run(self._add, item)
+
+    async def update(self, item):
+        await self._run(self._update, item)
+
+    async def remove(self, message_id):
+        await self._run(self._remove, message_id)
+
+    async def claim(self):
+        return await self._run(self._claim)
+
+    async def release(self):
+        await self._run(self._release)
+
+    async def close(self):
+        if self._executor is not None:
+            await self._run(self._close)
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+
+def retentavel(resultado: Dict) -> bool:
+    """Falha de conexão, timeout, 429 ou 5xx: vale tentar de novo"""
+    status = resultado.get("status")
+    return status is None or status == 429 or status >= 500
+
+
+class Outbox:
+    """Fila por chat com reenvio, circuit breaker e limite de vazão"""
+
+    def __init__(
+        self,
+        store: OutboxStore,
+        sender: Sender,
+        on_result: Optional[OnResult] = None,
+        workers: int = 2,
+        max_size: int = 5000,
+        max_attempts: int = 8,
+        base_delay: float = 1.0,
+        max_delay: float = 60.0,
+        rate: float = 1.0,
+        burst: float = 5.0,
+        breaker: Optional[ModelHealth] = None,
+        claim_interval: float = 10.0,
+    ):
+        self.store = store
+        self.sender = sender
+        self.on_result = on_result
+        self.workers = workers
+        self.max_size = max_size
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.bucket = TokenBucket(rate, burst)
+        self.breaker = breaker or ModelHealth(failure_threshold=3, cooldown=5.0, max_cooldown=60.0)
+        self.claim_interval = claim_interval  # sinal de vida + adoção de linhas órfãs
+        self._filas: Dict[str, Deque[Dict]] = {}
+        self._ids: Set[str] = set()  # ids enfileirados, para não pôr a mesma mensagem duas vezes
+        self._prontos: Optional[asyncio.Queue] = None
+        self._agendados: Dict[str, asyncio.TimerHandle] = {}
+        self._tasks: List[asyncio.Task] = []
+        self.depth = 0
+        self.stats_counters = {
+            "enqueued": 0,
+            "sent": 0,
+            "retries": 0,
+            "failed": 0,
+            "rejected": 0,
+            "restored": 0,
+            "adopted": 0,
+        }
+
+    def __len__(self):
+        return self.depth
+
+    def _colocar(self, item: Dict) -> bool:
+        """Põe na fila do chat; True se o chat estava parado e precisa ser agendado
+
+        Ignora mensagens que já estão na fila (enqueue e reivindicação podem
+        trazer a mesma). Uma linha adotada pode ser mais antiga que as já
+        enfileiradas: entra na ordem de criação, sem mexer na primeira (em envio).
+        """
+        if item["id"] in self._ids:
+            return False
+        self._ids.add(item["id"])
+        fila = self._filas.get(item["chat_id"])
+        novo = fila is None
+        if novo:
+            fila = self._filas[item["chat_id"]] = deque()
+        posicao = len(fila)
+        while posicao > 1 and fila[posicao - 1]["created_at"] > item["created_at"]:
+            posicao -= 1
+        fila.insert(posicao, item)
+        self.depth += 1
+        return novo
+
+    def _agendar(self, chat_id: str, atraso: float = 0.0):
+        if atraso <= 0:
+            self._prontos.put_nowait(chat_id)
+            return
+        loop = asyncio.get_running_loop()
+        self._agendados[chat_id] = loop.call_later(atraso, self._liberar, chat_id)
+
+    def _liberar(self, chat_id: str):
+        self._agendados.pop(chat_id, None)
+        self._prontos.put_nowait(chat_id)
+
+    async def enqueue(self, chat_id: str, texto: str, message_id: str) -> bool:
+        """Grava e enfileira; False se a fila está cheia (nada foi gravado)"""
+        if self.depth >= self.max_size:
+            self.stats_counters["rejected"] += 1
+            return False
+        item = {
+            "id": message_id,
+            "chat_id": chat_id,
+            "text": texto,
+            "attempts": 0,
+            "created_at": time.time(),
+            "last_error": None,
+        }
+        await self.store.add(item)
+        self.stats_counters["enqueued"] += 1
+        if self._colocar(item) and self._prontos is not None:
+            self._agendar(chat_id)
+        return True
+
+    async def _reivindicar(self, contador: str) -> List[str]:
+        """Põe na fila as linhas do store que ainda não estão nela; chats com novidade"""
+        chats = []
+        for item in await self.store.claim():
+            # Conferido depois do await: um enqueue pode ter enfileirado a mesma nesse meio tempo
+            if item["id"] in self._ids:
+                continue
+            if self._colocar(item):
+                chats.append(item["chat_id"])
+            self.stats_counters[contador] += 1
+        return chats
+
+    async def start(self):
+        """Recupera o que ficou pendente e sobe os workers"""
+        self._prontos = asyncio.Queue()
+        await self._reivindicar("restored")
+        for chat_id in self._filas:
+            self._agendar(chat_id)
+        for indice in range(self.workers):
+            self._tasks.append(asyncio.create_task(self._worker(indice)))
+        self._tasks.append(asyncio.create_task(self._adotar()))
+
+    async def _adotar(self):
+        """Renova o sinal de vida e assume as mensagens de workers que pararam"""
+        while True:
+            await asyncio.sleep(self.claim_interval)
+            try:
+                for chat_id in await self._reivindicar("adopted"):
+                    self._agendar(chat_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Erro ao reivindicar a fila de saída: {e}")
+
+    async def _esperar_breaker(self):
+        while self.breaker.state == "open":
+            await asyncio.sleep(max(0.05, self.breaker.open_until - time.monotonic()))
+
+    async def _esperar_cota(self):
+        while not self.bucket.try_acquire():
+            await asyncio.sleep(max(0.01, self.bucket.wait_time()))
+
+    def _atraso(self, tentativas: int) -> float:
+        atraso = min(self.max_delay, self.base_delay * 2 ** (tentativas - 1))
+        return atraso * random.uniform(0.5, 1.0)
+
+    async def _worker(self, indice: int):
+        while True:
+            chat_id = await self._prontos.get()
+            try:
+                await self._enviar_proxima(chat_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Erro na fila de saída ({chat_id}): {e}")
+                if chat_id in self._filas and chat_id not in self._agendados:
+                    self._agendar(chat_id, self.max_delay)
+
+    async def _enviar_proxima(self, chat_id: str):
+        fila = self._filas.get(chat_id)
+        if not fila:
+            self._filas.pop(chat_id, None)
+            return
+        item = fila[0]
+        await self._esperar_breaker()
+        await self._esperar_cota()
+
+        inicio = time.monotonic()
+        try:
+            resultado = await self.sender(chat_id, item["text"], item["id"])
+        except Exception as e:
+            resultado = {"success": False, "error": str(e)}
+        item["attempts"] += 1
+
+        if resultado.get("success"):
+            self.breaker.record_success((time.monotonic() - inicio) * 1000)
+            self.stats_counters["sent"] += 1
+            await self._concluir(chat_id, item, resultado)
+            return
+
+        erro = resultado.get("error") or "Falha ao enviar para WhatsApp"
+        item["last_error"] = erro
+        if retentavel(resultado):
+            self.breaker.record_failure(erro)
+            if item["attempts"] < self.max_attempts:
+                self.stats_counters["retries"] += 1
+                await self.store.update(item)
+                self._agendar(chat_id, self._atraso(item["attempts"]))
+                return
+        self.stats_counters["failed"] += 1
+        await self._concluir(chat_id, item, resultado)
+
+    async def _concluir(self, chat_id: str, item: Dict, resultado: Dict):
+        """Tira a mensagem da fila (entregue ou desistida) e libera a próxima do chat"""
+        # Apaga antes de tirar da fila: uma reivindicação no meio não a traz de volta
+        await self.store.remove(item["id"])
+        fila = self._filas[chat_id]
+        fila.popleft()
+        self._ids.discard(item["id"])
+        self.depth -= 1
+        if fila:
+            self._agendar(chat_id)
+        else:
+            del self._filas[chat_id]
+        if self.on_result is not None:
+            try:
+                await self.on_result(item, resultado)
+            except Exception as e:
+                print(f"Erro ao registrar envio de {chat_id}: {e}")
+
+    async def stop(self):
+        for handle in self._agendados.values():
+            handle.cancel()
+        self._agendados.clear()
+        for tarefa in self._tasks:
+            tarefa.cancel()
+            with suppress(asyncio.CancelledError):
+                await tarefa
+        self._tasks.clear()
+        # O que não saiu continua gravado, sem dono: sai no próximo start ou por outro worker
+        await self.store.release()
+        await self.store.close()
+
+    def stats(self) -> Dict:
+        mais_antiga = min(
+            (fila[0]["created_at"] for fila in self._filas.values() if fila),
+            default=None,
+        )
+        return {
+            "queued": self.depth,
+            "chats": len(self._filas),
+            "retrying": len(self._agendados),
+            "oldest_age": round(time.time() - mais_antiga, 1) if mais_antiga else 0.0,
+            "max_size": self.max_size,
+            "store": self.store.name,
+            "breaker": self.breaker.stats(),
+            "rate": self.bucket.stats(),
+            **self.stats_counters,
+        }
+
+
+def create_outbox_store(kind: str, path: Path, owner: str = "", owner_ttl: float = 0.0) -> OutboxStore:
+    """`memory` para testes; qualquer outro valor grava em SQLite local"""
+    if kind == "memory":
+        return MemoryOutboxStore()
+    return SQLiteOutboxStore(path, owner=owner, owner_ttl=owner_ttl)
@@ -0,0 +1,120 @@
+"""
+Registro de prompts
+
+Os textos (prompt do vendedor, modo humanizado, mensagem inicial, resposta
+a objeções) ficam em arquivos `prompts/<nome>.txt` com marcadores como
+`{business_name}` e `{site_url}`. Cada template é renderizado uma vez por
+versão da configuração e guardado junto com a contagem estimada de tokens.
+Editar um arquivo vale para a próxima mensagem, sem reiniciar o servidor.
+"""
+import time
+from pathlib import Path
+from typing import Callable, Dict, Optional, Tuple
+
+
+def estimar_tokens(texto: str) -> int:
+    """Estimativa sem tokenizer: ~3.5 caracteres por token em português"""
+    return max(1, round(len(texto) / 3.5)) if texto else 0
+
+
+class _Contexto(dict):
+    def __missing__(self, chave):
+        # Marcador desconhecido fica como está em vez de derrubar a resposta
+        return "{" + chave + "}"
+
+
+class PromptRegistry:
+    """Templates em arquivo, renderizados e cacheados por versão"""
+
+    def __init__(
+        self,
+        diretorio: Path,
+        contexto: Callable[[], Dict[str, str]],
+        check_interval: float = 2.0,
+        on_change: Optional[Callable[[], None]] = None,
+    ):
+        self.diretorio = Path(diretorio)
+        self.contexto = contexto
+        self.check_interval = check_interval
+        self.on_change = on_change
+        self.versao = 0
+        self._templates: Dict[str, Tuple[float, str]] = {}  # nome -> (mtime, texto)
+        self._renderizados: Dict[str, Tuple[str, int]] = {}  # nome -> (texto, tokens)
+        self._verificado_em = 0.0
+        self.stats_counters = {"renders": 0, "hits": 0, "file_reloads": 0, "errors": 0}
+
+    def invalidate(self):
+        """Config mudou: os próximos pedidos renderizam de novo"""
+        self.versao += 1
+        self._renderizados.clear()
+
+    def render(self, nome: str) -> str:
+        return self._get(nome)[0]
+
+    def tokens(self, nome: str) -> int:
+        return self._get(nome)[1]
+
+    def _get(self, nome: str) -> Tuple[str, int]:
+        self._verificar_arquivos()
+        pronto = self._renderizados.get(nome)
+        if pronto is not None:
+            self.stats_counters["hits"] += 1
+            return pronto
+
+        template = self._template(nome)
+        try:
+            texto = template.format_map(_Contexto(self.contexto())).strip()
+        except (ValueError, IndexError) as e:
+            # Chave solta num arquivo editado ("{" sem fechar): usa o texto cru
+            self.stats_counters["errors"] += 1
+            print(f"⚠️ Prompt {nome} com marcador inválido: {e}")
+            texto = template.strip()
+        pronto = (texto, estimar_tokens(texto))
+        self._renderizados[nome] = pronto
+        self.stats_counters["renders"] += 1
+        return pronto
+
+    def _template(self, nome: str) -> str:
+        carregado = self._templates.get(nome)
+        if carregado is None:
+            caminho = self.diretorio / f"{nome}.txt"
+            carregado = (caminho.stat().st_mtime, caminho.read_text(encoding="utf-8"))
+            self._templates[nome] = carregado
+        return carregado[1]
+
+    def _verificar_arquivos(self):
+        """Relê templates alterados no disco (no máximo a cada `check_interval`)"""
+        agora = time.monotonic()
+        if agora - self._verificado_em < self.check_interval:
+            return
+        self._verificado_em = agora
+
+        mudou = False
+        for nome, (mtime, _) in list(self._templates.items()):
+            caminho = self.diretorio / f"{nome}.txt"
+            try:
+                novo_mtime = caminho.stat().st_mtime
+                if novo_mtime == mtime:
+                    continue
+                self._templates[nome] = (novo_mtime, caminho.read_text(encoding="utf-8"))
+            except OSError as e:
+                # Arquivo sumiu/ilegível no meio da edição: mantém a versão anterior
+                self.stats_counters["errors"] += 1
+                print(f"⚠️ Prompt {nome}: {e}")
+                continue
+            self.stats_counters["file_reloads"] += 1
+            print(f"📝 Prompt {nome} recarregado do disco")
+            mudou = True
+
+        if mudou:
+            self.invalidate()
+            if self.on_change is not None:
+                self.on_change()
+
+    def stats(self) -> Dict:
+        return {
+            "versao": self.versao,
+            "diretorio": str(self.diretorio),
+            **self.stats_counters,
+            "tokens": {nome: tokens for nome, (_, tokens) in self._renderizados.items()},
+        }
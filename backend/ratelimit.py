@@ -0,0 +1,115 @@
+"""
+Limites de taxa para chamadas à IA
+
+Token buckets por chat (um cliente ou lista de transmissão em loop não
+gasta a cota de todo mundo) e por provedor (cota gratuita da OpenRouter,
+Gemini). Taxa 0 desliga o limite.
+"""
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Dict
+
+
+class TokenBucket:
+    """`rate` fichas por segundo, acumulando no máximo `burst`"""
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = max(1.0, burst)
+        self.tokens = self.burst
+        self._atualizado = time.monotonic()
+        self.allowed = 0
+        self.denied = 0
+
+    def _reabastecer(self):
+        agora = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (agora - self._atualizado) * self.rate)
+        self._atualizado = agora
+
+    def try_acquire(self, n: float = 1.0) -> bool:
+        if self.rate <= 0:
+            self.allowed += 1
+            return True
+        self._reabastecer()
+        if self.tokens >= n:
+            self.tokens -= n
+            self.allowed += 1
+            return True
+        self.denied += 1
+        return False
+
+    def wait_time(self, n: float = 1.0) -> float:
+        """Segundos até haver `n` fichas (0 se já há)"""
+        if self.rate <= 0:
+            return 0.0
+        self._reabastecer()
+        return max(0.0, (n - self.tokens) / self.rate)
+
+    async def acquire(self, timeout: float) -> bool:
+        """Espera a ficha por até `timeout` segundos; False se não der tempo"""
+        limite = time.monotonic() + timeout
+        while True:
+            espera = self.wait_time()
+            if espera <= 0:
+                if self.try_acquire():
+                    return True
+                continue
+            if time.monotonic() + espera > limite:
+                self.denied += 1
+                return False
+            await asyncio.sleep(espera)
+
+    def stats(self) -> Dict:
+        self._reabastecer()
+        return {
+            "rate_per_min": round(self.rate * 60, 2),
+            "burst": self.burst,
+            "available": round(self.tokens, 2),
+            "allowed": self.allowed,
+            "denied": self.denied,
+        }
+
+
+class KeyedRateLimiter:
+    """Um TokenBucket por chave (chat_id), com LRU para não crescer sem limite"""
+
+    def __init__(self, rate: float, burst: float, max_keys: int = 10000):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self._buckets: "OrderedDict[str, TokenBucket]" = OrderedDict()
+        self.allowed = 0
+        self.denied = 0
+
+    def try_acquire(self, chave: str) -> bool:
+        if self.rate <= 0:
+            return True
+        bucket = self._buckets.get(chave)
+        if bucket is None:
+            # Bucket esquecido pelo LRU estava cheio de qualquer forma
+            bucket = TokenBucket(self.rate, self.burst)
+            self._buckets[chave] = bucket
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(chave)
+        if bucket.try_acquire():
+            self.allowed += 1
+            return True
+        self.denied += 1
+        return False
+
+    def wait_time(self, chave: str) -> float:
+        """Segundos até a chave ter uma ficha (0 se já tem)"""
+        bucket = self._buckets.get(chave)
+        return bucket.wait_time() if bucket is not None else 0.0
+
+    def stats(self) -> Dict:
+        return {
+            "rate_per_min": round(self.rate * 60, 2),
+            "burst": self.burst,
+            "tracked": len(self._buckets),
+            "allowed": self.allowed,
+            "denied": self.denied,
+        }
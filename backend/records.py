@@ -0,0 +1,201 @@
+"""
+Registros compactos das conversas em memória
+
+Cada mensagem era um dict com chaves repetidas e o horário como texto ISO,
+e o webhook convertia `ultimo_humano` de volta para datetime a cada
+mensagem recebida. Aqui mensagens e conversas são objetos com `__slots__`
+(sem dict por instância), horários são epoch (float), autores/papéis são
+strings internadas (uma cópia só por processo) e o `historico_ia` é um
+buffer circular limitado.
+
+O formato JSON não muda: `to_dict`/`from_dict` convertem nas bordas
+(gravação, API, eventos do painel) e `get` atende quem lê os registros
+como dict (resumos, busca), aceitando as mesmas chaves de antes.
+"""
+import sys
+from collections import deque
+from datetime import datetime
+from typing import Any, Deque, Dict, List, Optional
+
+# Limite duro do historico_ia se o resumo falhar seguidamente
+HISTORICO_MAX_ENTRADAS = 60
+
+_intern = sys.intern
+
+
+def epoch(valor: Optional[str]) -> Optional[float]:
+    """ISO -> epoch; None se vazio ou inválido"""
+    if not valor:
+        return None
+    try:
+        return datetime.fromisoformat(valor).timestamp()
+    except (TypeError, ValueError):
+        return None
+
+
+def iso(ts: Optional[float]) -> Optional[str]:
+    return datetime.fromtimestamp(ts).isoformat() if ts is not None else None
+
+
+def _turno(entrada: Dict) -> Dict:
+    """Entrada do historico_ia com o papel internado"""
+    role = entrada.get("role")
+    if isinstance(role, str):
+        entrada["role"] = _intern(role)
+    return entrada
+
+
+class Message:
+    """Mensagem do histórico (cliente, bot ou atendente)"""
+
+    __slots__ = ("id", "sender", "text", "ts", "whatsapp_id", "status", "erro_envio", "extra")
+
+    def __init__(
+        self,
+        id: str,
+        sender: str,
+        text: str,
+        ts: Optional[float],
+        whatsapp_id: Optional[str] = None,
+        status: Optional[str] = None,
+        erro_envio: Optional[str] = None,
+        extra: Optional[Dict[str, Any]] = None,
+    ):
+        self.id = id
+        self.sender = _intern(sender)
+        self.text = text
+        self.ts = ts
+        self.whatsapp_id = whatsapp_id
+        self.status = _intern(status) if status else status
+        self.erro_envio = erro_envio
+        self.extra = extra  # chaves desconhecidas do JSON gravado, preservadas
+
+    @property
+    def timestamp(self) -> Optional[str]:
+        return iso(self.ts)
+
+    def get(self, chave: str, padrao: Any = None) -> Any:
+        """Leitura no formato antigo (`from`, `timestamp` em ISO)"""
+        if chave == "from":
+            valor = self.sender
+        elif chave == "timestamp":
+            valor = iso(self.ts)
+        elif chave in _CAMPOS_MENSAGEM:
+            valor = getattr(self, chave)
+        else:
+            valor = self.extra.get(chave) if self.extra else None
+        return padrao if valor is None else valor
+
+    def to_dict(self) -> Dict:
+        dados = {"id": self.id, "from": self.sender, "text": self.text, "timestamp": iso(self.ts)}
+        if self.whatsapp_id is not None:
+            dados["whatsapp_id"] = self.whatsapp_id
+        if self.status is not None:
+            dados["status"] = self.status
+        if self.erro_envio is not None:
+            dados["erro_envio"] = self.erro_envio
+        if self.extra:
+            dados.update(self.extra)
+        return dados
+
+    @classmethod
+    def from_dict(cls, dados: Dict) -> "Message":
+        dados = dict(dados)
+        timestamp = dados.pop("timestamp", None)
+        ts = epoch(timestamp)
+        if ts is None and timestamp is not None:
+            dados["timestamp"] = timestamp  # formato inesperado: devolve como veio
+        msg = cls(
+            dados.pop("id", None),
+            dados.pop("from", None) or "",
+            dados.pop("text", None) or "",
+            ts,
+            whatsapp_id=dados.pop("whatsapp_id", None),
+            status=dados.pop("status", None),
+            erro_envio=dados.pop("erro_envio", None),
+        )
+        msg.extra = dados or None
+        return msg
+
+
+_CAMPOS_MENSAGEM = frozenset(Message.__slots__) - {"extra"}
+
+
+class Conversation:
+    """Conversa de um chat: mensagens, flags de atendimento e contexto da IA"""
+
+    __slots__ = (
+        "chat_id", "mensagens", "humano_ativo", "modo_humanizado", "ultimo_humano",
+        "mensagem_inicial_enviada", "objecoes_tratadas", "historico_ia", "resumo_ia",
+        "nome_cliente", "criado_em", "extra",
+    )
+
+    def __init__(self, chat_id: str, nome_cliente: Optional[str] = None, criado_em: Optional[float] = None):
+        self.chat_id = chat_id
+        self.mensagens: List[Message] = []
+        self.humano_ativo = False
+        self.modo_humanizado = False  # modo 100% humanizado
+        self.ultimo_humano: Optional[float] = None  # epoch da última ação do atendente
+        self.mensagem_inicial_enviada = False
+        self.objecoes_tratadas: List[str] = []
+        self.historico_ia: Deque[Dict] = deque(maxlen=HISTORICO_MAX_ENTRADAS)
+        self.resumo_ia: Optional[Dict] = None
+        self.nome_cliente = nome_cliente
+        self.criado_em = criado_em
+        self.extra: Optional[Dict[str, Any]] = None
+
+    def get(self, chave: str, padrao: Any = None) -> Any:
+        """Leitura no formato antigo (horários em ISO)"""
+        if chave in ("ultimo_humano", "criado_em"):
+            valor = iso(getattr(self, chave))
+        elif chave in _CAMPOS_CONVERSA:
+            valor = getattr(self, chave)
+        else:
+            valor = self.extra.get(chave) if self.extra else None
+        return padrao if valor is None else valor
+
+    def __getitem__(self, chave: str) -> Any:
+        if chave not in _CAMPOS_CONVERSA:
+            raise KeyError(chave)
+        return self.get(chave)
+
+    def to_dict(self) -> Dict:
+        dados = {
+            "chat_id": self.chat_id,
+            "mensagens": [m.to_dict() for m in self.mensagens],
+            "humano_ativo": self.humano_ativo,
+            "modo_humanizado": self.modo_humanizado,
+            "ultimo_humano": iso(self.ultimo_humano),
+            "mensagem_inicial_enviada": self.mensagem_inicial_enviada,
+            "objecoes_tratadas": list(self.objecoes_tratadas),
+            "historico_ia": list(self.historico_ia),
+            "resumo_ia": self.resumo_ia,
+            "nome_cliente": self.nome_cliente,
+            "criado_em": iso(self.criado_em),
+        }
+        if self.extra:
+            dados.update(self.extra)
+        return dados
+
+    @classmethod
+    def from_dict(cls, dados: Dict) -> "Conversation":
+        dados = dict(dados)
+        conversa = cls(dados.pop("chat_id"), dados.pop("nome_cliente", None), epoch(dados.pop("criado_em", None)))
+        conversa.mensagens = [Message.from_dict(m) for m in dados.pop("mensagens", None) or []]
+        conversa.humano_ativo = bool(dados.pop("humano_ativo", False))
+        conversa.modo_humanizado = bool(dados.pop("modo_humanizado", False))
+        conversa.ultimo_humano = epoch(dados.pop("ultimo_humano", None))
+        conversa.mensagem_inicial_enviada = bool(dados.pop("mensagem_inicial_enviada", False))
+        conversa.objecoes_tratadas = [_intern(o) for o in dados.pop("objecoes_tratadas", None) or []]
+        conversa.historico_ia.extend(_turno(e) for e in dados.pop("historico_ia", None) or [])
+        conversa.resumo_ia = dados.pop("resumo_ia", None)
+        conversa.extra = dados or None
+        return conversa
+
+
+_CAMPOS_CONVERSA = frozenset(Conversation.__slots__) - {"extra"}
+
+
+def como_dict(conversa) -> Dict:
+    """Conversa do cache (registro) ou lida do banco (dict) no formato JSON"""
+    return conversa.to_dict() if isinstance(conversa, Conversation) else conversa
@@ -0,0 +1,193 @@
+"""
+Cache de respostas da IA
+
+Boa parte das mensagens são as mesmas perguntas (horário, pagamento, área
+de entrega, cardápio). O cache guarda a resposta por texto normalizado +
+modo (normal/humanizado) + versão da configuração, com TTL e LRU, e acha
+quase-duplicatas ("qual o horario?" / "qual horário vcs abrem") por
+similaridade de trigramas de caracteres, sem depender de modelos externos.
+"""
+import re
+import time
+from collections import Counter, OrderedDict
+from typing import Dict, Optional, Set, Tuple
+
+from intents import fold
+
+# Respostas curtas que só fazem sentido no contexto da conversa
+_DEPENDENTES_CONTEXTO = {
+    "sim", "nao", "ok", "okay", "blz", "beleza", "pode", "quero", "isso", "esse",
+    "essa", "aquele", "aquela", "obrigado", "obrigada", "valeu", "certo", "claro",
+    "oi", "ola", "bom", "boa", "dia", "tarde", "noite", "tudo", "bem", "e", "o", "a",
+    "um", "uma", "eu", "ta", "to", "vou", "vai", "agora", "entao", "mais", "menos",
+}
+
+Chave = Tuple[str, bool, int]  # (texto normalizado, modo humanizado, versão)
+
+
+def normalizar(texto: str) -> str:
+    """Minúsculas, sem acentos/pontuação, espaços e letras repetidas colapsados"""
+    texto = re.sub(r"(.)\1{2,}", r"\1\1", fold(texto))  # "oiiii" -> "oii"
+    return " ".join(texto.split())
+
+
+def numeros(texto: str) -> Set[str]:
+    return {t for t in texto.split() if any(c.isdigit() for c in t)}
+
+
+def trigramas(texto: str) -> Set[str]:
+    texto = f" {texto} "
+    return {texto[i:i + 3] for i in range(len(texto) - 2)}
+
+
+class _Entrada:
+    __slots__ = ("resposta", "criado_em", "gramas", "hits")
+
+    def __init__(self, resposta: str, gramas: Set[str]):
+        self.resposta = resposta
+        self.criado_em = time.monotonic()
+        self.gramas = gramas
+        self.hits = 0
+
+
+class ResponseCache:
+    """LRU com TTL, busca exata e por similaridade (Jaccard de trigramas)"""
+
+    def __init__(
+        self,
+        max_size: int = 500,
+        ttl: float = 6 * 3600,
+        similarity: float = 0.75,
+        min_chars: int = 10,
+    ):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.similarity = similarity  # 0 desliga a busca aproximada
+        self.min_chars = min_chars
+        self.versao = 0
+        self._entradas: "OrderedDict[Chave, _Entrada]" = OrderedDict()
+        self._indice: Dict[str, Set[Chave]] = {}
+        self.stats_counters = {
+            "hits_exact": 0,
+            "hits_similar": 0,
+            "misses": 0,
+            "skipped": 0,
+            "stores": 0,
+            "evicted_lru": 0,
+            "evicted_ttl": 0,
+            "invalidations": 0,
+        }
+
+    def __len__(self):
+        return len(self._entradas)
+
+    def elegivel(self, normalizado: str) -> bool:
+        """Mensagens curtas ou só de confirmação dependem do histórico"""
+        if len(normalizado) < self.min_chars:
+            return False
+        return not set(normalizado.split()) <= _DEPENDENTES_CONTEXTO
+
+    def get(self, mensagem: str, modo_humano: bool) -> Tuple[Optional[str], int]:
+        """(resposta em cache ou None, versão a usar no put)"""
+        normalizado = normalizar(mensagem)
+        if not self.elegivel(normalizado):
+            self.stats_counters["skipped"] += 1
+            return None, self.versao
+
+        chave = (normalizado, modo_humano, self.versao)
+        entrada = self._entradas.get(chave)
+        if entrada is not None and self._expirada(chave, entrada):
+            entrada = None
+        if entrada is not None:
+            self._entradas.move_to_end(chave)
+            self.stats_counters["hits_exact"] += 1
+        elif self.similarity > 0:
+            entrada = self._parecida(chave)
+            if entrada is not None:
+                self.stats_counters["hits_similar"] += 1
+
+        if entrada is None:
+            self.stats_counters["misses"] += 1
+            return None, self.versao
+        entrada.hits += 1
+        return entrada.resposta, self.versao
+
+    def put(self, mensagem: str, modo_humano: bool, resposta: str, versao: int):
+        """Guarda a resposta; descarta se a config mudou durante a geração"""
+        normalizado = normalizar(mensagem)
+        if versao != self.versao or not resposta or not self.elegivel(normalizado):
+            return
+        chave = (normalizado, modo_humano, versao)
+        if chave in self._entradas:
+            self._remover(chave)
+        entrada = _Entrada(resposta, trigramas(normalizado))
+        self._entradas[chave] = entrada
+        for grama in entrada.gramas:
+            self._indice.setdefault(grama, set()).add(chave)
+        self.stats_counters["stores"] += 1
+        while len(self._entradas) > self.max_size:
+            self._remover(next(iter(self._entradas)))
+            self.stats_counters["evicted_lru"] += 1
+
+    def invalidate(self):
+        """Config mudou (site, nome, prompts): tudo que foi gerado antes perde a validade"""
+        self.versao += 1
+        self._entradas.clear()
+        self._indice.clear()
+        self.stats_counters["invalidations"] += 1
+
+    def _parecida(self, chave: Chave) -> Optional[_Entrada]:
+        normalizado, modo_humano, versao = chave
+        gramas = trigramas(normalizado)
+        # "combo 1" e "combo 2" são quase iguais em trigramas, mas não na resposta
+        nums = numeros(normalizado)
+        comuns: Counter = Counter()
+        for grama in gramas:
+            for candidata in self._indice.get(grama, ()):
+                if candidata[1] == modo_humano and candidata[2] == versao:
+                    comuns[candidata] += 1
+
+        melhor, melhor_score = None, self.similarity
+        for candidata, n in comuns.items():
+            entrada = self._entradas[candidata]
+            score = n / (len(gramas) + len(entrada.gramas) - n)
+            if score >= melhor_score and numeros(candidata[0]) == nums:
+                melhor, melhor_score = candidata, score
+        if melhor is None:
+            return None
+        entrada = self._entradas[melhor]
+        if self._expirada(melhor, entrada):
+            return None
+        self._entradas.move_to_end(melhor)
+        return entrada
+
+    def _expirada(self, chave: Chave, entrada: _Entrada) -> bool:
+        if time.monotonic() - entrada.criado_em <= self.ttl:
+            return False
+        self._remover(chave)
+        self.stats_counters["evicted_ttl"] += 1
+        return True
+
+    def _remover(self, chave: Chave):
+        entrada = self._entradas.pop(chave, None)
+        if entrada is None:
+            return
+        for grama in entrada.gramas:
+            chaves = self._indice.get(grama)
+            if chaves is not None:
+                chaves.discard(chave)
+                if not chaves:
+                    del self._indice[grama]
+
+    def stats(self) -> Dict:
+        hits = self.stats_counters["hits_exact"] + self.stats_counters["hits_similar"]
+        consultas = hits + self.stats_counters["misses"]
+        return {
+            "size": len(self._entradas),
+            "max_size": self.max_size,
+            "ttl_seconds": self.ttl,
+            "similarity": self.similarity,
+            "versao": self.versao,
+            **self.stats_counters,
+            "hit_rate": round(hits / consultas, 3) if consultas else 0.0,
+        }
@@ -0,0 +1,227 @@
+"""
+Roteamento entre modelos de IA
+
+Cadeia de fallback entre provedores/modelos, requisições "hedged" (dispara
+o próximo modelo se o primeiro demorar demais e fica com a primeira
+resposta válida), circuit breaker por modelo e estatísticas de latência e
+erro que decidem a ordem das tentativas.
+"""
+import asyncio
+import time
+from contextlib import suppress
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+Candidato = Tuple[str, str]  # (provider, model)
+
+# Latência assumida para modelos ainda sem medição (ms)
+LATENCIA_DESCONHECIDA_MS = 8000.0
+
+
+class CandidatoIndisponivel(Exception):
+    """Pulado por limite local (taxa do provedor): não conta como falha do modelo"""
+
+
+async def _fechar(resultado: Any):
+    """Fecha o stream devolvido por uma tentativa que perdeu a corrida
+
+    `fn` pode devolver o stream direto ou junto do primeiro trecho
+    (open_stream); sem `aclose` a conexão HTTP (ou a thread do Gemini)
+    ficaria aberta até o coletor de lixo.
+    """
+    for item in resultado if isinstance(resultado, tuple) else (resultado,):
+        aclose = getattr(item, "aclose", None)
+        if aclose is not None:
+            with suppress(Exception):
+                await aclose()
+
+
+def _descartar(tarefa: asyncio.Task):
+    """Callback de uma tentativa cancelada que ainda assim terminou com resultado"""
+    if not tarefa.cancelled() and tarefa.exception() is None:
+        asyncio.ensure_future(_fechar(tarefa.result()))
+
+
+class ModelHealth:
+    """Estatísticas e circuit breaker de um modelo"""
+
+    def __init__(self, failure_threshold: int, cooldown: float, max_cooldown: float):
+        self.failure_threshold = failure_threshold
+        self.base_cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.cooldown = cooldown
+        self.calls = 0
+        self.successes = 0
+        self.errors = 0
+        self.consecutive_failures = 0
+        self.latency_ms: Optional[float] = None  # média móvel exponencial
+        self.open_until = 0.0
+        self.last_error: Optional[str] = None
+
+    @property
+    def state(self) -> str:
+        if self.consecutive_failures < self.failure_threshold:
+            return "closed"
+        return "open" if time.monotonic() < self.open_until else "half_open"
+
+    def available(self) -> bool:
+        return self.state != "open"
+
+    def record_success(self, ms: float):
+        self.calls += 1
+        self.successes += 1
+        self.consecutive_failures = 0
+        self.cooldown = self.base_cooldown
+        self.latency_ms = ms if self.latency_ms is None else self.latency_ms * 0.8 + ms * 0.2
+
+    def record_failure(self, erro: str):
+        self.calls += 1
+        self.errors += 1
+        self.last_error = erro[:200]
+        era_half_open = self.state == "half_open"
+        self.consecutive_failures += 1
+        if self.consecutive_failures >= self.failure_threshold:
+            if era_half_open:
+                # Falhou de novo logo após reabrir: espera o dobro
+                self.cooldown = min(self.cooldown * 2, self.max_cooldown)
+            self.open_until = time.monotonic() + self.cooldown
+
+    def score(self) -> float:
+        """Menor é melhor: latência média penalizada pela taxa de erro"""
+        latencia = self.latency_ms if self.latency_ms is not None else LATENCIA_DESCONHECIDA_MS
+        taxa_erro = self.errors / self.calls if self.calls else 0.0
+        return latencia * (1 + 4 * taxa_erro)
+
+    def stats(self) -> Dict:
+        return {
+            "state": self.state,
+            "calls": self.calls,
+            "successes": self.successes,
+            "errors": self.errors,
+            "latency_ms": round(self.latency_ms, 1) if self.latency_ms is not None else None,
+            "last_error": self.last_error,
+        }
+
+
+class ModelRouter:
+    """Escolhe a ordem dos modelos e executa failover/hedging"""
+
+    def __init__(
+        self,
+        failure_threshold: int = 3,
+        cooldown: float = 30.0,
+        max_cooldown: float = 600.0,
+        preferencia: float = 0.5,
+    ):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        # O modelo escolhido no painel "vale" esta fração da sua latência real
+        self.preferencia = preferencia
+        self._saude: Dict[Candidato, ModelHealth] = {}
+        self.hedges_disparados = 0
+        self.hedges_vencidos = 0
+        self.failovers = 0
+
+    def health(self, candidato: Candidato) -> ModelHealth:
+        saude = self._saude.get(candidato)
+        if saude is None:
+            saude = ModelHealth(self.failure_threshold, self.cooldown, self.max_cooldown)
+            self._saude[candidato] = saude
+        return saude
+
+    def healths(self) -> Dict[Candidato, ModelHealth]:
+        return dict(self._saude)
+
+    def order(self, candidatos: List[Candidato]) -> List[Candidato]:
+        """Saudáveis primeiro, do mais rápido ao mais lento; breakers abertos no fim"""
+        if not candidatos:
+            return []
+        principal = candidatos[0]
+        posicao = {c: i for i, c in enumerate(candidatos)}
+
+        def chave(c: Candidato):
+            saude = self.health(c)
+            score = saude.score() * (self.preferencia if c == principal else 1.0)
+            return (not saude.available(), score, posicao[c])
+
+        return sorted(dict.fromkeys(candidatos), key=chave)
+
+    async def call(
+        self,
+        candidatos: List[Candidato],
+        fn: Callable[[str, str], Awaitable[Any]],
+        hedge_after: Optional[float] = None,
+        max_attempts: int = 3,
+    ) -> Tuple[Any, Candidato]:
+        """Tenta os candidatos em ordem; com `hedge_after` (s) dispara o próximo
+        em paralelo se o atual não responder a tempo. Retorna (resultado, candidato).
+
+        Texto vazio conta como falha. `fn` também pode devolver um stream já
+        aberto: aí a latência medida é a do primeiro token.
+        """
+        fila = self.order(candidatos)[:max(1, max_attempts)]
+        if not fila:
+            raise ValueError("Nenhum modelo de IA configurado")
+
+        pendentes: Dict[asyncio.Task, Tuple[Candidato, float]] = {}
+        erros: List[str] = []
+        primeiro = fila[0]
+        hedged = False
+
+        def disparar():
+            candidato = fila.pop(0)
+            tarefa = asyncio.create_task(fn(*candidato))
+            pendentes[tarefa] = (candidato, time.perf_counter())
+
+        disparar()
+        try:
+            while pendentes:
+                timeout = hedge_after if (hedge_after and fila) else None
+                feitas, _ = await asyncio.wait(
+                    pendentes.keys(), timeout=timeout, return_when=asyncio.FIRST_COMPLETED
+                )
+                if not feitas:
+                    # Estourou o orçamento de latência: hedge com o próximo modelo
+                    self.hedges_disparados += 1
+                    hedged = True
+                    disparar()
+                    continue
+                for tarefa in feitas:
+                    candidato, inicio = pendentes.pop(tarefa)
+                    ms = (time.perf_counter() - inicio) * 1000
+                    erro = tarefa.exception()
+                    resultado = None if erro else tarefa.result()
+                    vazio = resultado is None or (isinstance(resultado, str) and not resultado.strip())
+                    if erro is None and not vazio:
+                        self.health(candidato).record_success(ms)
+                        if hedged and candidato != primeiro:
+                            self.hedges_vencidos += 1
+                        return resultado, candidato
+                    motivo = str(erro) if erro else "resposta vazia"
+                    if not isinstance(erro, CandidatoIndisponivel):
+                        self.health(candidato).record_failure(motivo)
+                    erros.append(f"{candidato[1]}: {motivo}")
+                    if fila and not pendentes:
+                        self.failovers += 1
+                        disparar()
+            raise ValueError("Todos os modelos falharam - " + " | ".join(erros))
+        finally:
+            # Perdedoras: as que já terminaram (inclusive na mesma leva da
+            # vencedora) têm o stream fechado; as demais são canceladas
+            for tarefa in pendentes:
+                if tarefa.done():
+                    _descartar(tarefa)
+                else:
+                    tarefa.cancel()
+                    tarefa.add_done_callback(_descartar)
+
+    def stats(self) -> Dict:
+        return {
+            "failovers": self.failovers,
+            "hedges_fired": self.hedges_disparados,
+            "hedges_won": self.hedges_vencidos,
+            "models": {
+                f"{provider}/{model}" if provider == "gemini" else model: saude.stats()
+                for (provider, model), saude in self._saude.items()
+            },
+        }
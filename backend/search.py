@@ -0,0 +1,378 @@
+"""
+Busca textual no histórico das conversas
+
+As mensagens (cliente, bot e atendente) ficam num SQLite próprio com um
+índice FTS5 (tokenizador unicode61 sem acentos, a mesma normalização das
+intenções): o processo não guarda texto, ids nem autores em memória, só a
+fila de mensagens ainda não gravadas. Cada mensagem é uma linha de `docs`
+com id crescente; a consulta pede ao FTS5 os documentos do mais novo para
+o mais antigo e para assim que enche a página, e o cursor é o id do último.
+
+As gravações são write-behind como as das conversas: `add`/`remove_chat`
+só enfileiram e um task grava em lotes, numa thread dedicada. Uma consulta
+grava o que estiver pendente antes de ler. Mensagens repetidas (eventos de
+outro worker, reindexação do histórico) são ignoradas pelo (chat_id, id).
+
+Sintaxe: palavras soltas (todas precisam aparecer), "frases entre aspas"
+(na ordem, lado a lado) e `palavra*` para prefixo.
+"""
+import asyncio
+import re
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from intents import fold
+from records import Message
+
+_TERMO = re.compile(r'"([^"]*)"|(\S+)')
+
+
+def tokens(texto: str) -> List[str]:
+    return fold(texto).split()
+
+
+def _timestamp(valor: Optional[str]) -> float:
+    if not valor:
+        return 0.0
+    try:
+        return datetime.fromisoformat(valor).timestamp()
+    except ValueError:
+        return 0.0
+
+
+def parse_query(q: str) -> Tuple[List[str], List[str], List[List[str]]]:
+    """(palavras, prefixos, frases) já normalizadas"""
+    palavras: List[str] = []
+    prefixos: List[str] = []
+    frases: List[List[str]] = []
+    for frase, termo in _TERMO.findall(q or ""):
+        if frase:
+            partes = tokens(frase)
+            if len(partes) > 1:
+                frases.append(partes)
+            palavras.extend(partes)
+        elif termo.endswith("*") and tokens(termo):
+            partes = tokens(termo)
+            palavras.extend(partes[:-1])
+            prefixos.append(partes[-1])
+        else:
+            palavras.extend(tokens(termo))
+    return list(dict.fromkeys(palavras)), list(dict.fromkeys(prefixos)), frases
+
+
+def fts_query(q: str) -> str:
+    """Consulta no formato do FTS5 (termos entre aspas, todos obrigatórios)"""
+    palavras, prefixos, frases = parse_query(q)
+    termos = [f'"{" ".join(frase)}"' for frase in frases]
+    termos += [f'"{p}"' for p in palavras]
+    termos += [f'"{p}"*' for p in prefixos]
+    return " AND ".join(termos)
+
+
+class SearchIndex:
+    """Índice FTS5 das mensagens, num arquivo SQLite (ou em memória)"""
+
+    def __init__(
+        self,
+        path: str = ":memory:",
+        flush_interval: float = 0.5,
+        max_pending: int = 1000,
+        max_backlog: int = 100000,
+    ):
+        self.path = str(path)
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending  # acima disso o flush é antecipado
+        self.max_backlog = max_backlog  # acima disso (banco travado) mensagens novas são descartadas
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._db: Optional[sqlite3.Connection] = None
+        # Operações ainda não gravadas, na ordem: ("add", linha) | ("remove", chat_id) | ("clear",)
+        self._pendentes: List[tuple] = []
+        self._acordar: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._documentos: Optional[int] = None
+        # Algo ficou fora do índice: o histórico precisa ser reindexado no próximo startup
+        self._incompleto = False
+        self.perdas = 0
+        self.stats_counters = {"queries": 0, "indexed": 0, "flushes": 0, "errors": 0, "dropped": 0}
+        self._tempos_ms: List[float] = []
+
+    def __len__(self):
+        return (self._documentos or 0) + sum(1 for op in self._pendentes if op[0] == "add")
+
+    # ---- banco (só na thread dedicada) ----
+
+    def _conn(self) -> sqlite3.Connection:
+        if self._db is None:
+            self._db = sqlite3.connect(self.path, check_same_thread=False, timeout=10)
+            if self.path != ":memory:":
+                self._db.execute("PRAGMA journal_mode=WAL")
+                self._db.execute("PRAGMA synchronous=NORMAL")
+            with self._db:
+                self._db.executescript(
+                    "CREATE TABLE IF NOT EXISTS docs ("
+                    " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+                    " chat_id TEXT NOT NULL,"
+                    " msg_id TEXT NOT NULL,"
+                    " autor TEXT NOT NULL,"
+                    " ts REAL NOT NULL,"
+                    " texto TEXT NOT NULL,"
+                    " UNIQUE (chat_id, msg_id));"
+                    "CREATE INDEX IF NOT EXISTS idx_docs_chat ON docs(chat_id, id);"
+                    "CREATE VIRTUAL TABLE IF NOT EXISTS docs_fts USING fts5("
+                    " texto, content='docs', content_rowid='id',"
+                    " tokenize='unicode61 remove_diacritics 2');"
+                    "CREATE TRIGGER IF NOT EXISTS docs_ai AFTER INSERT ON docs BEGIN"
+                    " INSERT INTO docs_fts (rowid, texto) VALUES (new.id, new.texto); END;"
+                    "CREATE TRIGGER IF NOT EXISTS docs_ad AFTER DELETE ON docs BEGIN"
+                    " INSERT INTO docs_fts (docs_fts, rowid, texto) VALUES ('delete', old.id, old.texto); END;"
+                    "CREATE TABLE IF NOT EXISTS meta (chave TEXT PRIMARY KEY, valor TEXT);"
+                )
+            self._documentos = self._db.execute("SELECT COUNT(*) FROM docs").fetchone()[0]
+        return self._db
+
+    async def _run(self, fn, *args):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="search")
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, fn, *args)
+
+    def _aplicar(self, ops: List[tuple]):
+        db = self._conn()
+        lote: List[tuple] = []
+        with db:
+            for op in ops:
+                if op[0] == "add":
+                    lote.append(op[1])
+                    continue
+                if lote:
+                    self._inserir(db, lote)
+                    lote = []
+                if op[0] == "remove":
+                    self._documentos -= db.execute("DELETE FROM docs WHERE chat_id = ?", (op[1],)).rowcount
+                elif op[0] == "incompleto":
+                    db.execute("DELETE FROM meta WHERE chave = 'historico_indexado'")
+                else:
+                    db.execute("DELETE FROM docs")
+                    self._documentos = 0
+            if lote:
+                self._inserir(db, lote)
+
+    def _inserir(self, db: sqlite3.Connection, lote: List[tuple]):
+        cursor = db.executemany(
+            "INSERT OR IGNORE INTO docs (chat_id, msg_id, autor, ts, texto) VALUES (?, ?, ?, ?, ?)", lote
+        )
+        self._documentos += cursor.rowcount
+        self.stats_counters["indexed"] += cursor.rowcount
+
+    def _search(self, consulta, chat_id, autor, desde, ate, limit, antes_de):
+        if consulta and chat_id is None:
+            origem, ordem = "docs_fts JOIN docs d ON d.id = docs_fts.rowid", "docs_fts.rowid"
+            condicoes, params = ["docs_fts MATCH ?"], [consulta]
+        else:
+            # Um chat só: percorre as mensagens dele e confere cada uma no FTS
+            origem, ordem = "docs d", "d.id"
+            condicoes, params = [], []
+            if consulta:
+                condicoes.append("EXISTS (SELECT 1 FROM docs_fts WHERE docs_fts MATCH ? AND rowid = d.id)")
+                params.append(consulta)
+        for condicao, valor in (
+            ("d.chat_id = ?", chat_id),
+            ("d.autor = ?", autor),
+            ("d.ts >= ?", desde),
+            ("d.ts < ?", ate),
+            (f"{ordem} < ?", antes_de),
+        ):
+            if valor is not None:
+                condicoes.append(condicao)
+                params.append(valor)
+        params.append(limit + 1)
+        return self._conn().execute(
+            f"SELECT d.id, d.chat_id, d.msg_id, d.autor, d.ts, d.texto FROM {origem} "
+            f"WHERE {' AND '.join(condicoes)} ORDER BY {ordem} DESC LIMIT ?",
+            params,
+        ).fetchall()
+
+    def _get_meta(self, chave: str) -> Optional[str]:
+        row = self._conn().execute("SELECT valor FROM meta WHERE chave = ?", (chave,)).fetchone()
+        return row[0] if row else None
+
+    def _set_meta(self, chave: str, valor: Optional[str]):
+        db = self._conn()
+        with db:
+            if valor is None:
+                db.execute("DELETE FROM meta WHERE chave = ?", (chave,))
+            else:
+                db.execute("INSERT OR REPLACE INTO meta (chave, valor) VALUES (?, ?)", (chave, valor))
+
+    def _close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+    # ---- escrita (não bloqueia) ----
+
+    def add(self, chat_id: str, mensagem: Dict):
+        """Enfileira uma mensagem recém-adicionada à conversa"""
+        if isinstance(mensagem, Message):
+            linha = (chat_id, mensagem.id or "", mensagem.sender, mensagem.ts or 0.0, mensagem.text)
+        else:
+            linha = (
+                chat_id, mensagem.get("id") or "", mensagem.get("from") or "",
+                _timestamp(mensagem.get("timestamp")), mensagem.get("text") or "",
+            )
+        if len(self._pendentes) >= self.max_backlog:
+            self._perder()
+            self.stats_counters["dropped"] += 1
+            return
+        self._pendentes.append(("add", linha))
+        if len(self._pendentes) >= self.max_pending and self._acordar is not None:
+            self._acordar.set()
+
+    def add_conversa(self, conversa: Dict):
+        """Enfileira as mensagens de uma conversa (as já indexadas são ignoradas)"""
+        chat_id = conversa["chat_id"]
+        for mensagem in conversa.get("mensagens", []):
+            self.add(chat_id, mensagem)
+
+    def remove_chat(self, chat_id: str):
+        self._pendentes.append(("remove", chat_id))
+
+    def clear(self):
+        self._pendentes = [("clear",)]
+
+    def _perder(self):
+        self.perdas += 1
+        self._incompleto = True
+
+    async def flush(self):
+        """Grava as operações pendentes (em ordem, numa transação)"""
+        ops, self._pendentes = self._pendentes, []
+        if self._incompleto:
+            # Apaga a marca de histórico completo junto com o próximo lote que der certo
+            ops.insert(0, ("incompleto",))
+            self._incompleto = False
+        if not ops:
+            return
+        try:
+            await self._run(self._aplicar, ops)
+            self.stats_counters["flushes"] += 1
+        except Exception as e:
+            self.stats_counters["errors"] += 1
+            self._perder()
+            print(f"⚠️ Busca: erro gravando {len(ops)} operações: {e}")
+            # Lote perdido: o próximo startup reindexa o histórico. Se o banco
+            # recusar isto também, a marca sai no próximo flush que funcionar
+            try:
+                await self._run(self._set_meta, "historico_indexado", None)
+            except Exception:
+                pass
+
+    async def _loop(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._acordar.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._acordar.clear()
+            try:
+                await self.flush()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Erro gravando o índice da busca: {e}")
+
+    def start(self):
+        self._acordar = asyncio.Event()
+        if self._task is None:
+            self._task = asyncio.create_task(self._loop())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+        if self._executor is not None:
+            await self._run(self._close)
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    # ---- histórico ----
+
+    async def historico_indexado(self) -> bool:
+        return await self._run(self._get_meta, "historico_indexado") is not None
+
+    async def marcar_historico_indexado(self, perdas_no_inicio: int) -> bool:
+        """Marca o histórico como indexado se nada se perdeu desde `perdas_no_inicio`"""
+        await self.flush()
+        if self.perdas != perdas_no_inicio:
+            return False
+        await self._run(self._set_meta, "historico_indexado", datetime.now().isoformat())
+        return True
+
+    # ---- consulta ----
+
+    @staticmethod
+    def parse_cursor(cursor: Optional[str]) -> Optional[int]:
+        if not cursor or not cursor.isdigit():
+            return None
+        return int(cursor)
+
+    async def search(
+        self,
+        q: str = "",
+        chat_id: Optional[str] = None,
+        autor: Optional[str] = None,
+        desde: Optional[float] = None,
+        ate: Optional[float] = None,
+        limit: int = 20,
+        cursor: Optional[str] = None,
+    ) -> Tuple[List[Dict], Optional[str]]:
+        """Página de resultados do mais novo ao mais antigo + cursor da próxima"""
+        inicio = time.perf_counter()
+        self.stats_counters["queries"] += 1
+        consulta = fts_query(q)
+        if not consulta and chat_id is None:
+            return self._fim(inicio, [], None)  # sem termos nem chat: nada a procurar
+        await self.flush()
+        rows = await self._run(
+            self._search, consulta, chat_id, autor, desde, ate, limit, self.parse_cursor(cursor)
+        )
+        proximo = str(rows[limit - 1][0]) if len(rows) > limit else None
+        resultados = [
+            {
+                "chat_id": chat,
+                "message": {
+                    "id": msg_id,
+                    "from": autor_msg,
+                    "text": texto,
+                    "timestamp": datetime.fromtimestamp(ts).isoformat() if ts else None,
+                },
+            }
+            for _, chat, msg_id, autor_msg, ts, texto in rows[:limit]
+        ]
+        return self._fim(inicio, resultados, proximo)
+
+    def _fim(self, inicio: float, resultados: List[Dict], proximo: Optional[str]):
+        self._tempos_ms.append((time.perf_counter() - inicio) * 1000)
+        if len(self._tempos_ms) > 1000:
+            del self._tempos_ms[:500]
+        return resultados, proximo
+
+    def stats(self) -> Dict:
+        tempos = sorted(self._tempos_ms)
+        return {
+            "documents": len(self),
+            "pending": len(self._pendentes),
+            "losses": self.perdas,
+            "path": self.path,
+            "query_p50_ms": round(tempos[len(tempos) // 2], 3) if tempos else None,
+            "query_p99_ms": round(tempos[int(len(tempos) * 0.99)], 3) if tempos else None,
+            **self.stats_counters,
+        }
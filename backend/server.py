@@ -1,15 +1,43 @@
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect, HTTPException, Request
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect, HTTPException, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response
 from pydantic import BaseModel
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, AsyncIterator, Awaitable, Callable, Mapping
 import os
 import json
+import time
 import asyncio
 import aiohttp
-from datetime import datetime
+import functools
+import inspect
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta
 from pathlib import Path
 
+from cluster import ErroRemoto, create_bus
+from http_pool import HttpPool
+from ingest import DedupIndex, IdGenerator
+from intents import DEFAULT_INTENTS, IntentMatcher
+from prompt_registry import PromptRegistry
+from records import HISTORICO_MAX_ENTRADAS, Conversation, Message, como_dict
+from storage import ConversationCache, WriteBehindWriter, create_store
+from search import SearchIndex
+from summaries import SummaryIndex, resumo_conversa
+from config_store import ConfigStore
+from context_window import entrada_historico, montar_mensagens, prompt_com_resumo, tokens_historico
+from events import PROTOCOL_VERSION, BroadcastHub, EventStream
+from jobs import PRIORIDADE_ALTA, PRIORIDADE_NORMAL, ChatCoalescer, JobQueue
+from metrics import GaugeFunc, Histogram, Registry, timed
+from outbox import Outbox, create_outbox_store
+from ratelimit import KeyedRateLimiter, TokenBucket
+from response_cache import ResponseCache
+from routing import CandidatoIndisponivel, ModelHealth, ModelRouter
+from streaming import SentenceBuffer, iter_in_thread, iter_sse, open_stream
+from whatsapp_state import WhatsAppState
+
 # Carregar .env manualmente
 env_path = Path(__file__).parent / ".env"
 if env_path.exists():
@@ -37,242 +65,305 @@ AVAILABLE_MODELS = {
         "deepseek/deepseek-r1:free": {
             "name": "DeepSeek R1 (Gratuito)",
             "description": "Modelo de raciocínio avançado, ótimo para respostas complexas",
-            "free": True
+            "free": True,
+            "context_tokens": 163840
         },
         "deepseek/deepseek-chat:free": {
             "name": "DeepSeek Chat (Gratuito)", 
             "description": "Modelo de chat rápido e eficiente",
-            "free": True
+            "free": True,
+            "context_tokens": 163840
         },
         "meta-llama/llama-3.3-70b-instruct:free": {
             "name": "Llama 3.3 70B (Gratuito)",
             "description": "Modelo grande da Meta, excelente qualidade",
-            "free": True
+            "free": True,
+            "context_tokens": 131072
         },
         "meta-llama/llama-3.1-8b-instruct:free": {
             "name": "Llama 3.1 8B (Gratuito)",
             "description": "Modelo menor mas muito rápido",
-            "free": True
+            "free": True,
+            "context_tokens": 131072
         },
         "google/gemma-2-9b-it:free": {
             "name": "Google Gemma 2 9B (Gratuito)",
             "description": "Modelo do Google, bom para português",
-            "free": True
+            "free": True,
+            "context_tokens": 8192
         },
         "qwen/qwen-2.5-72b-instruct:free": {
             "name": "Qwen 2.5 72B (Gratuito)",
             "description": "Modelo chinês muito capaz, multilíngue",
-            "free": True
+            "free": True,
+            "context_tokens": 32768
         },
         "qwen/qwen-2.5-coder-32b-instruct:free": {
             "name": "Qwen 2.5 Coder 32B (Gratuito)",
             "description": "Especializado em código e instruções",
-            "free": True
+            "free": True,
+            "context_tokens": 32768
         },
         "mistralai/mistral-small-24b-instruct-2501:free": {
             "name": "Mistral Small 24B (Gratuito)",
             "description": "Modelo europeu rápido e eficiente",
-            "free": True
+            "free": True,
+            "context_tokens": 32768
         },
         "microsoft/phi-3-mini-128k-instruct:free": {
             "name": "Microsoft Phi-3 Mini (Gratuito)",
             "description": "Modelo compacto da Microsoft",
-            "free": True
+            "free": True,
+            "context_tokens": 128000
         },
         "openchat/openchat-7b:free": {
             "name": "OpenChat 7B (Gratuito)",
             "description": "Modelo de chat open source",
-            "free": True
+            "free": True,
+            "context_tokens": 8192
         }
     },
     "gemini": {
         "gemini-2.5-flash": {
             "name": "Gemini 2.5 Flash",
             "description": "Mais recente e rápido",
-            "free": False
+            "free": False,
+            "context_tokens": 1048576
         },
         "gemini-2.5-pro": {
             "name": "Gemini 2.5 Pro",
             "description": "Mais capaz, respostas melhores",
-            "free": False
+            "free": False,
+            "context_tokens": 1048576
         },
         "gemini-2.0-flash": {
             "name": "Gemini 2.0 Flash",
             "description": "Versão estável e rápida",
-            "free": False
+            "free": False,
+            "context_tokens": 1048576
         },
         "gemini-1.5-flash": {
             "name": "Gemini 1.5 Flash",
             "description": "Versão anterior, muito estável",
-            "free": False
+            "free": False,
+            "context_tokens": 1048576
         },
         "gemini-1.5-pro": {
             "name": "Gemini 1.5 Pro",
             "description": "Versão anterior, alta qualidade",
-            "free": False
+            "free": False,
+            "context_tokens": 2097152
         }
     }
 }
 
 # ==================== CONFIGURAÇÃO ====================
-CONFIG_FILE = Path(__file__).parent / "config.json"
-
-def load_config():
-    """Carrega configuração do arquivo"""
-    default_config = {
-        "provider": "openrouter",
-        "gemini_api_key": os.getenv("GEMINI_API_KEY", ""),
-        "openrouter_api_key": os.getenv("OPENROUTER_API_KEY", ""),
-        "selected_model": "deepseek/deepseek-r1:free",
-        "auto_reply": True,
-        "human_takeover_minutes": 60,
-        "site_url": "https://sushiakicb.shop",
-        "business_name": "Sushi Aki"
-    }
-    
-    if CONFIG_FILE.exists():
-        try:
-            with open(CONFIG_FILE) as f:
-                saved = json.load(f)
-                default_config.update(saved)
-        except Exception:
-            pass
-    
-    return default_config
-
-def save_config(cfg):
-    """Salva configuração no arquivo"""
-    try:
-        with open(CONFIG_FILE, 'w') as f:
-            json.dump(cfg, f, indent=2)
-        return True
-    except Exception as e:
-        print(f"Erro ao salvar config: {e}")
-        return False
+CONFIG_FILE = Path(os.getenv("CONFIG_FILE", Path(__file__).parent / "config.json"))
+
+DEFAULT_CONFIG = {
+    "provider": "openrouter",
+    "gemini_api_key": os.getenv("GEMINI_API_KEY", ""),
+    "openrouter_api_key": os.getenv("OPENROUTER_API_KEY", ""),
+    "selected_model": "deepseek/deepseek-r1:free",
+    "auto_reply": True,
+    "human_takeover_minutes": 60,
+    "site_url": "https://sushiakicb.shop",
+    "business_name": "Sushi Aki",
+    "debounce_ms": 1200,
+    "fallback_enabled": True,
+    "fallback_models": [],
+    # Fallback de outro provedor na cadeia padrão (entra só com a gemini_api_key configurada)
+    "gemini_fallback_model": "gemini-2.0-flash",
+    "fallback_max_attempts": 3,
+    "hedge_ms": 0,
+    "streaming": True,
+    "stream_min_chars": 80,
+    "response_cache": True,
+    "intents": {},
+    "history_token_budget": 1500
+}
 
-# Carregar configuração inicial
-config = load_config()
+def aplicar_config(anterior: Optional[Mapping], nova: Mapping):
+    """Passa a usar o snapshot novo e atualiza o que depende dele"""
+    global config
+    config = nova
+    if anterior is None:
+        return
+    if (anterior.get("site_url") != nova.get("site_url")
+            or anterior.get("business_name") != nova.get("business_name")):
+        response_cache.invalidate()
+    if anterior.get("intents") != nova.get("intents"):
+        # Recompila na hora, sem reiniciar
+        intent_matcher.reload(intents_configurados())
+    prompt_registry.invalidate()
+
+async def config_recarregada():
+    # Cada worker recarrega o arquivo por conta própria: avisa só os seus painéis
+    publicar_local({"type": "config_updated"})
+
+# `config` é um snapshot imutável trocado por inteiro a cada alteração;
+# gravação agrupada e atômica, edições manuais no arquivo valem sem reiniciar
+config_store = ConfigStore(
+    CONFIG_FILE,
+    DEFAULT_CONFIG,
+    debounce=float(os.getenv("CONFIG_SAVE_DEBOUNCE", "0.5")),
+    check_interval=float(os.getenv("CONFIG_CHECK_INTERVAL", "2")),
+    on_change=aplicar_config,
+    on_reload=config_recarregada
+)
+config = config_store.carregar()
 
 # ==================== PROMPTS - LOBO DE WALL STREET ====================
 
+# Textos em prompts/*.txt; renderizados uma vez por versão da config
+PROMPTS_DIR = Path(os.getenv("PROMPTS_DIR", str(Path(__file__).parent / "prompts")))
+
+def contexto_prompts() -> Dict[str, str]:
+    return {
+        "business_name": config.get("business_name", "Sushi Aki"),
+        "site_url": config.get("site_url", "https://sushiakicb.shop")
+    }
+
+# Arquivo editado no disco também invalida as respostas em cache (ver response_cache)
+prompt_registry = PromptRegistry(
+    PROMPTS_DIR,
+    contexto_prompts,
+    on_change=lambda: response_cache.invalidate()
+)
+
 def get_system_prompt():
     """Prompt principal do bot - modo vendedor persuasivo"""
-    return f"""Você é SORA 🍣, vendedor expert do {config.get('business_name', 'Sushi Aki')}.
-
-🎯 SUA MISSÃO ÚNICA: Fazer o cliente finalizar o pedido no site {config.get('site_url', 'https://sushiakicb.shop')}
-
-⚡ TÉCNICAS DE VENDAS (use naturalmente):
-1. URGÊNCIA: "Última chance", "Poucos combos restantes", "Promoção acaba em breve"
-2. ESCASSEZ: "Só temos mais X unidades", "Item mais pedido, acaba rápido"
-3. PROVA SOCIAL: "Mais de 500 pedidos hoje", "Nosso combo mais amado"
-4. RECIPROCIDADE: "Vou te dar uma dica especial", "Deixa eu te ajudar"
-5. AUTORIDADE: "4 unidades em Curitiba", "Anos de experiência"
-6. COMPROMISSO: "Qual combo te interessou mais?", "Posso reservar pra você?"
-
-💬 ESTILO DE COMUNICAÇÃO:
-- Respostas CURTAS (máx 3 linhas)
-- Tom AMIGO, confiante, nunca robótico
-- Use POUCOS emojis (1-2 por mensagem)
-- Faça PERGUNTAS que levam ao site
-- SEMPRE termine direcionando ao site
-
-🚫 NUNCA FAÇA:
-- Aceitar pedidos fora do site
-- Prometer pagamento na entrega  
-- Repetir a mesma frase de forma idêntica
-- Ser insistente de forma irritante
-- Dar informações que não levem à venda
-
-📍 INFORMAÇÕES DO NEGÓCIO:
-- 4 unidades físicas em Curitiba
-- Entrega em toda Curitiba e região
-- Pagamento: Pix e cartão
-- Cardápio APENAS no site
-
-🔥 FRASES DE FECHAMENTO (varie):
-- "Aproveita que tá com promoção! 👉 {config.get('site_url')}"
-- "Quer que eu te mande o link direto? {config.get('site_url')}"
-- "Só acessar aqui e escolher: {config.get('site_url')}"
-- "Posso garantir que vai amar! Pede pelo site: {config.get('site_url')}"
-
-LEMBRE: Cada mensagem deve aproximar o cliente de fazer o pedido no site!"""
+    return prompt_registry.render("system")
 
 def get_human_mode_prompt():
     """Prompt para modo 100% humanizado (quando cliente pede atendente)"""
-    return f"""Você agora é um ATENDENTE HUMANO REAL do {config.get('business_name', 'Sushi Aki')}.
-
-🧑 PERSONALIDADE COMPLETA:
-- Nome: Pode ser "Carol", "Marcos", "Juliana" ou "Rafael" (escolha um e mantenha)
-- Você trabalha há 2 anos no restaurante
-- Ama sushi e conhece o cardápio de cor
-- É apaixonado por atender bem
-
-💬 COMO AGIR:
-- Fale como humano REAL (com pequenas imperfeições naturais)
-- Use gírias leves: "cara", "nossa", "sério?", "que legal"
-- Demonstre emoção genuína
-- Conte pequenas histórias pessoais
-- Admita quando não souber algo
-- Seja MUITO paciente e compreensivo
-
-🎯 SEU OBJETIVO CONTINUA O MESMO:
-Criar conexão e confiança para o cliente pedir pelo site.
-Mas agora de forma 100% humana e empática.
-
-📍 CONTEXTO:
-- Site: {config.get('site_url', 'https://sushiakicb.shop')}
-- Aceita Pix e cartão
-- 4 lojas em Curitiba
-- Entrega rápida
-
-🗣️ EXEMPLOS DE RESPOSTAS HUMANIZADAS:
-- "Oi! Aqui é a Carol 😊 tava vendo que você tá em dúvida né? Posso te ajudar!"
-- "Nossa, esse combo é meu favorito! Sério, é muito bom"
-- "Olha, vou ser sincero contigo... esse é o mais pedido aqui"
-- "Relaxa, acontece! Qualquer coisa me chama aqui"
-
-IMPORTANTE: Mantenha a mesma identidade humana durante toda a conversa!"""
+    return prompt_registry.render("human_mode")
 
 def get_mensagem_inicial():
-    return f"""Oi! 😊 Bem-vindo ao {config.get('business_name', 'Sushi Aki')} 🍣
-
-Nosso cardápio tá imperdível hoje!
-👉 Confere aqui: {config.get('site_url', 'https://sushiakicb.shop')}
+    return prompt_registry.render("mensagem_inicial")
 
-Aceita Pix e cartão 💳 | Entrega em toda Curitiba
+def get_resposta_desconfianca():
+    return prompt_registry.render("resposta_desconfianca")
 
-Posso te ajudar a escolher? 😉"""
+# Palavras que indicam desconfiança / pedido de atendente humano
+# (padrões em intents.DEFAULT_INTENTS; o painel pode sobrescrever via config "intents")
+def intents_configurados() -> Dict[str, List[str]]:
+    return {**DEFAULT_INTENTS, **(config.get("intents") or {})}
 
-def get_resposta_desconfianca():
-    return f"""Entendo sua preocupação 😊
+intent_matcher = IntentMatcher(intents_configurados())
 
-Olha, a gente tem 4 lojas físicas em Curitiba. Pode até passar aqui pra conhecer! 
+# ==================== CLIENTE HTTP ====================
 
-Mas o mais prático é pedir pelo site oficial:
-👉 {config.get('site_url', 'https://sushiakicb.shop')}
+# Sessão aiohttp compartilhada (aberta no startup, fechada no shutdown)
+http_pool = HttpPool.from_env()
+OPENROUTER_TIMEOUT = float(os.getenv("OPENROUTER_TIMEOUT", "30"))
+WHATSAPP_TIMEOUT = float(os.getenv("WHATSAPP_TIMEOUT", "10"))
+# Trocável para apontar a um mock local (benchmarks/load_test.py)
+OPENROUTER_URL = os.getenv("OPENROUTER_URL", "https://openrouter.ai/api/v1/chat/completions")
 
-Pagamento seguro por Pix ou cartão, com confirmação na hora 🍣"""
+# ==================== MÉTRICAS ====================
 
-# Palavras que indicam desconfiança
-DESCONFIANCA = ["golpe", "confiável", "fake", "pix antes", "site seguro", "fraude", "verdade", "mentira", "enganar", "roubo", "falso", "scam"]
+# Exportadas em /api/metrics (formato texto do Prometheus); os gauges são lidos na coleta
+metrics = Registry()
+WEBHOOK_LATENCY = Histogram(
+    metrics, "sushibot_webhook_latency_seconds",
+    "Tempo de resposta dos webhooks do bot Node.js", ["route"]
+)
+LLM_LATENCY = Histogram(
+    metrics, "sushibot_llm_latency_seconds",
+    "Duração das chamadas aos provedores de IA (resposta completa)", ["provider", "model", "outcome"]
+)
+LLM_FIRST_TOKEN = Histogram(
+    metrics, "sushibot_llm_first_token_seconds",
+    "Tempo até o primeiro token nas chamadas em streaming", ["provider", "model", "outcome"]
+)
+WHATSAPP_SEND_LATENCY = Histogram(
+    metrics, "sushibot_whatsapp_send_seconds",
+    "Duração do envio de mensagens pelo bot Node.js"
+)
+REPLY_LATENCY = Histogram(
+    metrics, "sushibot_reply_seconds",
+    "Tempo de processamento de uma resposta da fila (IA + envio)", ["outcome"]
+)
+BROADCAST_FANOUT = Histogram(
+    metrics, "sushibot_broadcast_fanout_seconds",
+    "Tempo para serializar e enfileirar um evento para todos os painéis",
+    buckets=(0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1)
+)
+WS_DELIVERY_LATENCY = Histogram(
+    metrics, "sushibot_ws_delivery_seconds",
+    "Tempo entre a publicação de um evento e a escrita no socket de cada painel"
+)
 
-# Palavras que indicam pedido de atendente humano
-PEDIDO_HUMANO = ["atendente", "humano", "pessoa", "real", "alguém", "funcionário", "gerente", "falar com alguém", "não é robô", "bot", "robozinho", "máquina", "quero falar"]
+def _estado_breakers() -> Dict[tuple, int]:
+    estados = {}
+    for (provider, model), saude in model_router.healths().items():
+        for estado in ("closed", "open", "half_open"):
+            estados[(provider, model, estado)] = int(saude.state == estado)
+    return estados
+
+GaugeFunc(metrics, "sushibot_queue_depth", "Jobs aguardando na fila", lambda: {
+    "respostas": reply_queue.depth,
+    "resumos": resumo_queue.depth
+}, ["queue"])
+GaugeFunc(metrics, "sushibot_queue_in_flight", "Jobs em execução", lambda: {
+    "respostas": reply_queue.in_flight,
+    "resumos": resumo_queue.in_flight
+}, ["queue"])
+GaugeFunc(metrics, "sushibot_coalescer_waiting_chats", "Chats com rajada aguardando a janela de debounce",
+          lambda: reply_coalescer.stats()["waiting_chats"])
+GaugeFunc(metrics, "sushibot_pending_writes", "Conversas alteradas ainda não gravadas no banco",
+          lambda: conversa_writer.pending)
+GaugeFunc(metrics, "sushibot_conversations_cached", "Conversas ativas em memória", lambda: len(conversas))
+GaugeFunc(metrics, "sushibot_conversations_total", "Conversas conhecidas (inclusive fora do cache)",
+          lambda: len(resumos))
+GaugeFunc(metrics, "sushibot_search_documents", "Mensagens no índice de busca", lambda: len(busca))
+GaugeFunc(metrics, "sushibot_websocket_clients", "Painéis conectados ao WebSocket", lambda: len(ws_hub))
+GaugeFunc(metrics, "sushibot_ai_in_flight", "Gerações de IA em andamento", lambda: admissao_stats["in_flight"])
+GaugeFunc(metrics, "sushibot_ai_waiting", "Gerações aguardando vaga (AI_MAX_CONCURRENCY)",
+          lambda: admissao_stats["waiting"])
+GaugeFunc(metrics, "sushibot_ai_shed_total", "Respostas substituídas pelo texto de sobrecarga",
+          lambda: admissao_stats["shed"] + admissao_stats["shed_silent"], tipo="counter")
+GaugeFunc(metrics, "sushibot_response_cache_hits_total", "Respostas servidas pelo cache", lambda: {
+    "exact": response_cache.stats_counters["hits_exact"],
+    "similar": response_cache.stats_counters["hits_similar"]
+}, ["kind"], tipo="counter")
+GaugeFunc(metrics, "sushibot_response_cache_misses_total", "Consultas ao cache sem resposta",
+          lambda: response_cache.stats_counters["misses"], tipo="counter")
+GaugeFunc(metrics, "sushibot_webhook_duplicates_total", "Reenvios do webhook de mensagens ignorados",
+          lambda: mensagens_recebidas.stats_counters["replayed"] + mensagens_recebidas.stats_counters["joined"]
+          + ingestao_stats["found_in_history"], tipo="counter")
+GaugeFunc(metrics, "sushibot_outbox_queued", "Mensagens aguardando envio ao WhatsApp", lambda: outbox.depth)
+GaugeFunc(metrics, "sushibot_outbox_messages_total", "Mensagens concluídas pela fila de saída", lambda: {
+    "sent": outbox.stats_counters["sent"],
+    "failed": outbox.stats_counters["failed"],
+    "rejected": outbox.stats_counters["rejected"]
+}, ["result"], tipo="counter")
+GaugeFunc(metrics, "sushibot_outbox_retries_total", "Reenvios ao bot Node.js",
+          lambda: outbox.stats_counters["retries"], tipo="counter")
+GaugeFunc(metrics, "sushibot_ai_failovers_total", "Trocas de modelo após falha", lambda: model_router.failovers,
+          tipo="counter")
+GaugeFunc(metrics, "sushibot_ai_breaker_state", "Estado do circuit breaker por modelo",
+          _estado_breakers, ["provider", "model", "state"])
 
 # ==================== CLIENTES DE IA ====================
 
-async def call_openrouter(messages: list, model: str) -> str:
-    """Chama a API da OpenRouter"""
+def openrouter_headers() -> dict:
     api_key = config.get("openrouter_api_key", "")
     if not api_key:
         raise ValueError("API Key da OpenRouter não configurada")
     
-    headers = {
+    return {
         "Authorization": f"Bearer {api_key}",
         "Content-Type": "application/json",
         "HTTP-Referer": config.get("site_url", "https://sushiakicb.shop"),
         "X-Title": config.get("business_name", "Sushi Aki Bot")
     }
+
+@timed(LLM_LATENCY, lambda messages, model: {"provider": "openrouter", "model": model})
+async def call_openrouter(messages: list, model: str) -> str:
+    """Chama a API da OpenRouter"""
+    headers = openrouter_headers()
     
     payload = {
         "model": model,
@@ -281,157 +372,707 @@ async def call_openrouter(messages: list, model: str) -> str:
         "temperature": 0.8
     }
     
-    async with aiohttp.ClientSession() as session:
-        async with session.post(
-            "https://openrouter.ai/api/v1/chat/completions",
-            headers=headers,
-            json=payload,
-            timeout=aiohttp.ClientTimeout(total=30)
-        ) as response:
-            if response.status != 200:
-                error_text = await response.text()
-                raise ValueError(f"Erro OpenRouter ({response.status}): {error_text}")
-            
-            data = await response.json()
-            return data["choices"][0]["message"]["content"]
+    session = await http_pool.session()
+    async with session.post(
+        OPENROUTER_URL,
+        headers=headers,
+        json=payload,
+        timeout=http_pool.timeout(OPENROUTER_TIMEOUT)
+    ) as response:
+        if response.status != 200:
+            error_text = await response.text()
+            raise ValueError(f"Erro OpenRouter ({response.status}): {error_text}")
+        
+        data = await response.json()
+        return data["choices"][0]["message"]["content"]
 
-def call_gemini(messages: list, model: str, system_prompt: str) -> str:
-    """Chama a API do Google Gemini"""
+async def stream_openrouter(messages: list, model: str) -> AsyncIterator[str]:
+    """Chama a OpenRouter com stream=True e devolve os tokens conforme chegam (SSE)"""
+    headers = openrouter_headers()
+    
+    payload = {
+        "model": model,
+        "messages": messages,
+        "max_tokens": 500,
+        "temperature": 0.8,
+        "stream": True
+    }
+    
+    session = await http_pool.session()
+    async with session.post(
+        OPENROUTER_URL,
+        headers=headers,
+        json=payload,
+        # Modelos de raciocínio demoram no total, mas não podem ficar mudos
+        timeout=http_pool.stream_timeout(OPENROUTER_TIMEOUT)
+    ) as response:
+        if response.status != 200:
+            error_text = await response.text()
+            raise ValueError(f"Erro OpenRouter ({response.status}): {error_text}")
+        
+        async for data in iter_sse(response.content):
+            if data == "[DONE]":
+                return
+            evento = json.loads(data)
+            if "error" in evento:
+                raise ValueError(f"Erro OpenRouter (stream): {evento['error']}")
+            choices = evento.get("choices") or [{}]
+            texto = (choices[0].get("delta") or {}).get("content")
+            if texto:
+                yield texto
+
+# O SDK do Gemini é síncrono: as chamadas rodam num pool de threads limitado
+# para nunca travar o event loop (webhooks, WebSocket, painel)
+GEMINI_MAX_CONCURRENCY = int(os.getenv("GEMINI_MAX_CONCURRENCY", "4"))
+GEMINI_MODEL_CACHE_SIZE = 16
+gemini_executor = ThreadPoolExecutor(max_workers=GEMINI_MAX_CONCURRENCY, thread_name_prefix="gemini")
+_gemini_models: "OrderedDict[tuple, Any]" = OrderedDict()
+_gemini_configured_key: Optional[str] = None
+_gemini_lock = threading.Lock()
+
+def get_gemini_model(api_key: str, model: str, system_prompt: str):
+    """Retorna o GenerativeModel em cache para (api_key, model, system_prompt)"""
+    global _gemini_configured_key
     import google.generativeai as genai
     
+    key = (api_key, model, system_prompt)
+    with _gemini_lock:
+        # genai.configure é global: só reconfigura quando a chave muda
+        if api_key != _gemini_configured_key:
+            genai.configure(api_key=api_key)
+            _gemini_configured_key = api_key
+            _gemini_models.clear()
+        
+        gemini_model = _gemini_models.get(key)
+        if gemini_model is None:
+            gemini_model = genai.GenerativeModel(
+                model_name=model,
+                system_instruction=system_prompt
+            )
+            _gemini_models[key] = gemini_model
+            if len(_gemini_models) > GEMINI_MODEL_CACHE_SIZE:
+                _gemini_models.popitem(last=False)
+        else:
+            _gemini_models.move_to_end(key)
+        return gemini_model
+
+def gemini_chat(messages: list, model: str, system_prompt: str):
+    """Abre um chat do Gemini com todas as mensagens menos a última como histórico"""
     api_key = config.get("gemini_api_key", "")
     if not api_key:
         raise ValueError("API Key do Gemini não configurada")
     
-    genai.configure(api_key=api_key)
-    
-    gemini_model = genai.GenerativeModel(
-        model_name=model,
-        system_instruction=system_prompt
-    )
+    gemini_model = get_gemini_model(api_key, model, system_prompt)
     
     # Converter mensagens para formato Gemini
     history = []
     for msg in messages[:-1]:
+        if msg["role"] == "system":
+            continue
         role = "user" if msg["role"] == "user" else "model"
         history.append({"role": role, "parts": [msg["content"]]})
     
-    chat = gemini_model.start_chat(history=history)
+    return gemini_model.start_chat(history=history)
+
+def call_gemini(messages: list, model: str, system_prompt: str) -> str:
+    """Chama a API do Google Gemini (bloqueante - use call_gemini_async)"""
+    chat = gemini_chat(messages, model, system_prompt)
     response = chat.send_message(messages[-1]["content"])
     return response.text
 
-async def generate_ai_response(mensagem: str, historico: list, modo_humano: bool = False) -> str:
-    """Gera resposta usando o provedor configurado"""
+def stream_gemini_sync(messages: list, model: str, system_prompt: str):
+    """Trechos da resposta do Gemini conforme chegam (bloqueante - use stream_gemini)"""
+    chat = gemini_chat(messages, model, system_prompt)
+    for chunk in chat.send_message(messages[-1]["content"], stream=True):
+        yield chunk.text
+
+@timed(LLM_LATENCY, lambda messages, model, system_prompt: {"provider": "gemini", "model": model})
+async def call_gemini_async(messages: list, model: str, system_prompt: str) -> str:
+    """Executa call_gemini no pool limitado sem bloquear o event loop"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(gemini_executor, call_gemini, messages, model, system_prompt)
+
+def stream_gemini(messages: list, model: str, system_prompt: str) -> AsyncIterator[str]:
+    """Streaming do Gemini consumido numa thread do mesmo pool limitado"""
+    return iter_in_thread(gemini_executor, lambda: stream_gemini_sync(messages, model, system_prompt))
+
+# ==================== ROTEAMENTO DE MODELOS ====================
+
+# Circuit breaker + estatísticas por modelo; decide a ordem das tentativas
+model_router = ModelRouter(
+    failure_threshold=int(os.getenv("AI_BREAKER_FAILURES", "3")),
+    cooldown=float(os.getenv("AI_BREAKER_COOLDOWN", "30"))
+)
+
+def provedor_do_modelo(model: str) -> Optional[str]:
+    for provider, modelos in AVAILABLE_MODELS.items():
+        if model in modelos:
+            return provider
+    return None
+
+def cadeia_modelos() -> List[tuple]:
+    """Modelo escolhido no painel seguido dos fallbacks com API Key configurada"""
     provider = config.get("provider", "openrouter")
-    model = config.get("selected_model", "deepseek/deepseek-r1:free")
-    
-    # Escolher prompt baseado no modo
-    system_prompt = get_human_mode_prompt() if modo_humano else get_system_prompt()
+    cadeia = [(provider, config.get("selected_model", "deepseek/deepseek-r1:free"))]
+    if not config.get("fallback_enabled", True):
+        return cadeia
     
-    # Construir mensagens
-    messages = [{"role": "system", "content": system_prompt}]
+    fallbacks = config.get("fallback_models") or []
+    if not fallbacks:
+        # Padrão: os modelos gratuitos da OpenRouter, na ordem de AVAILABLE_MODELS, com
+        # o Gemini de fallback logo depois do primeiro deles: outro provedor dentro das
+        # `fallback_max_attempts` tentativas cobre a OpenRouter inteira fora do ar
+        fallbacks = [m for m, info in AVAILABLE_MODELS["openrouter"].items() if info.get("free")]
+        if config.get("gemini_fallback_model"):
+            fallbacks.insert(1, config["gemini_fallback_model"])
     
-    for msg in historico[-10:]:
-        role = "user" if msg["role"] == "user" else "assistant"
-        messages.append({"role": role, "content": msg["content"]})
+    chaves = {
+        "openrouter": bool(config.get("openrouter_api_key")),
+        "gemini": bool(config.get("gemini_api_key"))
+    }
+    for model in fallbacks:
+        provedor = provedor_do_modelo(model)
+        if provedor and chaves.get(provedor) and (provedor, model) not in cadeia:
+            cadeia.append((provedor, model))
+    return cadeia
+
+# ==================== LIMITES DE USO DA IA ====================
+
+# Gerações simultâneas (respostas + resumos), independente de quantos workers existam
+AI_MAX_CONCURRENCY = int(os.getenv("AI_MAX_CONCURRENCY", "4"))
+ai_semaphore = asyncio.Semaphore(AI_MAX_CONCURRENCY)
+
+# Cota por provedor (a gratuita da OpenRouter é ~20 req/min); 0 desliga
+provider_limiters = {
+    "openrouter": TokenBucket(
+        rate=float(os.getenv("AI_RATE_OPENROUTER_PER_MIN", "20")) / 60,
+        burst=float(os.getenv("AI_BURST_OPENROUTER", "5"))
+    ),
+    "gemini": TokenBucket(
+        rate=float(os.getenv("AI_RATE_GEMINI_PER_MIN", "60")) / 60,
+        burst=float(os.getenv("AI_BURST_GEMINI", "10"))
+    )
+}
+AI_RATE_MAX_WAIT = float(os.getenv("AI_RATE_MAX_WAIT", "10"))
+
+# Respostas com IA por chat: spam ou lista de transmissão em loop não esgota a cota
+chat_limiter = KeyedRateLimiter(
+    rate=float(os.getenv("CHAT_RATE_PER_MIN", "6")) / 60,
+    burst=float(os.getenv("CHAT_BURST", "3"))
+)
+
+# Fila de respostas acima disso: responde com o texto fixo em vez da IA
+REPLY_SHED_DEPTH = int(os.getenv("REPLY_SHED_DEPTH", "100"))
+# No máximo um texto fixo de sobrecarga por chat a cada 10 minutos
+shed_limiter = KeyedRateLimiter(rate=1 / 600, burst=1)
+admissao_stats = {"in_flight": 0, "waiting": 0, "shed": 0, "shed_silent": 0, "chat_limited": 0}
+
+@asynccontextmanager
+async def vaga_ia():
+    """Ocupa uma das AI_MAX_CONCURRENCY vagas de geração"""
+    admissao_stats["waiting"] += 1
+    try:
+        await ai_semaphore.acquire()
+    finally:
+        admissao_stats["waiting"] -= 1
+    admissao_stats["in_flight"] += 1
+    try:
+        yield
+    finally:
+        admissao_stats["in_flight"] -= 1
+        ai_semaphore.release()
+
+async def reservar_provedor(provider: str):
+    """Espera uma ficha da cota do provedor; sem ficha, o router tenta o próximo modelo"""
+    bucket = provider_limiters.get(provider)
+    if bucket is not None and not await bucket.acquire(AI_RATE_MAX_WAIT):
+        raise CandidatoIndisponivel(f"limite de taxa do provedor {provider}")
+
+async def consumir_stream(
+    aberto: tuple,
+    candidato: tuple,
+    on_chunk: Callable[[str], Awaitable[None]]
+) -> tuple:
+    """Repassa os tokens de um stream já aberto; retorna (texto, completo)
+
+    A duração da geração inteira (do pedido ao último token) vai para
+    LLM_LATENCY, como nas chamadas sem streaming.
+    """
+    primeiro, chunks, inicio = aberto
+    partes = [primeiro]
+    completo = True
+    await on_chunk(primeiro)
+    try:
+        async for chunk in chunks:
+            if chunk:
+                partes.append(chunk)
+                await on_chunk(chunk)
+    except Exception as e:
+        # Trechos já podem ter chegado ao cliente: fica com a resposta parcial
+        completo = False
+        model_router.health(candidato).record_failure(f"stream interrompido: {e}")
+        print(f"Erro no streaming ({candidato[1]}): {e}")
+    finally:
+        await chunks.aclose()
+        LLM_LATENCY.observe(
+            time.perf_counter() - inicio,
+            provider=candidato[0], model=candidato[1], outcome="ok" if completo else "error"
+        )
+    return "".join(partes), completo
+
+# Perguntas repetidas (horário, pagamento, entrega...) não vão de novo para a IA
+response_cache = ResponseCache(
+    max_size=int(os.getenv("RESPONSE_CACHE_SIZE", "500")),
+    ttl=float(os.getenv("RESPONSE_CACHE_TTL_MINUTES", "360")) * 60,
+    similarity=float(os.getenv("RESPONSE_CACHE_SIMILARITY", "0.75"))
+)
+
+async def generate_ai_response(
+    mensagem: str,
+    historico: list,
+    modo_humano: bool = False,
+    on_chunk: Optional[Callable[[str], Awaitable[None]]] = None,
+    resumo: Optional[str] = None
+) -> str:
+    """Gera resposta com failover (e hedge opcional) entre os modelos configurados
+
+    Com `on_chunk` a resposta vem em streaming: failover e hedge valem até o
+    primeiro token e cada trecho é repassado ao callback assim que chega.
+    O histórico enviado cabe em `history_token_budget` e na janela de cada
+    modelo; `resumo` cobre as mensagens que já saíram do histórico.
+    """
+    usar_cache = config.get("response_cache", True)
+    if usar_cache:
+        em_cache, versao_cache = response_cache.get(mensagem, modo_humano)
+        if em_cache is not None:
+            if on_chunk is not None:
+                await on_chunk(em_cache)
+            return em_cache
     
-    messages.append({"role": "user", "content": mensagem})
+    # Escolher prompt baseado no modo
+    system_prompt = get_human_mode_prompt() if modo_humano else get_system_prompt()
+    system_prompt = prompt_com_resumo(system_prompt, resumo)
+    orcamento = config.get("history_token_budget", 1500)
     
-    try:
+    async def chamar(provider: str, model: str):
+        # Mensagens montadas por modelo: cada um tem sua janela de contexto
+        contexto = AVAILABLE_MODELS.get(provider, {}).get(model, {}).get("context_tokens")
+        messages = montar_mensagens(system_prompt, historico, mensagem, contexto, orcamento)
+        await reservar_provedor(provider)
+        if on_chunk is not None:
+            inicio = time.perf_counter()
+            with LLM_FIRST_TOKEN.time(provider=provider, model=model):
+                if provider == "openrouter":
+                    primeiro, chunks = await open_stream(stream_openrouter(messages, model))
+                else:
+                    primeiro, chunks = await open_stream(stream_gemini(messages, model, system_prompt))
+            return primeiro, chunks, inicio
         if provider == "openrouter":
             return await call_openrouter(messages, model)
+        return await call_gemini_async(messages, model, system_prompt)
+    
+    hedge_ms = config.get("hedge_ms", 0)
+    async with vaga_ia():
+        try:
+            resultado, candidato = await model_router.call(
+                cadeia_modelos(),
+                chamar,
+                hedge_after=hedge_ms / 1000 if hedge_ms else None,
+                max_attempts=config.get("fallback_max_attempts", 3)
+            )
+        except Exception as e:
+            print(f"Erro na IA: {e}")
+            return f"Desculpe, tive um probleminha técnico 😅 Mas você pode fazer seu pedido direto no site: {config.get('site_url', 'https://sushiakicb.shop')} 🍣"
+        
+        if on_chunk is None:
+            resposta, completo = resultado, True
         else:
-            return call_gemini(messages, model, system_prompt)
-    except Exception as e:
-        print(f"Erro na IA ({provider}/{model}): {e}")
-        return f"Desculpe, tive um probleminha técnico 😅 Mas você pode fazer seu pedido direto no site: {config.get('site_url', 'https://sushiakicb.shop')} 🍣"
+            resposta, completo = await consumir_stream(resultado, candidato, on_chunk)
+    if usar_cache and completo:
+        response_cache.put(mensagem, modo_humano, resposta, versao_cache)
+    return resposta
 
 # ==================== ESTADO GLOBAL ====================
-conversas: Dict[str, Dict] = {}
-websocket_clients: List[WebSocket] = []
-whatsapp_status = {
-    "connected": False,
-    "qr_code": None,
-    "phone_number": None,
-    "status_text": "Desconectado"
-}
+# Conversas ativas; as ociosas são removidas e recarregadas do banco sob demanda
+conversas: ConversationCache = ConversationCache(
+    max_size=int(os.getenv("CONVERSAS_CACHE_SIZE", "2000")),
+    ttl=float(os.getenv("CONVERSAS_CACHE_TTL_HOURS", "6")) * 3600
+)
+# Painéis conectados: fila de saída e task escritora por cliente
+ws_hub = BroadcastHub(
+    max_queue=int(os.getenv("WS_CLIENT_QUEUE", "256")),
+    send_timeout=float(os.getenv("WS_SEND_TIMEOUT", "10"))
+)
+# Status da conexão vindo do bot Node.js (diff por campo, QR identificado por hash)
+whatsapp_state = WhatsAppState()
+whatsapp_status = whatsapp_state.estado
+
+ws_hub.on_delivery = WS_DELIVERY_LATENCY.observe
+
+# ==================== PERSISTÊNCIA ====================
+
+# Backend das conversas (CONVERSAS_STORE=sqlite|mongo|memory)
+conversa_store = create_store()
+# Conversas alteradas nas últimas N horas são carregadas no startup;
+# as mais antigas só são lidas do banco quando acessadas
+CONVERSAS_PRELOAD_HOURS = float(os.getenv("CONVERSAS_PRELOAD_HOURS", "24"))
+# Resumos de todas as conversas (inclusive fora do cache) para listagem/deltas
+resumos = SummaryIndex()
+# Busca textual nas mensagens (FTS5 num SQLite próprio, atualizado a cada mensagem)
+busca = SearchIndex(
+    ":memory:" if conversa_store.name == "memory"
+    else os.getenv("SEARCH_DB", str(Path(__file__).parent / "search.db"))
+)
+conversa_writer = WriteBehindWriter(
+    conversa_store,
+    snapshot=lambda chat_id: como_dict(conversas.get(chat_id)),
+    summarize=resumo_conversa,
+    interval=float(os.getenv("CONVERSAS_FLUSH_INTERVAL", "1.0"))
+)
 
-# ==================== FUNÇÕES AUXILIARES ====================
+CONVERSAS_SWEEP_INTERVAL = float(os.getenv("CONVERSAS_SWEEP_INTERVAL", "30"))
+# Conversas lidas do banco por vez ao indexar o histórico para a busca
+SEARCH_BACKFILL_BATCH = int(os.getenv("SEARCH_BACKFILL_BATCH", "200"))
+
+def marcar_alterada(chat_id: str):
+    """Agenda a gravação da conversa (write-behind, não bloqueia)"""
+    conversa = conversas.get(chat_id)
+    if conversa is not None:
+        resumos.update(conversa)
+        conversas.mark_changed(chat_id)
+    conversa_writer.mark(chat_id)
+
+async def indexar_historico():
+    """Indexa para a busca as conversas gravadas (em segundo plano, no startup)
+
+    Percorre o banco em lotes de chat_id em chat_id; só roda enquanto o
+    índice nunca tiver sido completado (depois, cada mensagem entra na hora).
+    """
+    if await busca.historico_indexado():
+        print(f"🔎 Busca: {len(busca)} mensagens no índice")
+        return
+    inicio = time.perf_counter()
+    perdas = busca.perdas
+    total = 0
+    ultimo = None
+    while True:
+        pagina = await conversa_store.load_page(ultimo, SEARCH_BACKFILL_BATCH)
+        if not pagina:
+            break
+        for conversa in pagina:
+            busca.add_conversa(conversa)
+        await busca.flush()
+        total += len(pagina)
+        ultimo = pagina[-1]["chat_id"]
+    if not await busca.marcar_historico_indexado(perdas):
+        print("⚠️ Busca: mensagens ficaram fora do índice, o histórico será reindexado no próximo startup")
+    print(f"🔎 Busca: {len(busca)} mensagens de {total} conversas indexadas "
+          f"em {time.perf_counter() - inicio:.1f}s")
+
+async def limpar_cache_conversas():
+    """Tira da memória as conversas ociosas que já estão gravadas no banco"""
+    while True:
+        await asyncio.sleep(CONVERSAS_SWEEP_INTERVAL)
+        conversas.evict_idle(
+            protect=lambda chat_id: conversa_writer.is_pending(chat_id) or reply_coalescer.is_busy(chat_id)
+        )
 
-def detecta_desconfianca(texto: str) -> bool:
-    texto_lower = texto.lower()
-    return any(palavra in texto_lower for palavra in DESCONFIANCA)
+# ==================== FUNÇÕES AUXILIARES ====================
 
-def detecta_pedido_humano(texto: str) -> bool:
-    texto_lower = texto.lower()
-    return any(palavra in texto_lower for palavra in PEDIDO_HUMANO)
+def detectar_intencoes(texto: str) -> set:
+    """Intenções da mensagem ("desconfianca", "pedido_humano"...) numa passada só"""
+    return intent_matcher.match(texto)
 
-def get_conversa(chat_id: str) -> Dict:
-    if chat_id not in conversas:
-        conversas[chat_id] = {
-            "chat_id": chat_id,
-            "mensagens": [],
-            "humano_ativo": False,
-            "modo_humanizado": False,  # Novo: modo 100% humanizado
-            "ultimo_humano": None,
-            "mensagem_inicial_enviada": False,
-            "objecoes_tratadas": [],
-            "historico_ia": [],
-            "nome_cliente": chat_id.split("@")[0] if "@" in chat_id else chat_id,
-            "criado_em": datetime.now().isoformat()
-        }
-    return conversas[chat_id]
+def nova_conversa(chat_id: str) -> Conversation:
+    return Conversation(
+        chat_id,
+        nome_cliente=chat_id.split("@")[0] if "@" in chat_id else chat_id,
+        criado_em=time.time()
+    )
 
+async def carregar_conversa(chat_id: str) -> Optional[Conversation]:
+    """Busca a conversa em memória ou, se não estiver, no banco"""
+    conversa = conversas.get(chat_id)
+    if conversa is not None:
+        conversas.stats["hits"] += 1
+    else:
+        conversas.stats["misses"] += 1
+        dados = await conversa_store.load(chat_id)
+        if dados is None:
+            return None
+        conversas.stats["reloads"] += 1
+        conversa = Conversation.from_dict(dados)
+        # Outro request pode ter carregado enquanto esperávamos o banco
+        conversa = conversas.setdefault(chat_id, conversa)
+    conversas.touch(chat_id)
+    return conversa
+
+async def get_conversa(chat_id: str) -> Conversation:
+    conversa = await carregar_conversa(chat_id)
+    if conversa is None:
+        conversa = conversas.setdefault(chat_id, nova_conversa(chat_id))
+        conversas.touch(chat_id)
+        marcar_alterada(chat_id)
+    return conversa
+
+# Sequência e replay dos eventos do painel (resume após reconexão)
+event_stream = EventStream(replay_size=int(os.getenv("WS_REPLAY_SIZE", "1000")))
+WS_SNAPSHOT_CONVERSAS = int(os.getenv("WS_SNAPSHOT_CONVERSAS", "200"))
+
+@timed(BROADCAST_FANOUT)
 async def broadcast_message(message: dict):
-    """Envia mensagem para todos os clientes WebSocket conectados"""
-    disconnected = []
-    for client in websocket_clients:
-        try:
-            await client.send_json(message)
-        except Exception:
-            disconnected.append(client)
+    """Numera o evento e envia para todos os clientes WebSocket conectados"""
+    # Eventos de um chat levam o resumo atualizado: o painel não precisa refazer a lista
+    chat_id = message.get("chat_id")
+    if chat_id and "resumo" not in message:
+        resumo = resumos.get(chat_id)
+        if resumo is not None:
+            message = {**message, "resumo": resumo}
+    publicar_local(message)
+    cluster.publish(message)
+
+# Sem seq nem replay: quem reconecta recebe o estado atual por outro caminho
+EVENTOS_EFEMEROS = {"message_partial", "outbox_stats"}
+
+def publicar_local(message: dict):
+    """Evento para os painéis conectados a este worker"""
+    # Só enfileira: o envio acontece na task de cada cliente, fora do webhook
+    if message.get("type") in EVENTOS_EFEMEROS:
+        ws_hub.publish(message)
+    else:
+        ws_hub.publish(event_stream.publish(message))
+
+def publicar_parcial(chat_id: str, stream_id: str, texto: str, done: bool = False):
+    """Texto ainda não enviado de uma resposta em streaming
+
+    Evento efêmero: não recebe seq nem entra no buffer de replay (quem
+    reconecta recebe as mensagens completas pelo caminho normal).
+    """
+    message = {
+        "type": "message_partial",
+        "chat_id": chat_id,
+        "stream_id": stream_id,
+        "text": texto,
+        "done": done
+    }
+    publicar_local(message)
+    cluster.publish(message)
+
+# ==================== CLUSTER ====================
+# Vários workers (uvicorn --workers N / várias máquinas): CLUSTER_BACKEND=sqlite|redis
+cluster = create_bus()
+# Rotas que alteram uma conversa rodam no worker dono do chat_id
+OPERACOES: Dict[str, Callable] = {}
+
+def no_dono(fallback_local: bool = False):
+    """Encaminha a rota ao worker dono do chat_id (afinidade por conversa)
+
+    Assim a conversa, a fila de respostas e o agrupamento de mensagens de um
+    chat vivem num processo só. Se o dono não responder a tempo, o webhook
+    de mensagens é atendido aqui mesmo (melhor responder do que perder a
+    mensagem); as demais rotas devolvem 503.
+    """
+    def decorador(fn):
+        assinatura = inspect.signature(fn)
+        OPERACOES[fn.__name__] = fn
+
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            argumentos = assinatura.bind(*args, **kwargs).arguments
+            chat_id = argumentos.get("chat_id") or getattr(argumentos.get("request"), "chat_id", None)
+            if not cluster.distribuido or not chat_id:
+                return await fn(*args, **kwargs)
+            dono = cluster.dono(chat_id)
+            if dono == cluster.worker_id:
+                return await fn(*args, **kwargs)
+            corpo = {
+                "op": fn.__name__,
+                "args": {
+                    nome: valor.model_dump() if isinstance(valor, BaseModel) else valor
+                    for nome, valor in argumentos.items()
+                }
+            }
+            try:
+                return await cluster.request(dono, corpo)
+            except ErroRemoto as e:
+                raise HTTPException(status_code=e.status, detail=e.detail)
+            except asyncio.TimeoutError:
+                print(f"⚠️ Worker {dono} não respondeu ({fn.__name__} {chat_id})")
+                if fallback_local:
+                    return await fn(*args, **kwargs)
+                raise HTTPException(status_code=503, detail="Worker responsável pela conversa indisponível")
+        return wrapper
+    return decorador
+
+async def pedido_do_cluster(corpo: dict):
+    """Executa aqui uma rota encaminhada por outro worker"""
+    fn = OPERACOES.get(corpo.get("op"))
+    if fn is None:
+        raise ErroRemoto(404, f"Operação desconhecida: {corpo.get('op')}")
+    argumentos = {}
+    for nome, parametro in inspect.signature(fn).parameters.items():
+        if nome not in corpo["args"]:
+            continue
+        valor = corpo["args"][nome]
+        if inspect.isclass(parametro.annotation) and issubclass(parametro.annotation, BaseModel):
+            valor = parametro.annotation(**valor)
+        argumentos[nome] = valor
+    return await fn(**argumentos)
+
+# IDs das mensagens gravadas: crescentes e únicos mesmo entre workers
+ids = IdGenerator(node=cluster.worker_id.rsplit("-", 1)[-1] if cluster.distribuido else "")
+
+async def evento_do_cluster(message: dict):
+    """Evento publicado por outro worker: atualiza o estado local e repassa aos painéis"""
+    tipo = message.get("type")
+    chat_id = message.get("chat_id")
+    if tipo == "status_update":
+        whatsapp_state.aplicar(message.get("status") or {})
+    elif tipo == "conversas_limpas":
+        conversas.clear()
+        resumos.clear()
+        busca.clear()
+        conversa_writer.reset()
+    elif tipo == "conversa_removida":
+        if chat_id in conversas:
+            del conversas[chat_id]
+        resumos.remove(chat_id)
+        busca.remove_chat(chat_id)
+    elif tipo in ("message_received", "message_sent") and message.get("message"):
+        busca.add(chat_id, message["message"])
+    elif tipo == "config_updated":
+        await config_store.recarregar_se_mudou()
+    if chat_id and tipo not in ("conversa_removida", "message_partial"):
+        if message.get("resumo"):
+            message = {**message, "resumo": resumos.put(message["resumo"])}
+        # Cópia local ficou velha: a próxima leitura busca a versão gravada pelo dono
+        if chat_id in conversas and not conversa_writer.is_pending(chat_id):
+            del conversas[chat_id]
+    publicar_local(message)
+
+# ==================== RESUMO DO HISTÓRICO ====================
+
+HISTORICO_MANTER = 6          # entradas recentes que nunca entram no resumo
+RESUMO_MAX_CHARS = 1500
+historico_stats = {"summaries": 0, "summary_failures": 0, "hard_trimmed": 0}
+_resumindo: set = set()
+
+def registrar_turno(chat_id: str, conversa: Conversation, mensagem: str, resposta: str):
+    """Adiciona pergunta/resposta ao historico_ia e agenda o resumo se passou do orçamento"""
+    historico = conversa.historico_ia
+    # Buffer circular: cheio, as entradas mais antigas saem sozinhas
+    if len(historico) + 2 > HISTORICO_MAX_ENTRADAS:
+        historico_stats["hard_trimmed"] += 1
+    historico.append(entrada_historico("user", mensagem))
+    historico.append(entrada_historico("assistant", resposta))
+    marcar_alterada(chat_id)
+    
+    if (len(historico) > HISTORICO_MANTER
+            and tokens_historico(historico) > config.get("history_token_budget", 1500)
+            and chat_id not in _resumindo):
+        _resumindo.add(chat_id)
+        if not resumo_queue.submit({"chat_id": chat_id}):
+            _resumindo.discard(chat_id)
+
+async def gerar_resumo_historico(anterior: Optional[str], turnos: List[Dict]) -> str:
+    """Pede à IA um resumo acumulado: resumo anterior + mensagens que vão sair do histórico"""
+    transcricao = "\n".join(
+        f"{'Cliente' if m['role'] == 'user' else 'Atendente'}: {m['content']}" for m in turnos
+    )
+    conteudo = (f"Resumo anterior:\n{anterior}\n\n" if anterior else "") + f"Mensagens novas:\n{transcricao}"
+    system_prompt = prompt_registry.render("resumo_historico")
+    messages = [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": conteudo}
+    ]
     
-    for client in disconnected:
+    async def chamar(provider: str, model: str) -> str:
+        await reservar_provedor(provider)
+        if provider == "openrouter":
+            return await call_openrouter(messages, model)
+        return await call_gemini_async(messages, model, system_prompt)
+    
+    async with vaga_ia():
+        texto, _ = await model_router.call(
+            cadeia_modelos(), chamar, max_attempts=config.get("fallback_max_attempts", 3)
+        )
+    return texto.strip()[:RESUMO_MAX_CHARS]
+
+async def resumir_historico(job: Dict):
+    """Worker: troca as entradas antigas do historico_ia pelo resumo acumulado"""
+    chat_id = job["chat_id"]
+    try:
+        conversa = conversas.get(chat_id) or await carregar_conversa(chat_id)
+        if conversa is None:
+            return
+        antigas = list(conversa.historico_ia)[:-HISTORICO_MANTER]
+        if not antigas:
+            return
+        resumo_atual = conversa.resumo_ia or {}
         try:
-            websocket_clients.remove(client)
-        except Exception:
-            pass
-
-async def gerar_resposta(chat_id: str, mensagem: str) -> str:
-    """Gera resposta para o cliente"""
-    conversa = get_conversa(chat_id)
+            texto = await gerar_resumo_historico(resumo_atual.get("texto"), antigas)
+        except Exception as e:
+            historico_stats["summary_failures"] += 1
+            print(f"Erro ao resumir histórico de {chat_id}: {e}")
+            return
+        
+        # A conversa pode ter sido apagada/limpa enquanto a IA resumia
+        if conversas.get(chat_id) is not conversa:
+            return
+        resumidas = {id(m) for m in antigas}
+        conversa.historico_ia = deque(
+            (m for m in conversa.historico_ia if id(m) not in resumidas), maxlen=HISTORICO_MAX_ENTRADAS
+        )
+        conversa.resumo_ia = {
+            "texto": texto,
+            "mensagens": resumo_atual.get("mensagens", 0) + len(antigas),
+            "atualizado_em": datetime.now().isoformat()
+        }
+        historico_stats["summaries"] += 1
+        marcar_alterada(chat_id)
+    finally:
+        _resumindo.discard(chat_id)
+
+# Um worker basta: resumir não tem pressa e não deve competir com as respostas
+resumo_queue = JobQueue(resumir_historico, workers=1, max_size=1000, name="resumos")
+
+async def gerar_resposta(
+    chat_id: str,
+    mensagem: str,
+    on_chunk: Optional[Callable[[str], Awaitable[None]]] = None
+) -> str:
+    """Gera resposta para o cliente (em streaming se `on_chunk` for passado)"""
+    conversa = await get_conversa(chat_id)
+    intencoes = detectar_intencoes(mensagem)
+    resumo = (conversa.resumo_ia or {}).get("texto")
     
     # Verificar se cliente pediu atendente humano
-    if detecta_pedido_humano(mensagem):
-        conversa["modo_humanizado"] = True
+    if "pedido_humano" in intencoes:
+        conversa.modo_humanizado = True
         # Gera resposta humanizada
-        resposta = await generate_ai_response(mensagem, conversa["historico_ia"], modo_humano=True)
-        # Atualizar histórico
-        conversa["historico_ia"].append({"role": "user", "content": mensagem})
-        conversa["historico_ia"].append({"role": "assistant", "content": resposta})
+        resposta = await generate_ai_response(
+            mensagem, conversa.historico_ia, modo_humano=True, on_chunk=on_chunk, resumo=resumo
+        )
+        registrar_turno(chat_id, conversa, mensagem, resposta)
         return resposta
     
     # Verificar desconfiança
-    if detecta_desconfianca(mensagem):
-        if "desconfianca" not in conversa["objecoes_tratadas"]:
-            conversa["objecoes_tratadas"].append("desconfianca")
+    if "desconfianca" in intencoes:
+        if "desconfianca" not in conversa.objecoes_tratadas:
+            conversa.objecoes_tratadas.append("desconfianca")
+            marcar_alterada(chat_id)
             return get_resposta_desconfianca()
     
     # Gerar resposta com IA (modo normal ou humanizado)
     resposta = await generate_ai_response(
         mensagem, 
-        conversa["historico_ia"], 
-        modo_humano=conversa.get("modo_humanizado", False)
+        conversa.historico_ia, 
+        modo_humano=conversa.modo_humanizado,
+        on_chunk=on_chunk,
+        resumo=resumo
     )
     
-    # Atualizar histórico
-    conversa["historico_ia"].append({"role": "user", "content": mensagem})
-    conversa["historico_ia"].append({"role": "assistant", "content": resposta})
-    
-    # Limitar histórico
-    if len(conversa["historico_ia"]) > 20:
-        conversa["historico_ia"] = conversa["historico_ia"][-20:]
-    
+    registrar_turno(chat_id, conversa, mensagem, resposta)
     return resposta
 
 # ==================== MODELS ====================
@@ -439,6 +1080,7 @@ async def gerar_resposta(chat_id: str, mensagem: str) -> str:
 class MessageRequest(BaseModel):
     chat_id: str
     message: str
+    message_id: Optional[str] = None  # ID da mensagem no WhatsApp (deduplicação)
 
 class ConfigRequest(BaseModel):
     provider: Optional[str] = None
@@ -449,6 +1091,17 @@ class ConfigRequest(BaseModel):
     human_takeover_minutes: Optional[int] = None
     site_url: Optional[str] = None
     business_name: Optional[str] = None
+    debounce_ms: Optional[int] = None
+    fallback_enabled: Optional[bool] = None
+    fallback_models: Optional[List[str]] = None
+    gemini_fallback_model: Optional[str] = None
+    fallback_max_attempts: Optional[int] = None
+    hedge_ms: Optional[int] = None
+    streaming: Optional[bool] = None
+    stream_min_chars: Optional[int] = None
+    response_cache: Optional[bool] = None
+    intents: Optional[Dict[str, List[str]]] = None
+    history_token_budget: Optional[int] = None
 
 class ManualMessageRequest(BaseModel):
     chat_id: str
@@ -486,9 +1139,46 @@ async def get_status():
         "conversas_ativas": len(conversas),
         "ai_configured": has_api_key,
         "provider": provider,
-        "model": config.get("selected_model", "deepseek/deepseek-r1:free")
+        "model": config.get("selected_model", "deepseek/deepseek-r1:free"),
+        "http_pool": http_pool.stats(),
+        "storage": {
+            "backend": conversa_store.name,
+            "pending_writes": conversa_writer.pending,
+            **conversa_writer.stats
+        },
+        "memory": conversas.memory_stats(),
+        "config": config_store.stats(),
+        "whatsapp_sync": whatsapp_state.stats(),
+        "ingest": {**ingestao_stats, **mensagens_recebidas.stats()},
+        "cluster": cluster.stats(),
+        "ai_routing": model_router.stats(),
+        "response_cache": response_cache.stats(),
+        "prompts": prompt_registry.stats(),
+        "history": {**historico_stats, "queue": resumo_queue.stats()},
+        "search": busca.stats(),
+        "admission": {
+            **admissao_stats,
+            "max_concurrency": AI_MAX_CONCURRENCY,
+            "shed_depth": REPLY_SHED_DEPTH,
+            "per_chat": chat_limiter.stats(),
+            "providers": {nome: bucket.stats() for nome, bucket in provider_limiters.items()}
+        },
+        "outbox": outbox.stats(),
+        "reply_queue": {
+            **reply_queue.stats(),
+            "coalescer": reply_coalescer.stats()
+        },
+        "websocket": {
+            **event_stream.stats(),
+            **ws_hub.stats()
+        }
     }
 
+@app.get("/api/metrics")
+async def get_metrics():
+    """Métricas no formato texto do Prometheus (para scrape)"""
+    return Response(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
 @app.get("/api/config")
 async def get_config():
     """Retorna configuração atual"""
@@ -502,165 +1192,569 @@ async def get_config():
         "auto_reply": config.get("auto_reply", True),
         "human_takeover_minutes": config.get("human_takeover_minutes", 60),
         "site_url": config.get("site_url", "https://sushiakicb.shop"),
-        "business_name": config.get("business_name", "Sushi Aki")
+        "business_name": config.get("business_name", "Sushi Aki"),
+        "debounce_ms": config.get("debounce_ms", 1200),
+        "fallback_enabled": config.get("fallback_enabled", True),
+        "fallback_models": config.get("fallback_models", []),
+        "gemini_fallback_model": config.get("gemini_fallback_model", ""),
+        "fallback_max_attempts": config.get("fallback_max_attempts", 3),
+        "hedge_ms": config.get("hedge_ms", 0),
+        "streaming": config.get("streaming", True),
+        "stream_min_chars": config.get("stream_min_chars", 80),
+        "response_cache": config.get("response_cache", True),
+        "intents": intent_matcher.keywords,
+        "history_token_budget": config.get("history_token_budget", 1500)
     }
 
 @app.post("/api/config")
 async def update_config(request: ConfigRequest):
     """Atualiza configuração"""
-    global config
-    
-    updated = False
+    mudancas = {}
     
     if request.provider is not None:
-        config["provider"] = request.provider
-        updated = True
+        mudancas["provider"] = request.provider
     
     if request.gemini_api_key is not None:
-        config["gemini_api_key"] = request.gemini_api_key
-        updated = True
+        mudancas["gemini_api_key"] = request.gemini_api_key
     
     if request.openrouter_api_key is not None:
-        config["openrouter_api_key"] = request.openrouter_api_key
-        updated = True
+        mudancas["openrouter_api_key"] = request.openrouter_api_key
     
     if request.selected_model is not None:
-        config["selected_model"] = request.selected_model
-        updated = True
+        mudancas["selected_model"] = request.selected_model
     
     if request.auto_reply is not None:
-        config["auto_reply"] = request.auto_reply
-        updated = True
+        mudancas["auto_reply"] = request.auto_reply
     
     if request.human_takeover_minutes is not None:
-        config["human_takeover_minutes"] = request.human_takeover_minutes
-        updated = True
+        mudancas["human_takeover_minutes"] = request.human_takeover_minutes
     
     if request.site_url is not None:
-        config["site_url"] = request.site_url
-        updated = True
+        mudancas["site_url"] = request.site_url
     
     if request.business_name is not None:
-        config["business_name"] = request.business_name
-        updated = True
+        mudancas["business_name"] = request.business_name
+    
+    if request.debounce_ms is not None:
+        mudancas["debounce_ms"] = max(0, min(request.debounce_ms, 10000))
+    
+    if request.fallback_enabled is not None:
+        mudancas["fallback_enabled"] = request.fallback_enabled
+    
+    if request.fallback_models is not None:
+        mudancas["fallback_models"] = [m for m in request.fallback_models if provedor_do_modelo(m)]
     
-    if updated:
-        save_config(config)
+    if request.gemini_fallback_model is not None:
+        # Vazio desliga; só aceita modelos do Gemini
+        if request.gemini_fallback_model and provedor_do_modelo(request.gemini_fallback_model) != "gemini":
+            raise HTTPException(status_code=400, detail=f"Modelo Gemini desconhecido: {request.gemini_fallback_model}")
+        mudancas["gemini_fallback_model"] = request.gemini_fallback_model
+    
+    if request.fallback_max_attempts is not None:
+        mudancas["fallback_max_attempts"] = max(1, min(request.fallback_max_attempts, 10))
+    
+    if request.hedge_ms is not None:
+        mudancas["hedge_ms"] = max(0, request.hedge_ms)
+    
+    if request.streaming is not None:
+        mudancas["streaming"] = request.streaming
+    
+    if request.stream_min_chars is not None:
+        mudancas["stream_min_chars"] = max(0, min(request.stream_min_chars, 2000))
+    
+    if request.response_cache is not None:
+        mudancas["response_cache"] = request.response_cache
+    
+    if request.history_token_budget is not None:
+        mudancas["history_token_budget"] = max(200, min(request.history_token_budget, 32000))
+    
+    if request.intents is not None:
+        # Só guarda o que difere do padrão
+        mudancas["intents"] = {
+            nome: palavras for nome, palavras in request.intents.items()
+            if palavras != DEFAULT_INTENTS.get(nome)
+        }
+    
+    if mudancas:
+        config_store.update(mudancas)
+        if cluster.distribuido:
+            # Os outros workers recarregam do arquivo ao receber o evento
+            await config_store.flush()
         await broadcast_message({"type": "config_updated"})
     
     return {"success": True, "config": await get_config()}
 
+def resposta_com_etag(request: Request, etag: str, corpo) -> Response:
+    """Responde 304 se o cliente já tem esta versão (If-None-Match)"""
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+    return JSONResponse(corpo() if callable(corpo) else corpo, headers={"ETag": etag})
+
 @app.get("/api/conversas")
-async def get_conversas():
-    return {"conversas": list(conversas.values())}
+async def get_conversas(request: Request, limit: Optional[int] = None, cursor: Optional[str] = None):
+    """Conversas completas; com `limit`/`cursor` pagina pela atividade mais recente
+
+    Sem `limit`/`cursor` devolve só as conversas em memória (as ativas nas
+    últimas horas, até CONVERSAS_CACHE_SIZE); para percorrer todas, use a
+    paginação, que lê do banco as que saíram do cache.
+    """
+    etag = f'W/"{resumos.token}"'
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+    
+    if limit is None and cursor is None:
+        return JSONResponse({"conversas": [c.to_dict() for c in conversas.values()]}, headers={"ETag": etag})
+    
+    pagina, proximo = resumos.page(max(1, min(limit or 50, 200)), cursor)
+    completas = []
+    for resumo in pagina:
+        # Conversas fora do cache são lidas do banco sem voltar para a memória
+        conversa = conversas.get(resumo["chat_id"]) or await conversa_store.load(resumo["chat_id"])
+        if conversa is not None:
+            completas.append(como_dict(conversa))
+    return JSONResponse(
+        {"conversas": completas, "next_cursor": proximo, "versao": resumos.token},
+        headers={"ETag": etag}
+    )
+
+@app.get("/api/conversas/resumo")
+async def get_conversas_resumo(
+    request: Request,
+    limit: int = 50,
+    cursor: Optional[str] = None,
+    since: Optional[str] = None
+):
+    """Listagem leve (última mensagem, não lidas, flags) paginada ou em delta"""
+    etag = f'W/"{resumos.token}"'
+    
+    def corpo():
+        if since is not None:
+            versao = resumos.parse_token(since)
+            mudancas = resumos.changes_since(versao) if versao is not None else None
+            if mudancas is not None:
+                alterados, removidos = mudancas
+                return {
+                    "delta": True,
+                    "conversas": alterados,
+                    "removidas": removidos,
+                    "versao": resumos.token,
+                    "total": len(resumos)
+                }
+            # Token de outra instância ou antigo demais: recomeçar do zero
+        pagina, proximo = resumos.page(max(1, min(limit, 500)), cursor)
+        return {
+            "delta": False,
+            "conversas": pagina,
+            "next_cursor": proximo,
+            "versao": resumos.token,
+            "total": len(resumos)
+        }
+    
+    return resposta_com_etag(request, etag, corpo)
+
+@app.get("/api/conversa/{chat_id}/mensagens")
+async def get_mensagens(
+    request: Request,
+    chat_id: str,
+    limit: int = 50,
+    antes_de: Optional[str] = None,
+    depois_de: Optional[str] = None
+):
+    """Faixa de mensagens de um chat: últimas `limit`, ou antes/depois de um id"""
+    conversa = await carregar_conversa(chat_id)
+    if conversa is None:
+        raise HTTPException(status_code=404, detail="Conversa não encontrada")
+    
+    resumo = resumos.get(chat_id) or {}
+    etag = f'W/"{resumos.epoch}.{resumo.get("versao", 0)}"'
+    limit = max(1, min(limit, 500))
+    
+    def corpo():
+        mensagens = conversa.mensagens
+        ids = [m.id for m in mensagens]
+        # Id desconhecido (ex.: conversa apagada e recriada): devolve as últimas
+        reinicio = (depois_de is not None and depois_de not in ids) or (
+            antes_de is not None and antes_de not in ids
+        )
+        if depois_de is not None and not reinicio:
+            inicio = ids.index(depois_de) + 1
+            fim = min(len(mensagens), inicio + limit)
+        else:
+            fim = ids.index(antes_de) if antes_de is not None and not reinicio else len(mensagens)
+            inicio = max(0, fim - limit)
+        return {
+            "chat_id": chat_id,
+            "mensagens": [m.to_dict() for m in mensagens[inicio:fim]],
+            "reinicio": reinicio,
+            "inicio": inicio,
+            "total": len(mensagens),
+            "tem_anteriores": inicio > 0,
+            "tem_posteriores": fim < len(mensagens)
+        }
+    
+    return resposta_com_etag(request, etag, corpo)
+
+def _data_filtro(valor: Optional[str], fim_do_dia: bool = False) -> Optional[float]:
+    """ISO (data ou data/hora) -> epoch; só a data em `ate` inclui o dia inteiro"""
+    if not valor:
+        return None
+    try:
+        data = datetime.fromisoformat(valor)
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Data inválida: {valor}")
+    if fim_do_dia and len(valor) == 10:
+        data += timedelta(days=1)
+    return data.timestamp()
+
+@app.get("/api/search")
+async def search_mensagens(
+    q: str = "",
+    chat_id: Optional[str] = None,
+    autor: Optional[str] = Query(None, alias="from"),
+    desde: Optional[str] = None,
+    ate: Optional[str] = None,
+    limit: int = 20,
+    cursor: Optional[str] = None
+):
+    """Busca nas mensagens: palavras, "frases", prefixo*; filtros por chat, autor e data"""
+    inicio = time.perf_counter()
+    resultados, proximo = await busca.search(
+        q,
+        chat_id=chat_id,
+        autor=autor,
+        desde=_data_filtro(desde),
+        ate=_data_filtro(ate, fim_do_dia=True),
+        limit=max(1, min(limit, 100)),
+        cursor=cursor
+    )
+    for resultado in resultados:
+        resumo = resumos.get(resultado["chat_id"])
+        resultado["nome_cliente"] = resumo.get("nome_cliente") if resumo else None
+    return {
+        "results": resultados,
+        "next_cursor": proximo,
+        "took_ms": round((time.perf_counter() - inicio) * 1000, 2)
+    }
 
 @app.get("/api/conversa/{chat_id}")
 async def get_conversa_by_id(chat_id: str):
-    if chat_id not in conversas:
+    conversa = await carregar_conversa(chat_id)
+    if conversa is None:
         raise HTTPException(status_code=404, detail="Conversa não encontrada")
-    return conversas[chat_id]
+    return conversa.to_dict()
 
 @app.post("/api/takeover/{chat_id}")
+@no_dono()
 async def human_takeover(chat_id: str):
-    conversa = get_conversa(chat_id)
-    conversa["humano_ativo"] = True
-    conversa["ultimo_humano"] = datetime.now().isoformat()
+    conversa = await get_conversa(chat_id)
+    conversa.humano_ativo = True
+    conversa.ultimo_humano = time.time()
+    marcar_alterada(chat_id)
     await broadcast_message({"type": "human_takeover", "chat_id": chat_id})
     return {"success": True}
 
 @app.post("/api/release/{chat_id}")
+@no_dono()
 async def release_to_bot(chat_id: str):
-    conversa = get_conversa(chat_id)
-    conversa["humano_ativo"] = False
-    conversa["modo_humanizado"] = False  # Reset modo humanizado
+    conversa = await get_conversa(chat_id)
+    conversa.humano_ativo = False
+    conversa.modo_humanizado = False  # Reset modo humanizado
+    marcar_alterada(chat_id)
     await broadcast_message({"type": "bot_resumed", "chat_id": chat_id})
     return {"success": True}
 
 # URL do bot WhatsApp (Node.js)
 WHATSAPP_BOT_URL = os.getenv("WHATSAPP_BOT_URL", "http://localhost:3001")
 
-async def send_to_whatsapp(chat_id: str, message: str) -> dict:
-    """Envia mensagem para o WhatsApp através do bot Node.js"""
+@timed(WHATSAPP_SEND_LATENCY)
+async def send_to_whatsapp(chat_id: str, message: str, message_id: Optional[str] = None) -> dict:
+    """Envia mensagem para o WhatsApp através do bot Node.js (uma tentativa)
+
+    `message_id` deixa o reenvio seguro: o bot não manda duas vezes a mesma
+    mensagem se a primeira tentativa saiu mas a resposta se perdeu.
+    """
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.post(
-                f"{WHATSAPP_BOT_URL}/send-message",
-                json={"chat_id": chat_id, "message": message},
-                timeout=aiohttp.ClientTimeout(total=10)
-            ) as response:
-                if response.status == 200:
-                    result = await response.json()
-                    return result
-                else:
-                    error_text = await response.text()
-                    return {"success": False, "error": f"Erro {response.status}: {error_text}"}
+        session = await http_pool.session()
+        async with session.post(
+            f"{WHATSAPP_BOT_URL}/send-message",
+            json={"chat_id": chat_id, "message": message, "message_id": message_id},
+            timeout=http_pool.timeout(WHATSAPP_TIMEOUT)
+        ) as response:
+            if response.status == 200:
+                result = await response.json()
+                return result
+            else:
+                error_text = await response.text()
+                return {"success": False, "status": response.status, "error": f"Erro {response.status}: {error_text}"}
     except aiohttp.ClientError as e:
         return {"success": False, "error": f"Erro de conexão: {str(e)}"}
     except Exception as e:
         return {"success": False, "error": str(e)}
 
 @app.post("/api/send-message")
+@no_dono()
 async def send_manual_message(request: ManualMessageRequest):
-    """Envia mensagem manual do painel para o WhatsApp"""
-    conversa = get_conversa(request.chat_id)
+    """Envia mensagem manual do painel para o WhatsApp (pela fila de saída)"""
+    conversa = await get_conversa(request.chat_id)
     
-    # Enviar para o WhatsApp de verdade!
-    whatsapp_result = await send_to_whatsapp(request.chat_id, request.message)
+    msg = Message(ids.next("manual"), "humano", request.message, time.time(), status="pending")
+    # Gravada na fila antes de responder: se o bot estiver fora, sai quando ele voltar
+    if not await outbox.enqueue(request.chat_id, request.message, msg.id):
+        return {"success": False, "error": "Fila de envio cheia, tente novamente em instantes"}
     
-    if not whatsapp_result.get("success"):
-        return {
-            "success": False, 
-            "error": whatsapp_result.get("error", "Falha ao enviar para WhatsApp")
-        }
-    
-    # Salvar mensagem no histórico
-    msg = {
-        "id": f"manual_{datetime.now().timestamp()}",
-        "from": "humano",
-        "text": request.message,
-        "timestamp": datetime.now().isoformat(),
-        "whatsapp_id": whatsapp_result.get("messageId")
-    }
-    conversa["mensagens"].append(msg)
-    conversa["humano_ativo"] = True
-    conversa["ultimo_humano"] = datetime.now().isoformat()
+    conversa.mensagens.append(msg)
+    busca.add(request.chat_id, msg)
+    conversa.humano_ativo = True
+    conversa.ultimo_humano = msg.ts
+    marcar_alterada(request.chat_id)
     
     await broadcast_message({
         "type": "message_sent",
         "chat_id": request.chat_id,
-        "message": msg
+        "message": msg.to_dict()
     })
     
-    return {"success": True, "message": msg}
+    return {"success": True, "message": msg.to_dict(), "queued": True}
+
+# ==================== PIPELINE DE RESPOSTAS ====================
+
+async def registrar_resposta_bot(chat_id: str, resposta: str, enviar: bool = False):
+    """Salva a resposta do bot no histórico e avisa os painéis
+
+    Com `enviar` a resposta também entra na fila de saída; sem, quem entrega
+    é o próprio bot Node.js (texto devolvido no webhook).
+    """
+    conversa = await get_conversa(chat_id)
+    msg_enviada = Message(ids.next("sent"), "bot", resposta, time.time())
+    if enviar:
+        msg_enviada.status = "pending"
+        if not await outbox.enqueue(chat_id, resposta, msg_enviada.id):
+            msg_enviada.status = "failed"
+            msg_enviada.erro_envio = "Fila de envio cheia"
+    conversa.mensagens.append(msg_enviada)
+    busca.add(chat_id, msg_enviada)
+    marcar_alterada(chat_id)
+    
+    await broadcast_message({
+        "type": "message_sent",
+        "chat_id": chat_id,
+        "message": msg_enviada.to_dict()
+    })
+    return msg_enviada
+
+async def registrar_entrega(item: Dict, resultado: Dict):
+    """Fila de saída terminou uma mensagem: atualiza o histórico e os painéis"""
+    chat_id = item["chat_id"]
+    if not resultado.get("success"):
+        print(f"Erro ao enviar mensagem para {chat_id} ({item['attempts']} tentativa(s)): {resultado.get('error')}")
+    conversa = await carregar_conversa(chat_id)
+    msg = next((m for m in reversed(conversa.mensagens) if m.id == item["id"]), None) if conversa else None
+    if msg is None:
+        return  # conversa removida enquanto a mensagem estava na fila
+    if resultado.get("success"):
+        msg.status = "sent"
+        msg.whatsapp_id = resultado.get("messageId")
+        msg.erro_envio = None
+    else:
+        msg.status = "failed"
+        msg.erro_envio = resultado.get("error") or "Falha ao enviar para WhatsApp"
+    marcar_alterada(chat_id)
+    await broadcast_message({
+        "type": "message_status",
+        "chat_id": chat_id,
+        "message_id": msg.id,
+        "status": msg.status,
+        "whatsapp_id": msg.whatsapp_id,
+        "error": msg.erro_envio
+    })
+
+# Mensagens para o WhatsApp: ordem por chat, reenvio, circuit breaker e limite de vazão
+outbox = Outbox(
+    create_outbox_store(
+        "memory" if conversa_store.name == "memory" else "sqlite",
+        Path(os.getenv("OUTBOX_DB", Path(__file__).parent / "outbox.db")),
+        owner=cluster.worker_id,
+        # Um worker só: o que ficou de um processo anterior é dele na hora
+        owner_ttl=float(os.getenv("OUTBOX_OWNER_TTL", "30")) if cluster.distribuido else 0.0
+    ),
+    sender=send_to_whatsapp,
+    on_result=registrar_entrega,
+    workers=int(os.getenv("OUTBOX_WORKERS", "2")),
+    max_size=int(os.getenv("OUTBOX_MAX_SIZE", "5000")),
+    max_attempts=int(os.getenv("OUTBOX_MAX_ATTEMPTS", "8")),
+    max_delay=float(os.getenv("OUTBOX_MAX_RETRY_DELAY", "60")),
+    rate=float(os.getenv("OUTBOX_RATE_PER_MIN", "40")) / 60,
+    burst=float(os.getenv("OUTBOX_BURST", "5")),
+    breaker=ModelHealth(
+        failure_threshold=int(os.getenv("OUTBOX_BREAKER_FAILURES", "3")),
+        cooldown=float(os.getenv("OUTBOX_BREAKER_COOLDOWN", "5")),
+        max_cooldown=60.0
+    )
+)
+# Fila de saída acima disso: sem IA para quem já foi atendido, como na fila de respostas
+OUTBOX_SHED_DEPTH = int(os.getenv("OUTBOX_SHED_DEPTH", "200"))
+OUTBOX_STATS_INTERVAL = 2.0
+
+async def publicar_stats_fila():
+    """Card "Fila de envio" dos painéis: no máximo um evento a cada poucos segundos, só se mudou"""
+    anterior = None
+    while True:
+        await asyncio.sleep(OUTBOX_STATS_INTERVAL)
+        stats = outbox.stats()
+        atual = (stats["queued"], stats["retrying"], stats["sent"], stats["failed"],
+                 stats["rejected"], stats["breaker"]["state"])
+        if atual != anterior:
+            anterior = atual
+            publicar_local({"type": "outbox_stats", "outbox": stats})
+
+# Intervalo mínimo entre eventos de texto parcial para o painel
+STREAM_PARTIAL_INTERVAL = float(os.getenv("STREAM_PARTIAL_INTERVAL_MS", "150")) / 1000
+
+async def enviar_trecho(chat_id: str, trecho: str) -> bool:
+    """Envia um trecho da resposta; False se um atendente assumiu a conversa"""
+    conversa = await get_conversa(chat_id)
+    if conversa.humano_ativo:
+        return False
+    await registrar_resposta_bot(chat_id, trecho, enviar=True)
+    return True
+
+async def responder_em_streaming(chat_id: str, mensagem: str):
+    """Gera a resposta em streaming e envia cada frase/parágrafo completo ao
+    WhatsApp enquanto o resto ainda está sendo gerado"""
+    stream_id = ids.next("stream")
+    buffer = SentenceBuffer(min_chars=config.get("stream_min_chars", 80))
+    estado = {"recebeu": False, "ativo": True, "parcial_em": 0.0}
+    
+    async def on_chunk(delta: str):
+        estado["recebeu"] = True
+        trechos = buffer.feed(delta)
+        for trecho in trechos:
+            if estado["ativo"]:
+                estado["ativo"] = await enviar_trecho(chat_id, trecho)
+        agora = time.monotonic()
+        if trechos or agora - estado["parcial_em"] >= STREAM_PARTIAL_INTERVAL:
+            estado["parcial_em"] = agora
+            publicar_parcial(chat_id, stream_id, buffer.pendente if estado["ativo"] else "")
+    
+    try:
+        resposta = await gerar_resposta(chat_id, mensagem, on_chunk=on_chunk)
+        # Respostas fixas (objeções, erro da IA) não passam pelo streaming
+        restante = buffer.flush() if estado["recebeu"] else resposta
+        if restante and estado["ativo"]:
+            await enviar_trecho(chat_id, restante)
+    finally:
+        if estado["recebeu"]:
+            publicar_parcial(chat_id, stream_id, "", done=True)
+
+@timed(REPLY_LATENCY)
+async def processar_resposta(job: Dict):
+    """Worker: gera uma resposta para a rajada do chat e entrega pelo bot Node.js"""
+    chat_id = job["chat_id"]
+    try:
+        mensagens = reply_coalescer.take(chat_id)
+        if not mensagens:
+            return
+        if not chat_limiter.try_acquire(chat_id):
+            # Acima do limite por chat: a rajada espera a próxima ficha e sai numa
+            # resposta só, junto com o que o cliente mandar até lá
+            admissao_stats["chat_limited"] += 1
+            espera = chat_limiter.wait_time(chat_id)
+            print(f"⚠️ {chat_id} acima do limite de respostas por minuto, resposta adiada {espera:.0f}s")
+            reply_coalescer.defer(chat_id, mensagens, espera)
+            return
+        if config.get("streaming", True):
+            await responder_em_streaming(chat_id, "\n".join(mensagens))
+            return
+        
+        resposta = await gerar_resposta(chat_id, "\n".join(mensagens))
+        
+        # Um atendente pode ter assumido enquanto a IA pensava
+        conversa = await get_conversa(chat_id)
+        if conversa.humano_ativo:
+            return
+        
+        await registrar_resposta_bot(chat_id, resposta, enviar=True)
+    finally:
+        reply_coalescer.done(chat_id)
+
+# O webhook só enfileira; REPLY_WORKERS workers chamam a IA em paralelo
+reply_queue = JobQueue(
+    processar_resposta,
+    workers=int(os.getenv("REPLY_WORKERS", "4")),
+    max_size=int(os.getenv("REPLY_QUEUE_SIZE", "1000")),
+    name="respostas"
+)
+
+# Mensagens em sequência do mesmo cliente viram uma só geração (janela debounce_ms)
+reply_coalescer = ChatCoalescer(
+    reply_queue,
+    window=lambda: config.get("debounce_ms", 1200) / 1000
+)
+
+async def responder_sobrecarga(chat_id: str) -> dict:
+    """Fila funda demais: texto fixo (sem IA) no lugar da resposta, uma vez por chat"""
+    if not shed_limiter.try_acquire(chat_id):
+        admissao_stats["shed_silent"] += 1
+        return {"response": None, "reason": "overloaded"}
+    admissao_stats["shed"] += 1
+    resposta = get_mensagem_inicial()
+    await registrar_resposta_bot(chat_id, resposta)
+    return {"response": resposta, "reason": "overloaded"}
+
+# Reenvios do webhook (timeout no bot) pelo ID da mensagem no WhatsApp
+mensagens_recebidas = DedupIndex(
+    ttl=float(os.getenv("WEBHOOK_DEDUP_TTL", "600")),
+    max_size=int(os.getenv("WEBHOOK_DEDUP_SIZE", "10000"))
+)
+# Depois de um restart o índice está vazio: confere as últimas mensagens do chat
+DEDUP_HISTORICO = 50
+ingestao_stats = {"without_id": 0, "found_in_history": 0}
 
 @app.post("/api/webhook/message")
+@timed(WEBHOOK_LATENCY, {"route": "message"})
+@no_dono(fallback_local=True)
 async def receive_message(request: MessageRequest):
+    """Mensagem de um cliente; o mesmo message_id é processado uma vez só"""
+    if not request.message_id:
+        ingestao_stats["without_id"] += 1
+        return await ingerir_mensagem(request)
+    resultado, repetida = await mensagens_recebidas.run(
+        f"{request.chat_id}|{request.message_id}", lambda: ingerir_mensagem(request)
+    )
+    return {**resultado, "duplicate": True} if repetida else resultado
+
+async def ingerir_mensagem(request: MessageRequest) -> dict:
     chat_id = request.chat_id
     mensagem = request.message
     
-    conversa = get_conversa(chat_id)
+    conversa = await get_conversa(chat_id)
     
-    msg_recebida = {
-        "id": f"recv_{datetime.now().timestamp()}",
-        "from": "cliente",
-        "text": mensagem,
-        "timestamp": datetime.now().isoformat()
-    }
-    conversa["mensagens"].append(msg_recebida)
+    if request.message_id and any(
+        m.whatsapp_id == request.message_id for m in conversa.mensagens[-DEDUP_HISTORICO:]
+    ):
+        ingestao_stats["found_in_history"] += 1
+        return {"response": None, "duplicate": True}
+    
+    msg_recebida = Message(
+        ids.next("recv"), "cliente", mensagem, time.time(), whatsapp_id=request.message_id or None
+    )
+    conversa.mensagens.append(msg_recebida)
+    busca.add(chat_id, msg_recebida)
+    marcar_alterada(chat_id)
     
     await broadcast_message({
         "type": "message_received",
         "chat_id": chat_id,
-        "message": msg_recebida
+        "message": msg_recebida.to_dict()
     })
     
     # Verificar se bot pode responder
-    if conversa["humano_ativo"]:
-        if conversa["ultimo_humano"]:
-            ultimo = datetime.fromisoformat(conversa["ultimo_humano"])
-            diff_minutes = (datetime.now() - ultimo).total_seconds() / 60
+    if conversa.humano_ativo:
+        if conversa.ultimo_humano is not None:
+            diff_minutes = (msg_recebida.ts - conversa.ultimo_humano) / 60
             if diff_minutes > config.get("human_takeover_minutes", 60):
-                conversa["humano_ativo"] = False
+                conversa.humano_ativo = False
+                marcar_alterada(chat_id)
             else:
                 return {"response": None, "reason": "human_active"}
     
@@ -668,55 +1762,47 @@ async def receive_message(request: MessageRequest):
         return {"response": None, "reason": "auto_reply_disabled"}
     
     # PRIMEIRO: Verificar se cliente pediu atendente humano
-    if detecta_pedido_humano(mensagem):
-        conversa["modo_humanizado"] = True
-        conversa["mensagem_inicial_enviada"] = True  # Pula mensagem inicial
-        resposta = await gerar_resposta(chat_id, mensagem)
-    # SEGUNDO: Mensagem inicial para novos clientes
-    elif not conversa["mensagem_inicial_enviada"]:
+    if "pedido_humano" in detectar_intencoes(mensagem):
+        conversa.modo_humanizado = True
+        conversa.mensagem_inicial_enviada = True  # Pula mensagem inicial
+        marcar_alterada(chat_id)
+    # SEGUNDO: Mensagem inicial para novos clientes (texto fixo, responde na hora)
+    elif not conversa.mensagem_inicial_enviada:
         resposta = get_mensagem_inicial()
-        conversa["mensagem_inicial_enviada"] = True
-    # TERCEIRO: Resposta normal
-    else:
-        resposta = await gerar_resposta(chat_id, mensagem)
-    
-    msg_enviada = {
-        "id": f"sent_{datetime.now().timestamp()}",
-        "from": "bot",
-        "text": resposta,
-        "timestamp": datetime.now().isoformat()
-    }
-    conversa["mensagens"].append(msg_enviada)
+        conversa.mensagem_inicial_enviada = True
+        await registrar_resposta_bot(chat_id, resposta)
+        return {"response": resposta}
     
-    await broadcast_message({
-        "type": "message_sent",
-        "chat_id": chat_id,
-        "message": msg_enviada
-    })
-    
-    return {"response": resposta}
+    # TERCEIRO: Resposta com IA - agrupa a rajada, enfileira e envia pela fila de saída
+    # Primeiro contato passa na frente e nunca é descartado por sobrecarga
+    primeiro_contato = not conversa.historico_ia and not conversa.resumo_ia
+    if not primeiro_contato and (reply_queue.depth >= REPLY_SHED_DEPTH or outbox.depth >= OUTBOX_SHED_DEPTH):
+        return await responder_sobrecarga(chat_id)
+    reply_coalescer.add(chat_id, mensagem, priority=PRIORIDADE_ALTA if primeiro_contato else PRIORIDADE_NORMAL)
+    return {"response": None, "queued": True}
 
 @app.post("/api/webhook/status")
+@timed(WEBHOOK_LATENCY, {"route": "status"})
 async def update_whatsapp_status(request: Request):
-    global whatsapp_status
-    
+    """Status do bot (um objeto ou uma lista em ordem); só o que mudou vai aos painéis"""
     try:
         status = await request.json()
     except Exception:
         return {"success": False, "error": "Invalid JSON"}
     
-    if "connected" in status:
-        whatsapp_status["connected"] = status["connected"]
-    if "qr_code" in status:
-        whatsapp_status["qr_code"] = status["qr_code"]
-    if "phone_number" in status:
-        whatsapp_status["phone_number"] = status["phone_number"]
-    if "status_text" in status:
-        whatsapp_status["status_text"] = status["status_text"]
+    lote = status if isinstance(status, list) else [status]
+    mudancas, precisa_qr = whatsapp_state.aplicar_lote(s for s in lote if isinstance(s, dict))
+    if mudancas:
+        await broadcast_message({"type": "status_update", "status": mudancas})
+        # Worker que subir depois começa com o último status conhecido
+        await cluster.set_state("whatsapp", whatsapp_state.publico())
     
-    await broadcast_message({"type": "status_update", "status": whatsapp_status})
-    
-    return {"success": True}
+    return {"success": True, "changed": sorted(mudancas), "need_qr": precisa_qr}
+
+@app.get("/api/whatsapp/status")
+async def get_whatsapp_status(request: Request, qr: bool = True):
+    """Status do WhatsApp para polling: 304 (If-None-Match) enquanto nada muda"""
+    return resposta_com_etag(request, whatsapp_state.etag(qr), lambda: whatsapp_state.publico(qr))
 
 @app.post("/api/test-ai")
 async def test_ai():
@@ -737,7 +1823,7 @@ async def test_ai():
         else:
             if not config.get("gemini_api_key"):
                 return {"success": False, "error": "API Key do Gemini não configurada"}
-            response = call_gemini(messages, model, "Responda apenas: OK, funcionando!")
+            response = await call_gemini_async(messages, model, "Responda apenas: OK, funcionando!")
         
         return {
             "success": True, 
@@ -750,36 +1836,68 @@ async def test_ai():
 
 @app.delete("/api/conversas")
 async def clear_conversas():
-    global conversas
-    conversas = {}
+    conversas.clear()
+    resumos.clear()
+    busca.clear()
+    conversa_writer.reset()
+    await conversa_store.clear()
+    await broadcast_message({"type": "conversas_limpas"})
     return {"success": True}
 
 @app.delete("/api/conversa/{chat_id}")
+@no_dono()
 async def delete_conversa(chat_id: str):
-    if chat_id in conversas:
+    if await carregar_conversa(chat_id) is not None:
         del conversas[chat_id]
+        resumos.remove(chat_id)
+        busca.remove_chat(chat_id)
+        conversa_writer.mark_deleted(chat_id)
+        await broadcast_message({"type": "conversa_removida", "chat_id": chat_id})
         return {"success": True}
     raise HTTPException(status_code=404, detail="Conversa não encontrada")
 
 # ==================== WEBSOCKET ====================
 
+def snapshot_painel() -> dict:
+    """Estado inicial compacto: status, config e resumos das conversas recentes"""
+    pagina, proximo = resumos.page(WS_SNAPSHOT_CONVERSAS)
+    return {
+        "type": "init",
+        "v": PROTOCOL_VERSION,
+        "epoch": event_stream.epoch,
+        "seq": event_stream.seq,
+        "status": whatsapp_status,
+        "outbox": outbox.stats(),
+        "config": {
+            "auto_reply": config.get("auto_reply", True),
+            "human_takeover_minutes": config.get("human_takeover_minutes", 60)
+        },
+        "conversas": pagina,
+        "next_cursor": proximo,
+        "versao": resumos.token
+    }
+
+def sincronizacao_inicial(resume_seq: Optional[int]) -> List[dict]:
+    """Replay dos eventos perdidos ou, se não der, um snapshot novo"""
+    if resume_seq is not None:
+        perdidos = event_stream.since(resume_seq)
+        if perdidos is not None:
+            return [{
+                "type": "resumed",
+                "v": PROTOCOL_VERSION,
+                "epoch": event_stream.epoch,
+                "from_seq": resume_seq,
+                "seq": event_stream.seq
+            }] + perdidos
+    return [snapshot_painel()]
+
 @app.websocket("/api/ws")
-async def websocket_endpoint(websocket: WebSocket):
+async def websocket_endpoint(websocket: WebSocket, epoch: Optional[str] = None, resume: Optional[int] = None):
     await websocket.accept()
-    websocket_clients.append(websocket)
     
-    try:
-        await websocket.send_json({
-            "type": "init",
-            "status": whatsapp_status,
-            "config": {
-                "auto_reply": config.get("auto_reply", True),
-                "human_takeover_minutes": config.get("human_takeover_minutes", 60)
-            },
-            "conversas": list(conversas.values())
-        })
-    except Exception:
-        pass
+    # Backlog e registro acontecem sem await no meio: nenhum evento se perde
+    backlog = sincronizacao_inicial(event_stream.parse_resume(epoch, resume))
+    client = ws_hub.register(websocket, backlog)
     
     try:
         while True:
@@ -787,21 +1905,53 @@ async def websocket_endpoint(websocket: WebSocket):
             try:
                 cmd = json.loads(data)
                 if cmd.get("type") == "ping":
-                    await websocket.send_json({"type": "pong"})
+                    ws_hub.send_to(client, {"type": "pong", "seq": event_stream.seq})
             except Exception:
                 pass
     except WebSocketDisconnect:
         pass
+    except RuntimeError:
+        # Socket já fechado pela task escritora (cliente lento)
+        pass
     finally:
-        try:
-            websocket_clients.remove(websocket)
-        except Exception:
-            pass
+        await client.stop()
+        ws_hub.unregister(client)
 
 # ==================== STARTUP ====================
 
+background_tasks: List[asyncio.Task] = []
+
 @app.on_event("startup")
 async def startup_event():
+    await http_pool.start()
+    config_store.start()
+    
+    # Recarregar conversas recentes; as antigas entram sob demanda
+    desde = datetime.now().timestamp() - CONVERSAS_PRELOAD_HOURS * 3600
+    recentes = await conversa_store.load_since(desde)
+    # Mais antigas primeiro para a ordem LRU ficar correta
+    for dados in reversed(recentes[:conversas.max_size]):
+        conversas.setdefault(dados["chat_id"], Conversation.from_dict(dados))
+        conversas.touch(dados["chat_id"])
+    resumos.load([
+        resumo_conversa(resumo["_conversa"]) if "_conversa" in resumo else resumo
+        for resumo in await conversa_store.load_summaries()
+    ])
+    conversa_writer.start()
+    busca.start()
+    estado_whatsapp = await cluster.get_state("whatsapp")
+    if estado_whatsapp:
+        whatsapp_state.aplicar(estado_whatsapp)
+    await cluster.start(evento_do_cluster, pedido_do_cluster)
+    await outbox.start()
+    if cluster.distribuido and conversa_store.name == "memory":
+        print("⚠️ CONVERSAS_STORE=memory com vários workers: cada um só enxerga as próprias conversas")
+    reply_queue.start()
+    resumo_queue.start()
+    background_tasks.append(asyncio.create_task(limpar_cache_conversas()))
+    background_tasks.append(asyncio.create_task(indexar_historico()))
+    background_tasks.append(asyncio.create_task(publicar_stats_fila()))
+    
     provider = config.get("provider", "openrouter")
     model = config.get("selected_model", "deepseek/deepseek-r1:free")
     if provider == "openrouter":
@@ -816,9 +1966,29 @@ async def startup_event():
     print(f"🧠 Modelo: {model}")
     print(f"🔑 API Key configurada: {'Sim' if has_key else 'Não'}")
     print(f"🌐 Site: {config.get('site_url', 'https://sushiakicb.shop')}")
+    print(f"💾 Conversas: {conversa_store.name} ({len(conversas)} carregadas)")
+    print(f"🔗 Cluster: {cluster.name} ({cluster.worker_id}, {len(cluster.membros)} worker(s))")
     print(f"🐺 Modo Lobo de Wall Street: ATIVADO")
     print("=" * 60)
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    for task in background_tasks:
+        task.cancel()
+    background_tasks.clear()
+    reply_coalescer.cancel()
+    await reply_queue.stop()
+    await resumo_queue.stop()
+    await outbox.stop()
+    await ws_hub.close()
+    await cluster.close()
+    await conversa_writer.stop()
+    await busca.close()
+    await conversa_store.close()
+    await http_pool.close()
+    await config_store.stop()
+    gemini_executor.shutdown(wait=False, cancel_futures=True)
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8001)
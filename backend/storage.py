@@ -0,0 +1,575 @@
+"""
+Persistência das conversas
+
+Backends plugáveis (SQLite local por padrão, MongoDB opcional) e um
+escritor write-behind: o webhook só marca a conversa como alterada e um
+task em segundo plano grava os lotes, sem o hot path esperar pelo disco.
+"""
+import asyncio
+import json
+import os
+import sqlite3
+import sys
+import time
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+
+class ConversationStore:
+    """Interface dos backends de armazenamento de conversas"""
+
+    name = "base"
+
+    async def load(self, chat_id: str) -> Optional[Dict]:
+        raise NotImplementedError
+
+    async def load_since(self, since: float) -> List[Dict]:
+        """Conversas alteradas depois de `since` (epoch), mais recentes primeiro"""
+        raise NotImplementedError
+
+    async def load_summaries(self) -> List[Dict]:
+        """Resumos de todas as conversas (sem carregar as mensagens)"""
+        raise NotImplementedError
+
+    async def load_page(self, after: Optional[str], limit: int) -> List[Dict]:
+        """Até `limit` conversas com chat_id maior que `after`, em ordem de chat_id
+
+        Para percorrer o arquivo inteiro em lotes sem carregar tudo de uma vez.
+        """
+        raise NotImplementedError
+
+    async def save_many(self, rows: List[Tuple[str, str, float, str]]):
+        """Grava (chat_id, json, atualizado_em, resumo_json) em lote"""
+        raise NotImplementedError
+
+    async def delete_many(self, chat_ids: List[str]):
+        raise NotImplementedError
+
+    async def clear(self):
+        raise NotImplementedError
+
+    async def count(self) -> int:
+        raise NotImplementedError
+
+    async def close(self):
+        pass
+
+
+class MemoryStore(ConversationStore):
+    """Sem persistência (comportamento antigo) - útil para testes"""
+
+    name = "memory"
+
+    def __init__(self):
+        self._rows: Dict[str, Tuple[str, float, str]] = {}
+
+    async def load(self, chat_id):
+        row = self._rows.get(chat_id)
+        return json.loads(row[0]) if row else None
+
+    async def load_since(self, since):
+        rows = sorted(self._rows.values(), key=lambda r: r[1], reverse=True)
+        return [json.loads(data) for data, ts, _ in rows if ts >= since]
+
+    async def load_summaries(self):
+        return [json.loads(resumo) for _, _, resumo in self._rows.values()]
+
+    async def load_page(self, after, limit):
+        chat_ids = sorted(c for c in self._rows if after is None or c > after)[:limit]
+        return [json.loads(self._rows[c][0]) for c in chat_ids]
+
+    async def save_many(self, rows):
+        for chat_id, data, ts, resumo in rows:
+            self._rows[chat_id] = (data, ts, resumo)
+
+    async def delete_many(self, chat_ids):
+        for chat_id in chat_ids:
+            self._rows.pop(chat_id, None)
+
+    async def clear(self):
+        self._rows.clear()
+
+    async def count(self):
+        return len(self._rows)
+
+
+def _decode(data) -> Dict:
+    """Aceita JSON puro (linhas antigas) ou JSON comprimido com zlib"""
+    if isinstance(data, bytes):
+        data = zlib.decompress(data).decode("utf-8")
+    return json.loads(data)
+
+
+class SQLiteStore(ConversationStore):
+    """SQLite local; todo acesso ao arquivo roda numa única thread dedicada
+
+    O JSON é gravado comprimido (zlib), o que deixa o arquivo bem menor para
+    conversas que saíram do cache em memória.
+    """
+
+    name = "sqlite"
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._db: Optional[sqlite3.Connection] = None
+
+    def _conn(self) -> sqlite3.Connection:
+        if self._db is None:
+            self._db = sqlite3.connect(str(self.path), check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS conversas ("
+                " chat_id TEXT PRIMARY KEY,"
+                " data TEXT NOT NULL,"
+                " atualizado_em REAL NOT NULL,"
+                " resumo TEXT)"
+            )
+            colunas = {r[1] for r in self._db.execute("PRAGMA table_info(conversas)")}
+            if "resumo" not in colunas:
+                self._db.execute("ALTER TABLE conversas ADD COLUMN resumo TEXT")
+            self._db.execute(
+                "CREATE INDEX IF NOT EXISTS idx_conversas_atualizado ON conversas(atualizado_em)"
+            )
+            self._db.commit()
+        return self._db
+
+    async def _run(self, fn, *args):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite")
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, fn, *args)
+
+    def _load(self, chat_id):
+        row = self._conn().execute(
+            "SELECT data FROM conversas WHERE chat_id = ?", (chat_id,)
+        ).fetchone()
+        return _decode(row[0]) if row else None
+
+    def _load_since(self, since):
+        rows = self._conn().execute(
+            "SELECT data FROM conversas WHERE atualizado_em >= ? ORDER BY atualizado_em DESC",
+            (since,),
+        ).fetchall()
+        return [_decode(r[0]) for r in rows]
+
+    def _load_summaries(self):
+        rows = self._conn().execute("SELECT chat_id, data, resumo FROM conversas").fetchall()
+        resumos = []
+        for chat_id, data, resumo in rows:
+            if resumo is None:
+                # Linha antiga, gravada antes da coluna existir
+                resumos.append({"chat_id": chat_id, "_conversa": _decode(data)})
+            else:
+                resumos.append(json.loads(resumo))
+        return resumos
+
+    def _load_page(self, after, limit):
+        rows = self._conn().execute(
+            "SELECT data FROM conversas WHERE chat_id > ? ORDER BY chat_id LIMIT ?",
+            (after or "", limit),
+        ).fetchall()
+        return [_decode(r[0]) for r in rows]
+
+    def _save_many(self, rows):
+        db = self._conn()
+        with db:
+            db.executemany(
+                "INSERT INTO conversas (chat_id, data, atualizado_em, resumo) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(chat_id) DO UPDATE SET data = excluded.data, "
+                "atualizado_em = excluded.atualizado_em, resumo = excluded.resumo",
+                [
+                    (chat_id, zlib.compress(data.encode("utf-8"), 6), ts, resumo)
+                    for chat_id, data, ts, resumo in rows
+                ],
+            )
+
+    def _delete_many(self, chat_ids):
+        db = self._conn()
+        with db:
+            db.executemany("DELETE FROM conversas WHERE chat_id = ?", [(c,) for c in chat_ids])
+
+    def _clear(self):
+        db = self._conn()
+        with db:
+            db.execute("DELETE FROM conversas")
+
+    def _count(self):
+        return self._conn().execute("SELECT COUNT(*) FROM conversas").fetchone()[0]
+
+    def _close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+    async def load(self, chat_id):
+        return await self._run(self._load, chat_id)
+
+    async def load_since(self, since):
+        return await self._run(self._load_since, since)
+
+    async def load_summaries(self):
+        return await self._run(self._load_summaries)
+
+    async def load_page(self, after, limit):
+        return await self._run(self._load_page, after, limit)
+
+    async def save_many(self, rows):
+        if rows:
+            await self._run(self._save_many, rows)
+
+    async def delete_many(self, chat_ids):
+        if chat_ids:
+            await self._run(self._delete_many, chat_ids)
+
+    async def clear(self):
+        await self._run(self._clear)
+
+    async def count(self):
+        return await self._run(self._count)
+
+    async def close(self):
+        if self._executor is not None:
+            await self._run(self._close)
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+
+class MongoStore(ConversationStore):
+    """MongoDB via motor (dependência opcional: pip install motor)"""
+
+    name = "mongo"
+
+    def __init__(self, url: str, database: str = "sushiaki"):
+        try:
+            from motor.motor_asyncio import AsyncIOMotorClient
+        except ImportError as e:
+            raise RuntimeError("CONVERSAS_STORE=mongo requer o pacote 'motor' (pip install motor)") from e
+        from pymongo import UpdateOne
+
+        self._update_one = UpdateOne
+        self._client = AsyncIOMotorClient(url)
+        db = self._client.get_default_database(default=database)
+        self._col = db["conversas"]
+
+    async def load(self, chat_id):
+        doc = await self._col.find_one({"_id": chat_id})
+        return json.loads(doc["data"]) if doc else None
+
+    async def load_since(self, since):
+        cursor = self._col.find({"atualizado_em": {"$gte": since}}).sort("atualizado_em", -1)
+        return [json.loads(doc["data"]) async for doc in cursor]
+
+    async def load_summaries(self):
+        cursor = self._col.find({}, {"resumo": 1, "data": 1})
+        resumos = []
+        async for doc in cursor:
+            if doc.get("resumo"):
+                resumos.append(json.loads(doc["resumo"]))
+            else:
+                resumos.append({"chat_id": doc["_id"], "_conversa": json.loads(doc["data"])})
+        return resumos
+
+    async def load_page(self, after, limit):
+        filtro = {"_id": {"$gt": after}} if after is not None else {}
+        cursor = self._col.find(filtro, {"data": 1}).sort("_id", 1).limit(limit)
+        return [json.loads(doc["data"]) async for doc in cursor]
+
+    async def save_many(self, rows):
+        if not rows:
+            return
+        ops = [
+            self._update_one(
+                {"_id": chat_id},
+                {"$set": {"data": data, "atualizado_em": ts, "resumo": resumo}},
+                upsert=True,
+            )
+            for chat_id, data, ts, resumo in rows
+        ]
+        await self._col.bulk_write(ops, ordered=False)
+
+    async def delete_many(self, chat_ids):
+        if chat_ids:
+            await self._col.delete_many({"_id": {"$in": list(chat_ids)}})
+
+    async def clear(self):
+        await self._col.delete_many({})
+
+    async def count(self):
+        return await self._col.count_documents({})
+
+    async def close(self):
+        self._client.close()
+
+
+def create_store(kind: Optional[str] = None, base_dir: Optional[Path] = None) -> ConversationStore:
+    """Cria o backend a partir de CONVERSAS_STORE (sqlite | mongo | memory)"""
+    kind = (kind or os.getenv("CONVERSAS_STORE", "sqlite")).lower()
+    if kind == "memory":
+        return MemoryStore()
+    if kind == "mongo":
+        url = os.getenv("MONGO_URL")
+        if not url:
+            raise RuntimeError("CONVERSAS_STORE=mongo requer MONGO_URL")
+        return MongoStore(url)
+    if kind == "sqlite":
+        default_path = Path(base_dir or Path(__file__).parent) / "conversas.db"
+        return SQLiteStore(Path(os.getenv("CONVERSAS_DB", default_path)))
+    raise RuntimeError(f"CONVERSAS_STORE desconhecido: {kind}")
+
+
+class WriteBehindWriter:
+    """Acumula chat_ids alterados e grava em lotes periódicos"""
+
+    def __init__(
+        self,
+        store: ConversationStore,
+        snapshot: Callable[[str], Optional[Dict]],
+        summarize: Callable[[Dict], Dict],
+        interval: float = 1.0,
+        max_batch: int = 500,
+    ):
+        self.store = store
+        self.snapshot = snapshot
+        self.summarize = summarize
+        self.interval = interval
+        self.max_batch = max_batch
+        self._dirty: Set[str] = set()
+        self._deleted: Set[str] = set()
+        self._task: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._flush_lock: Optional[asyncio.Lock] = None
+        self.stats = {
+            "batches": 0,
+            "rows_written": 0,
+            "rows_deleted": 0,
+            "errors": 0,
+            "last_flush_ms": 0.0,
+        }
+
+    def mark(self, chat_id: str):
+        """Marca a conversa para ser gravada no próximo lote"""
+        self._deleted.discard(chat_id)
+        self._dirty.add(chat_id)
+        if self._wakeup is not None and len(self._dirty) >= self.max_batch:
+            self._wakeup.set()
+
+    def mark_deleted(self, chat_id: str):
+        self._dirty.discard(chat_id)
+        self._deleted.add(chat_id)
+
+    def reset(self):
+        """Descarta alterações pendentes (ex.: após limpar todas as conversas)"""
+        self._dirty.clear()
+        self._deleted.clear()
+
+    def is_pending(self, chat_id: str) -> bool:
+        return chat_id in self._dirty
+
+    @property
+    def pending(self) -> int:
+        return len(self._dirty) + len(self._deleted)
+
+    def start(self):
+        if self._task is None:
+            self._wakeup = asyncio.Event()
+            self._flush_lock = asyncio.Lock()
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.stats["errors"] += 1
+                print(f"Erro ao gravar conversas: {e}")
+
+    async def flush(self):
+        """Grava agora tudo o que estiver pendente"""
+        if self._flush_lock is None:
+            self._flush_lock = asyncio.Lock()
+        async with self._flush_lock:
+            if not self._dirty and not self._deleted:
+                return
+            inicio = time.perf_counter()
+            dirty, self._dirty = self._dirty, set()
+            deleted, self._deleted = self._deleted, set()
+
+            # Serializa no event loop para gravar um estado consistente
+            agora = time.time()
+            rows = []
+            for chat_id in dirty:
+                conversa = self.snapshot(chat_id)
+                if conversa is not None:
+                    rows.append((
+                        chat_id,
+                        json.dumps(conversa, ensure_ascii=False),
+                        agora,
+                        json.dumps(self.summarize(conversa), ensure_ascii=False),
+                    ))
+            try:
+                await self.store.delete_many(list(deleted))
+                await self.store.save_many(rows)
+            except Exception:
+                # Devolve para a fila e tenta de novo no próximo ciclo
+                self._dirty |= dirty - self._deleted
+                self._deleted |= deleted - self._dirty
+                raise
+            self.stats["batches"] += 1
+            self.stats["rows_written"] += len(rows)
+            self.stats["rows_deleted"] += len(deleted)
+            self.stats["last_flush_ms"] = round((time.perf_counter() - inicio) * 1000, 2)
+
+    async def stop(self):
+        """Para o task e grava o que restou"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+
+class ConversationCache(dict):
+    """Conversas ativas em memória, limitadas por quantidade (LRU) e ociosidade (TTL)
+
+    É um dict comum para o resto do código; quem acessa uma conversa chama
+    `touch` para atualizar a ordem LRU. A remoção fica a cargo de `evict_idle`,
+    chamada periodicamente depois que o write-behind já gravou a conversa.
+    """
+
+    def __init__(self, max_size: int = 2000, ttl: float = 6 * 3600, min_idle: float = 120):
+        super().__init__()
+        self.max_size = max_size
+        self.ttl = ttl
+        self.min_idle = min_idle  # nunca remove conversas tocadas há menos que isso
+        self._last_access: Dict[str, float] = {}  # ordem de inserção = ordem LRU
+        # Tamanho estimado por conversa; só as alteradas são medidas de novo
+        self._tamanhos: Dict[str, int] = {}
+        self._alteradas: Set[str] = set()
+        self.stats = {
+            "hits": 0,
+            "misses": 0,
+            "reloads": 0,
+            "evicted_lru": 0,
+            "evicted_ttl": 0,
+        }
+
+    def touch(self, chat_id: str):
+        self._last_access.pop(chat_id, None)
+        self._last_access[chat_id] = time.monotonic()
+        self._alteradas.add(chat_id)
+
+    def mark_changed(self, chat_id: str):
+        """A conversa mudou: o tamanho estimado é refeito na próxima leitura"""
+        self._alteradas.add(chat_id)
+
+    def __delitem__(self, chat_id):
+        super().__delitem__(chat_id)
+        self._last_access.pop(chat_id, None)
+        self._tamanhos.pop(chat_id, None)
+
+    def clear(self):
+        super().clear()
+        self._last_access.clear()
+        self._tamanhos.clear()
+        self._alteradas.clear()
+
+    def _remover(self, chat_id: str, motivo: str):
+        super().__delitem__(chat_id)
+        del self._last_access[chat_id]
+        self._tamanhos.pop(chat_id, None)
+        self.stats[motivo] += 1
+
+    def evict_idle(self, protect: Callable[[str], bool]) -> List[str]:
+        """Remove conversas ociosas (TTL) e as menos usadas acima de max_size
+
+        `protect` diz quais conversas não podem sair agora (alteração ainda
+        não gravada, resposta em andamento).
+        """
+        agora = time.monotonic()
+        removidas = []
+        # TTL: em ordem LRU, para na primeira usada há menos tempo que o TTL
+        for chat_id, acesso in list(self._last_access.items()):
+            if chat_id not in self:
+                del self._last_access[chat_id]
+                continue
+            if agora - acesso < max(self.ttl, self.min_idle):
+                break
+            if protect(chat_id):
+                continue
+            self._remover(chat_id, "evicted_ttl")
+            removidas.append(chat_id)
+
+        # Tamanho: as menos usadas saem até caber em max_size; primeiro as
+        # ociosas há mais de min_idle e, numa rajada de chats novos, as recentes
+        excesso = len(self) - self.max_size
+        for recentes in (False, True):
+            if excesso <= 0:
+                break
+            for chat_id, acesso in list(self._last_access.items()):
+                if excesso <= 0:
+                    break
+                if chat_id not in self:
+                    continue
+                if not recentes and agora - acesso < self.min_idle:
+                    break  # daqui em diante todas foram usadas mais recentemente
+                if protect(chat_id):
+                    continue
+                self._remover(chat_id, "evicted_lru")
+                removidas.append(chat_id)
+                excesso -= 1
+        return removidas
+
+    @property
+    def estimated_bytes(self) -> int:
+        for chat_id in self._alteradas:
+            conversa = self.get(chat_id)
+            if conversa is not None:
+                self._tamanhos[chat_id] = _estimate_size(conversa)
+        self._alteradas.clear()
+        return sum(self._tamanhos.values())
+
+    def memory_stats(self) -> Dict:
+        return {
+            "cached": len(self),
+            "max_size": self.max_size,
+            "ttl_seconds": self.ttl,
+            "estimated_bytes": self.estimated_bytes,
+            "rss_bytes": _rss_bytes(),
+            **self.stats,
+        }
+
+
+def _estimate_size(obj, _getsizeof=sys.getsizeof) -> int:
+    """Tamanho aproximado (recursivo) de uma conversa em memória"""
+    if isinstance(obj, dict):
+        return _getsizeof(obj) + sum(_estimate_size(k) + _estimate_size(v) for k, v in obj.items())
+    if isinstance(obj, (list, tuple, deque)):
+        return _getsizeof(obj) + sum(_estimate_size(v) for v in obj)
+    slots = getattr(type(obj), "__slots__", None)
+    if slots:  # registros compactos (records.py)
+        return _getsizeof(obj) + sum(_estimate_size(getattr(obj, s, None)) for s in slots)
+    return _getsizeof(obj)
+
+
+def _rss_bytes() -> Optional[int]:
+    """Memória residente do processo (Linux); None em outros sistemas"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return None
@@ -0,0 +1,127 @@
+"""
+Respostas da IA em streaming
+
+Utilitários para consumir tokens conforme chegam: parser de SSE (formato
+da OpenRouter/OpenAI), ponte de iteradores síncronos (SDK do Gemini) para
+async generators e o divisor que corta o texto em frases/parágrafos para
+enviar ao WhatsApp assim que um trecho completo fica pronto.
+"""
+import asyncio
+import re
+import threading
+from concurrent.futures import Executor
+from typing import AsyncIterator, Callable, Iterable, List, Optional, Tuple
+
+# Fim de frase seguido de espaço/quebra; "1. " de listas numeradas não conta
+_FIM_FRASE = re.compile(r"(?<!\d)[.!?…]+[\"')\]]*\s+|\n")
+_FIM = object()
+
+
+async def iter_sse(linhas: AsyncIterator[bytes]) -> AsyncIterator[str]:
+    """Campos `data:` de um stream Server-Sent Events, um evento por item"""
+    dados: List[str] = []
+    async for bruta in linhas:
+        linha = bruta.decode("utf-8").rstrip("\r\n")
+        if not linha:
+            if dados:
+                yield "\n".join(dados)
+                dados = []
+            continue
+        if linha.startswith(":"):
+            continue  # comentário/keep-alive (": OPENROUTER PROCESSING")
+        campo, _, valor = linha.partition(":")
+        if campo == "data":
+            dados.append(valor[1:] if valor.startswith(" ") else valor)
+    if dados:
+        yield "\n".join(dados)
+
+
+async def iter_in_thread(executor: Executor, factory: Callable[[], Iterable]) -> AsyncIterator:
+    """Consome um iterador bloqueante numa thread do `executor`, item a item"""
+    loop = asyncio.get_running_loop()
+    fila: asyncio.Queue = asyncio.Queue()
+    parar = threading.Event()
+
+    def entregar(item, erro=None):
+        try:
+            loop.call_soon_threadsafe(fila.put_nowait, (item, erro))
+        except RuntimeError:
+            parar.set()  # loop já fechado
+
+    def produzir():
+        try:
+            for item in factory():
+                if parar.is_set():
+                    return
+                entregar(item)
+        except Exception as e:
+            entregar(_FIM, e)
+        else:
+            entregar(_FIM)
+
+    loop.run_in_executor(executor, produzir)
+    try:
+        while True:
+            item, erro = await fila.get()
+            if item is _FIM:
+                if erro is not None:
+                    raise erro
+                return
+            yield item
+    finally:
+        parar.set()
+
+
+async def open_stream(chunks: AsyncIterator[str]) -> Tuple[str, AsyncIterator[str]]:
+    """Espera o primeiro trecho não vazio; erros antes dele sobem normalmente
+
+    Usado com o ModelRouter: failover e hedge valem até o primeiro token,
+    depois disso o stream pertence a um único modelo.
+    """
+    async for chunk in chunks:
+        if chunk:
+            return chunk, chunks
+    raise ValueError("resposta vazia")
+
+
+class SentenceBuffer:
+    """Acumula tokens e libera trechos completos (frases/parágrafos)
+
+    Um trecho só sai quando termina em fim de frase e tem pelo menos
+    `min_chars` caracteres, para não picotar a resposta em dezenas de
+    mensagens; quebra de parágrafo sempre libera o que houver.
+    """
+
+    def __init__(self, min_chars: int = 80):
+        self.min_chars = min_chars
+        self.pendente = ""
+
+    def feed(self, delta: str) -> List[str]:
+        self.pendente += delta
+        trechos = []
+        while True:
+            corte = self._corte()
+            if corte is None:
+                break
+            trecho, self.pendente = self.pendente[:corte].strip(), self.pendente[corte:].lstrip()
+            if trecho:
+                trechos.append(trecho)
+        return trechos
+
+    def _corte(self) -> Optional[int]:
+        paragrafo = self.pendente.find("\n\n")
+        if paragrafo != -1:
+            return paragrafo + 2
+        corte = None
+        for fim in _FIM_FRASE.finditer(self.pendente):
+            if fim.end() >= len(self.pendente):
+                # Pode ser "3." de "3.5" ou reticências ainda chegando
+                break
+            corte = fim.end()
+            if corte >= self.min_chars:
+                return corte
+        return None
+
+    def flush(self) -> Optional[str]:
+        trecho, self.pendente = self.pendente.strip(), ""
+        return trecho or None
@@ -0,0 +1,202 @@
+"""
+Índice de resumos das conversas
+
+Mantém, para cada chat (inclusive os que já saíram do cache em memória),
+um resumo pequeno com a última mensagem, contadores e flags de modo, além
+de um número de versão monotônico. Com isso a listagem do painel é
+paginada por cursor e os clientes podem pedir só o que mudou (`since=`).
+"""
+import base64
+import uuid
+from bisect import bisect_left, insort
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+PREVIEW_CHARS = 200
+MAX_REMOVIDAS = 5000
+
+
+def resumo_conversa(conversa: Dict) -> Dict:
+    """Resumo compacto de uma conversa para a listagem do painel"""
+    mensagens = conversa.get("mensagens", [])
+    ultima = mensagens[-1] if mensagens else None
+
+    # Mensagens do cliente ainda sem resposta (bot ou humano)
+    nao_lidas = 0
+    for msg in reversed(mensagens):
+        if msg.get("from") != "cliente":
+            break
+        nao_lidas += 1
+
+    if ultima is not None:
+        ultima = {
+            "id": ultima.get("id"),
+            "from": ultima.get("from"),
+            "text": (ultima.get("text") or "")[:PREVIEW_CHARS],
+            "timestamp": ultima.get("timestamp"),
+        }
+
+    return {
+        "chat_id": conversa["chat_id"],
+        "nome_cliente": conversa.get("nome_cliente"),
+        "humano_ativo": conversa.get("humano_ativo", False),
+        "modo_humanizado": conversa.get("modo_humanizado", False),
+        "ultima_mensagem": ultima,
+        "total_mensagens": len(mensagens),
+        "nao_lidas": nao_lidas,
+        "criado_em": conversa.get("criado_em"),
+        "atualizado_em": ultima["timestamp"] if ultima else conversa.get("criado_em"),
+    }
+
+
+def chave_ordem(resumo: Dict) -> Tuple[str, str]:
+    """Posição do resumo na listagem (a página anda do maior para o menor)"""
+    return resumo.get("atualizado_em") or "", resumo["chat_id"]
+
+
+def encode_cursor(atualizado_em: str, chat_id: str) -> str:
+    raw = f"{atualizado_em or ''}|{chat_id}".encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Optional[Tuple[str, str]]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode("utf-8")
+        atualizado_em, chat_id = raw.split("|", 1)
+        return atualizado_em, chat_id
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+
+class SummaryIndex:
+    """Resumos de todas as conversas com versionamento para deltas"""
+
+    def __init__(self):
+        self._resumos: Dict[str, Dict] = {}
+        # Chaves de ordem em ordem crescente, mantidas com bisect a cada escrita
+        self._ordem: List[Tuple[str, str]] = []
+        # chat_id -> versão, da mais antiga para a mais recente
+        self._versoes: "OrderedDict[str, int]" = OrderedDict()
+        self._removidas: Dict[str, int] = {}  # chat_id -> versão da remoção
+        self._horizonte = 0  # remoções anteriores a esta versão foram esquecidas
+        self.epoch = uuid.uuid4().hex[:8]
+        self.versao = 0
+
+    def __len__(self):
+        return len(self._resumos)
+
+    def __contains__(self, chat_id):
+        return chat_id in self._resumos
+
+    @property
+    def token(self) -> str:
+        """Token opaco da versão atual (muda também quando o servidor reinicia)"""
+        return f"{self.epoch}.{self.versao}"
+
+    def parse_token(self, token: Optional[str]) -> Optional[int]:
+        """Versão contida no token, ou None se for de outra instância/inválido"""
+        if not token:
+            return None
+        epoch, _, versao = token.partition(".")
+        if epoch != self.epoch:
+            return None
+        try:
+            return int(versao)
+        except ValueError:
+            return None
+
+    def load(self, resumos: List[Dict]):
+        """Popula o índice no startup a partir dos resumos gravados"""
+        for resumo in resumos:
+            self._resumos[resumo["chat_id"]] = {**resumo, "versao": 0}
+            self._versoes.pop(resumo["chat_id"], None)
+        # Uma ordenação só no fim em vez de um insort por resumo
+        self._ordem = sorted(chave_ordem(r) for r in self._resumos.values())
+
+    def _gravar(self, resumo: Dict) -> Dict:
+        chat_id = resumo["chat_id"]
+        self._tirar_da_ordem(chat_id)
+        self._resumos[chat_id] = resumo
+        insort(self._ordem, chave_ordem(resumo))
+        self._versoes[chat_id] = resumo["versao"]
+        self._versoes.move_to_end(chat_id)
+        self._removidas.pop(chat_id, None)
+        return resumo
+
+    def _tirar_da_ordem(self, chat_id: str):
+        anterior = self._resumos.get(chat_id)
+        if anterior is not None:
+            chave = chave_ordem(anterior)
+            posicao = bisect_left(self._ordem, chave)
+            if posicao < len(self._ordem) and self._ordem[posicao] == chave:
+                del self._ordem[posicao]
+
+    def update(self, conversa: Dict) -> Dict:
+        self.versao += 1
+        resumo = resumo_conversa(conversa)
+        resumo["versao"] = self.versao
+        return self._gravar(resumo)
+
+    def put(self, resumo: Dict) -> Dict:
+        """Resumo calculado em outro worker; recebe uma versão deste índice"""
+        self.versao += 1
+        return self._gravar({**resumo, "versao": self.versao})
+
+    def remove(self, chat_id: str):
+        if chat_id not in self._resumos:
+            return
+        self._tirar_da_ordem(chat_id)
+        del self._resumos[chat_id]
+        self._versoes.pop(chat_id, None)
+        self.versao += 1
+        self._removidas[chat_id] = self.versao
+        if len(self._removidas) > MAX_REMOVIDAS:
+            antigo = next(iter(self._removidas))
+            self._horizonte = self._removidas.pop(antigo)
+
+    def clear(self):
+        """Remove tudo; uma nova epoch força os clientes a recarregar"""
+        self._resumos.clear()
+        self._ordem.clear()
+        self._versoes.clear()
+        self._removidas.clear()
+        self._horizonte = 0
+        self.epoch = uuid.uuid4().hex[:8]
+        self.versao = 0
+
+    def get(self, chat_id: str) -> Optional[Dict]:
+        return self._resumos.get(chat_id)
+
+    def page(self, limit: int, cursor: Optional[str] = None) -> Tuple[List[Dict], Optional[str]]:
+        """Página ordenada da atividade mais recente para a mais antiga"""
+        fim = len(self._ordem)
+        if cursor:
+            posicao = decode_cursor(cursor)
+            if posicao is not None:
+                fim = bisect_left(self._ordem, posicao)
+        inicio = max(0, fim - limit)
+        pagina = [self._resumos[chat_id] for _, chat_id in reversed(self._ordem[inicio:fim])]
+        proximo = None
+        if inicio > 0 and pagina:
+            ultimo = pagina[-1]
+            proximo = encode_cursor(ultimo.get("atualizado_em") or "", ultimo["chat_id"])
+        return pagina, proximo
+
+    def changes_since(self, versao: int) -> Optional[Tuple[List[Dict], List[str]]]:
+        """(alterados, removidos) depois de `versao`; None se for antiga demais"""
+        if versao < self._horizonte or versao > self.versao:
+            return None
+        # Os dois índices estão em ordem de versão: lê só a cauda que mudou
+        alterados = []
+        for chat_id, versao_chat in reversed(self._versoes.items()):
+            if versao_chat <= versao:
+                break
+            alterados.append(self._resumos[chat_id])
+        alterados.sort(key=chave_ordem, reverse=True)
+        removidos = []
+        for chat_id, versao_chat in reversed(self._removidas.items()):
+            if versao_chat <= versao:
+                break
+            removidos.append(chat_id)
+        removidos.reverse()
+        return alterados, removidos
@@ -0,0 +1,5 @@
+"""Os testes importam os módulos do backend como o server.py faz (de dentro de backend/)"""
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
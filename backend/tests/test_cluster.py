@@ -0,0 +1,235 @@
+import asyncio
+import importlib
+import os
+
+import pytest
+
+from cluster import ClusterBus, ErroRemoto, LocalBus, SQLiteBus
+
+
+def bus_com_membros(membros):
+    bus = LocalBus()
+    bus.membros = sorted(membros)
+    return bus
+
+
+def donos(bus, chaves):
+    return {chave: bus.dono(chave) for chave in chaves}
+
+
+CHATS = [f"5541{i:08d}@s.whatsapp.net" for i in range(3000)]
+
+
+def test_dono_deterministico_e_equilibrado():
+    membros = ["w1", "w2", "w3"]
+    a, b = bus_com_membros(membros), bus_com_membros(list(reversed(membros)))
+
+    assert donos(a, CHATS) == donos(b, CHATS)  # todo worker chega ao mesmo dono
+    contagem = {w: list(donos(a, CHATS).values()).count(w) for w in membros}
+    assert all(800 < n < 1200 for n in contagem.values())
+
+
+def test_so_os_chats_do_worker_que_saiu_mudam_de_dono():
+    antes = donos(bus_com_membros(["w1", "w2", "w3"]), CHATS)
+    depois = donos(bus_com_membros(["w1", "w3"]), CHATS)
+
+    mudaram = {chat for chat in CHATS if antes[chat] != depois[chat]}
+    assert mudaram == {chat for chat in CHATS if antes[chat] == "w2"}
+
+
+def test_worker_novo_so_recebe_chats_e_nao_embaralha_o_resto():
+    antes = donos(bus_com_membros(["w1", "w2"]), CHATS)
+    depois = donos(bus_com_membros(["w1", "w2", "w3"]), CHATS)
+
+    for chat in CHATS:
+        assert depois[chat] in (antes[chat], "w3")
+    assert sum(1 for chat in CHATS if depois[chat] == "w3") > 700
+
+
+def test_um_worker_so_e_dono_de_tudo():
+    bus = LocalBus()
+    assert not bus.distribuido
+    assert all(bus.sou_dono(chat) for chat in CHATS[:10])
+
+
+async def dois_nos(path):
+    """Dois workers no mesmo arquivo, cada um registrando o que recebe"""
+    recebidos = {"a": [], "b": []}
+
+    def handlers(nome):
+        async def on_event(evento):
+            recebidos[nome].append(evento)
+
+        async def on_request(corpo):
+            if corpo.get("falha"):
+                raise ErroRemoto(409, "conflito")
+            return {"feito_por": nome, "eco": corpo}
+
+        return on_event, on_request
+
+    a = SQLiteBus(path, poll_interval=0.01, heartbeat=0.05)
+    b = SQLiteBus(path, poll_interval=0.01, heartbeat=0.05)
+    await a.start(*handlers("a"))
+    await b.start(*handlers("b"))
+    await asyncio.sleep(0.1)  # heartbeats: cada um enxerga o outro
+    return a, b, recebidos
+
+
+async def esperar(condicao, timeout=2.0):
+    fim = asyncio.get_running_loop().time() + timeout
+    while not condicao():
+        assert asyncio.get_running_loop().time() < fim, "tempo esgotado"
+        await asyncio.sleep(0.01)
+
+
+def test_evento_chega_uma_vez_ao_outro_no_e_nao_volta(tmp_path):
+    async def cenario():
+        a, b, recebidos = await dois_nos(tmp_path / "cluster.db")
+        try:
+            a.publish({"type": "message_received", "chat_id": "c", "n": 1})
+            a.publish({"type": "message_received", "chat_id": "c", "n": 2})
+            await esperar(lambda: len(recebidos["b"]) == 2)
+            await asyncio.sleep(0.1)  # tempo para uma duplicata ou um eco aparecer
+            return recebidos, a.membros, b.membros, a.dono("c"), b.dono("c")
+        finally:
+            await a.close()
+            await b.close()
+
+    recebidos, membros_a, membros_b, dono_a, dono_b = asyncio.run(cenario())
+    assert [e["n"] for e in recebidos["b"]] == [1, 2]
+    assert recebidos["a"] == []
+    assert membros_a == membros_b and len(membros_a) == 2
+    assert dono_a == dono_b
+
+
+def test_pedido_executa_no_dono_e_devolve_erro_remoto(tmp_path):
+    async def cenario():
+        a, b, _ = await dois_nos(tmp_path / "cluster.db")
+        try:
+            resposta = await a.request(b.worker_id, {"op": "teste"})
+            with pytest.raises(ErroRemoto) as erro:
+                await a.request(b.worker_id, {"falha": True})
+            return resposta, erro.value.status, b.stats()["requests_served"]
+        finally:
+            await a.close()
+            await b.close()
+
+    resposta, status, atendidos = asyncio.run(cenario())
+    assert resposta == {"feito_por": "b", "eco": {"op": "teste"}}
+    assert status == 409
+    assert atendidos == 2
+
+
+def test_worker_que_para_sai_dos_membros(tmp_path):
+    async def cenario():
+        a, b, _ = await dois_nos(tmp_path / "cluster.db")
+        try:
+            await b.close()
+            await esperar(lambda: a.membros == [a.worker_id])
+            return a.dono("qualquer")
+        finally:
+            await a.close()
+
+    assert asyncio.run(cenario()) is not None
+
+
+# ---- server.py: encaminhamento ao dono e repasse dos eventos ----
+
+@pytest.fixture(scope="module")
+def server(tmp_path_factory):
+    pasta = tmp_path_factory.mktemp("server")
+    ambiente = {
+        "CONFIG_FILE": str(pasta / "config.json"),
+        "CONVERSAS_STORE": "memory",
+        "OUTBOX_DB": str(pasta / "outbox.db"),
+        "CLUSTER_BACKEND": "local",
+    }
+    anterior = {chave: os.environ.get(chave) for chave in ambiente}
+    os.environ.update(ambiente)
+    try:
+        yield importlib.import_module("server")
+    finally:
+        for chave, valor in anterior.items():
+            if valor is None:
+                os.environ.pop(chave, None)
+            else:
+                os.environ[chave] = valor
+
+
+class BusFalso(ClusterBus):
+    """Dois workers; o outro é dono de tudo e responde aos pedidos"""
+
+    name = "falso"
+
+    def __init__(self):
+        super().__init__()
+        self.membros = sorted([self.worker_id, "outro"])
+        self.publicados = []
+        self.pedidos = []
+
+    @property
+    def distribuido(self):
+        return True
+
+    def dono(self, chave):
+        return "outro"
+
+    def publish(self, evento):
+        self.publicados.append(evento)
+
+    async def request(self, destino, corpo):
+        self.pedidos.append((destino, corpo))
+        return {"remoto": True}
+
+
+@pytest.fixture
+def cluster_falso(server, monkeypatch):
+    bus = BusFalso()
+    monkeypatch.setattr(server, "cluster", bus)
+    publicados_ws = []
+    monkeypatch.setattr(server.ws_hub, "publish", publicados_ws.append)
+    return bus, publicados_ws
+
+
+def test_evento_remoto_vai_aos_paineis_uma_vez_sem_voltar_ao_bus(server, cluster_falso):
+    bus, publicados_ws = cluster_falso
+    evento = {
+        "type": "message_received",
+        "chat_id": "5541999990000@s.whatsapp.net",
+        "message": {"id": "m1", "from": "cliente", "text": "oi", "timestamp": "2024-05-01T19:30:00"},
+    }
+
+    asyncio.run(server.evento_do_cluster(evento))
+
+    assert len(publicados_ws) == 1
+    assert publicados_ws[0]["message"] == evento["message"]
+    assert "seq" in publicados_ws[0]  # numerado pelo stream deste worker
+    assert bus.publicados == []
+
+
+def test_broadcast_publica_uma_vez_local_e_uma_no_bus(server, cluster_falso):
+    bus, publicados_ws = cluster_falso
+
+    asyncio.run(server.broadcast_message({"type": "status_update", "status": {}}))
+
+    assert len(publicados_ws) == 1
+    assert bus.publicados == [{"type": "status_update", "status": {}}]
+
+
+def test_rota_de_conversa_e_encaminhada_ao_dono(server, cluster_falso):
+    bus, _ = cluster_falso
+    executou_aqui = []
+
+    @server.no_dono()
+    async def operacao_de_teste(chat_id: str, valor: int):
+        executou_aqui.append(chat_id)
+        return {"remoto": False}
+
+    resultado = asyncio.run(operacao_de_teste("c1", valor=3))
+
+    assert resultado == {"remoto": True}
+    assert executou_aqui == []
+    assert bus.pedidos == [("outro", {"op": "operacao_de_teste", "args": {"chat_id": "c1", "valor": 3}})]
+    # Do outro lado, o pedido roda a mesma função
+    assert asyncio.run(server.pedido_do_cluster(bus.pedidos[0][1])) == {"remoto": False}
+    assert executou_aqui == ["c1"]
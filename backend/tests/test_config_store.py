@@ -0,0 +1,115 @@
+import asyncio
+import json
+import os
+
+from config_store import ConfigStore
+
+DEFAULTS = {"auto_reply": True, "provider": "openrouter", "respostas": {"oi": "Olá"}}
+
+
+def test_carregar_mescla_defaults_com_o_arquivo(tmp_path):
+    path = tmp_path / "config.json"
+    path.write_text(json.dumps({"provider": "gemini"}))
+    store = ConfigStore(path, DEFAULTS)
+
+    atual = store.carregar()
+
+    assert atual["provider"] == "gemini"
+    assert atual["auto_reply"] is True
+    assert store.versao == 1
+
+
+def test_update_fora_do_loop_grava_na_hora_e_sem_temporarios(tmp_path):
+    path = tmp_path / "config.json"
+    store = ConfigStore(path, DEFAULTS)
+    store.carregar()
+    anterior = store.atual
+
+    store.update({"auto_reply": False})
+
+    assert json.loads(path.read_text())["auto_reply"] is False
+    assert anterior["auto_reply"] is True  # snapshot antigo não muda
+    assert os.listdir(tmp_path) == ["config.json"]
+    assert store.stats()["saves"] == 1
+
+
+def test_gravacao_mantem_permissoes(tmp_path):
+    path = tmp_path / "config.json"
+    path.write_text("{}")
+    os.chmod(path, 0o600)
+    store = ConfigStore(path, DEFAULTS)
+    store.carregar()
+
+    store.update({"provider": "gemini"})
+
+    assert os.stat(path).st_mode & 0o777 == 0o600
+
+
+def test_falha_na_gravacao_preserva_o_arquivo(tmp_path, monkeypatch):
+    path = tmp_path / "config.json"
+    path.write_text(json.dumps({"provider": "gemini"}))
+    store = ConfigStore(path, DEFAULTS)
+    store.carregar()
+
+    def quebra(*args, **kwargs):
+        raise OSError("disco cheio")
+
+    monkeypatch.setattr("config_store.json.dump", quebra)
+    store.update({"provider": "openrouter"})
+
+    assert json.loads(path.read_text()) == {"provider": "gemini"}
+    assert os.listdir(tmp_path) == ["config.json"]
+    assert store.stats()["save_errors"] == 1
+
+
+def test_updates_seguidos_viram_uma_gravacao(tmp_path):
+    path = tmp_path / "config.json"
+    store = ConfigStore(path, DEFAULTS, debounce=0.01)
+    store.carregar()
+
+    async def cenario():
+        for i in range(5):
+            store.update({"contador": i})
+        await asyncio.sleep(0.05)
+
+    asyncio.run(cenario())
+
+    assert json.loads(path.read_text())["contador"] == 4
+    assert store.stats()["saves"] == 1
+    assert store.stats()["pending_save"] is False
+
+
+def test_recarrega_edicao_manual(tmp_path):
+    path = tmp_path / "config.json"
+    recarregou = []
+
+    async def on_reload():
+        recarregou.append(store.versao)
+
+    store = ConfigStore(path, DEFAULTS, on_reload=on_reload)
+    store.carregar()
+    store.update({"auto_reply": False})
+
+    async def cenario():
+        assert await store.recarregar_se_mudou() is False  # a própria gravação não conta
+        path.write_text(json.dumps({"provider": "gemini", "extra": 1}))
+        os.utime(path, ns=(1, 1))  # mtime diferente mesmo em sistemas de arquivos de baixa resolução
+        return await store.recarregar_se_mudou()
+
+    assert asyncio.run(cenario()) is True
+    assert store.atual["provider"] == "gemini"
+    assert store.atual["auto_reply"] is True  # a edição no arquivo vence
+    assert recarregou == [store.versao]
+
+
+def test_json_invalido_mantem_a_configuracao(tmp_path):
+    path = tmp_path / "config.json"
+    store = ConfigStore(path, DEFAULTS)
+    store.carregar()
+    store.update({"provider": "gemini"})
+    path.write_text("{ quebrado")
+    os.utime(path, ns=(1, 1))
+
+    assert asyncio.run(store.recarregar_se_mudou()) is False
+    assert store.atual["provider"] == "gemini"
+    assert store.stats()["reload_errors"] == 1
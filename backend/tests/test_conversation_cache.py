@@ -0,0 +1,91 @@
+import pytest
+
+import storage
+from storage import ConversationCache
+
+
+class Relogio:
+    def __init__(self):
+        self.agora = 1000.0
+
+    def __call__(self):
+        return self.agora
+
+
+@pytest.fixture
+def relogio(monkeypatch):
+    relogio = Relogio()
+    monkeypatch.setattr(storage.time, "monotonic", relogio)
+    return relogio
+
+
+def preencher(cache, relogio, chat_ids, intervalo=1.0):
+    for chat_id in chat_ids:
+        cache[chat_id] = {"chat_id": chat_id, "mensagens": []}
+        cache.touch(chat_id)
+        relogio.agora += intervalo
+
+
+def nunca(chat_id):
+    return False
+
+
+def test_ttl_remove_so_as_ociosas(relogio):
+    cache = ConversationCache(max_size=100, ttl=60, min_idle=10)
+    preencher(cache, relogio, ["a", "b"])
+    relogio.agora += 100
+    preencher(cache, relogio, ["c"])
+
+    assert cache.evict_idle(nunca) == ["a", "b"]
+    assert list(cache) == ["c"]
+    assert cache.stats["evicted_ttl"] == 2
+
+
+def test_ttl_respeita_protegidas(relogio):
+    cache = ConversationCache(max_size=100, ttl=60, min_idle=10)
+    preencher(cache, relogio, ["a", "b"])
+    relogio.agora += 100
+
+    assert cache.evict_idle(lambda chat_id: chat_id == "a") == ["b"]
+    assert "a" in cache
+
+
+def test_tamanho_remove_as_menos_usadas(relogio):
+    cache = ConversationCache(max_size=3, ttl=3600, min_idle=10)
+    preencher(cache, relogio, ["a", "b", "c", "d", "e"], intervalo=20)
+    cache.touch("a")
+
+    assert cache.evict_idle(nunca) == ["b", "c"]
+    assert set(cache) == {"a", "d", "e"}
+    assert cache.stats["evicted_lru"] == 2
+
+
+def test_rajada_de_chats_novos_nao_passa_do_limite(relogio):
+    # Todas usadas há menos de min_idle: ainda assim o limite vale
+    cache = ConversationCache(max_size=2, ttl=3600, min_idle=120)
+    preencher(cache, relogio, ["a", "b", "c", "d", "e"], intervalo=0.1)
+
+    assert cache.evict_idle(nunca) == ["a", "b", "c"]
+    assert len(cache) == 2
+
+
+def test_limite_pula_protegidas_sem_parar(relogio):
+    cache = ConversationCache(max_size=2, ttl=3600, min_idle=10)
+    preencher(cache, relogio, ["a", "b", "c", "d"], intervalo=20)
+
+    assert cache.evict_idle(lambda chat_id: chat_id == "a") == ["b", "c"]
+    assert set(cache) == {"a", "d"}
+
+
+def test_tamanho_estimado_acompanha_alteracoes(relogio):
+    cache = ConversationCache()
+    preencher(cache, relogio, ["a"])
+    antes = cache.estimated_bytes
+
+    cache["a"]["mensagens"].append({"text": "x" * 5000})
+    assert cache.estimated_bytes == antes  # alteração ainda não avisada
+    cache.mark_changed("a")
+    assert cache.estimated_bytes > antes + 5000
+
+    del cache["a"]
+    assert cache.estimated_bytes == 0
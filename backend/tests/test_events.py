@@ -0,0 +1,117 @@
+import asyncio
+import json
+
+from events import BroadcastHub, EventStream
+
+
+def publicar(stream, n):
+    return [stream.publish({"type": "evento", "n": i}) for i in range(n)]
+
+
+def test_resume_devolve_exatamente_os_eventos_perdidos():
+    stream = EventStream(replay_size=10)
+    eventos = publicar(stream, 8)
+
+    assert [e["seq"] for e in eventos] == list(range(1, 9))
+    assert stream.since(5) == eventos[5:]
+    assert stream.since(0) == eventos
+    assert stream.since(8) == []
+
+
+def test_buffer_estourado_pede_resync():
+    stream = EventStream(replay_size=5)
+    eventos = publicar(stream, 12)  # ficam só 8..12
+
+    assert stream.since(6) is None  # o 7 já saiu do buffer
+    assert stream.since(7) == eventos[7:]
+    assert stream.since(11) == eventos[11:]
+
+
+def test_sequencia_do_futuro_pede_resync():
+    # Cliente que viu seq maior que a atual falou com outra instância
+    stream = EventStream()
+    publicar(stream, 3)
+
+    assert stream.since(4) is None
+
+
+def test_resume_so_vale_na_mesma_instancia():
+    stream = EventStream()
+    publicar(stream, 3)
+
+    assert stream.parse_resume(stream.epoch, 2) == 2
+    assert stream.parse_resume("outra", 2) is None
+    assert stream.parse_resume(stream.epoch, None) is None
+    assert stream.parse_resume(stream.epoch, -1) is None
+    assert EventStream().epoch != stream.epoch
+
+
+class Socket:
+    """WebSocket falso; `travado` segura os envios como um celular sem sinal"""
+
+    def __init__(self, travado=False):
+        self.recebidos = []
+        self.fechado_com = None
+        self.liberar = asyncio.Event()
+        if not travado:
+            self.liberar.set()
+
+    async def send_text(self, texto):
+        await self.liberar.wait()
+        self.recebidos.append(json.loads(texto))
+
+    async def close(self, code=1000):
+        self.fechado_com = code
+
+
+def test_cliente_lento_e_derrubado_sem_travar_o_broadcast():
+    async def cenario():
+        hub = BroadcastHub(max_queue=5, send_timeout=5)
+        lento, rapido = Socket(travado=True), Socket()
+        hub.register(lento, [])
+        hub.register(rapido, [{"type": "init"}])
+        await asyncio.sleep(0)
+
+        for i in range(20):
+            hub.publish({"type": "evento", "n": i})  # síncrono: nunca espera socket
+            await asyncio.sleep(0.001)
+        clientes_apos_publicar = len(hub)
+        lento.liberar.set()  # o envio que estava preso termina
+        await asyncio.sleep(0.01)
+        stats = hub.stats()
+        await hub.close()
+        return lento, rapido, clientes_apos_publicar, stats
+
+    lento, rapido, clientes, stats = asyncio.run(cenario())
+    assert clientes == 1
+    assert stats["dropped_slow_clients"] == 1
+    assert stats["published"] == 20
+    assert lento.recebidos == [{"type": "evento", "n": 0}, {"type": "overflow"}]
+    assert lento.fechado_com == 4000
+    assert rapido.recebidos == [{"type": "init"}] + [{"type": "evento", "n": i} for i in range(20)]
+
+
+def test_backlog_inicial_nao_conta_no_limite_da_fila():
+    async def cenario():
+        hub = BroadcastHub(max_queue=2)
+        socket = Socket()
+        hub.register(socket, [{"type": "evento", "n": i} for i in range(10)])
+        hub.publish({"type": "evento", "n": 10})
+        await asyncio.sleep(0.01)
+        await hub.close()
+        return socket, hub.dropped_clients
+
+    socket, derrubados = asyncio.run(cenario())
+    assert derrubados == 0
+    assert [m["n"] for m in socket.recebidos] == list(range(11))
+
+
+def test_socket_travado_expira_e_sai_do_hub():
+    async def cenario():
+        hub = BroadcastHub(max_queue=10, send_timeout=0.02)
+        hub.register(Socket(travado=True), [])
+        hub.publish({"type": "evento"})
+        await asyncio.sleep(0.1)
+        return len(hub)
+
+    assert asyncio.run(cenario()) == 0
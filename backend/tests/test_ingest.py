@@ -0,0 +1,118 @@
+import asyncio
+
+import pytest
+
+from ingest import DedupIndex, IdGenerator
+
+
+class Contador:
+    def __init__(self, atraso=0.0, erros=0):
+        self.chamadas = 0
+        self.atraso = atraso
+        self.erros = erros
+
+    async def __call__(self):
+        self.chamadas += 1
+        await asyncio.sleep(self.atraso)
+        if self.chamadas <= self.erros:
+            raise RuntimeError("falhou")
+        return f"resposta {self.chamadas}"
+
+
+def test_reenvio_depois_recebe_o_mesmo_resultado():
+    indice = DedupIndex()
+    fn = Contador()
+
+    async def cenario():
+        return await indice.run("msg1", fn), await indice.run("msg1", fn)
+
+    assert asyncio.run(cenario()) == (("resposta 1", False), ("resposta 1", True))
+    assert fn.chamadas == 1
+    assert indice.stats()["replayed"] == 1
+
+
+def test_reenvio_durante_o_processamento_espera_o_original():
+    indice = DedupIndex()
+    fn = Contador(atraso=0.02)
+
+    async def cenario():
+        return await asyncio.gather(indice.run("msg1", fn), indice.run("msg1", fn))
+
+    assert asyncio.run(cenario()) == [("resposta 1", False), ("resposta 1", True)]
+    assert fn.chamadas == 1
+    assert indice.stats()["joined"] == 1
+
+
+def test_falha_nao_fica_guardada():
+    indice = DedupIndex()
+    fn = Contador(atraso=0.01, erros=1)
+
+    async def cenario():
+        original, junto = await asyncio.gather(
+            indice.run("msg1", fn), indice.run("msg1", fn), return_exceptions=True
+        )
+        return original, junto, await indice.run("msg1", fn)
+
+    original, junto, reenvio = asyncio.run(cenario())
+    assert isinstance(original, RuntimeError)
+    assert isinstance(junto, RuntimeError)  # quem esperava o original vê o mesmo erro
+    assert reenvio == ("resposta 2", False)
+    assert indice.stats()["failed"] == 1
+
+
+def test_cancelamento_libera_a_chave():
+    indice = DedupIndex()
+    fn = Contador(atraso=1)
+
+    async def cenario():
+        tarefa = asyncio.create_task(indice.run("msg1", fn))
+        await asyncio.sleep(0)
+        tarefa.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await tarefa
+        return len(indice)
+
+    assert asyncio.run(cenario()) == 0
+
+
+def test_expira_depois_do_ttl():
+    indice = DedupIndex(ttl=0.01)
+    fn = Contador()
+
+    async def cenario():
+        await indice.run("msg1", fn)
+        await asyncio.sleep(0.02)
+        return await indice.run("msg1", fn)
+
+    assert asyncio.run(cenario()) == ("resposta 2", False)
+    assert fn.chamadas == 2
+
+
+def test_limite_de_tamanho_descarta_as_mais_antigas_concluidas():
+    indice = DedupIndex(max_size=3)
+    lenta = Contador(atraso=0.05)
+
+    async def cenario():
+        em_andamento = asyncio.create_task(indice.run("lenta", lenta))
+        await asyncio.sleep(0)
+        for i in range(5):
+            await indice.run(f"msg{i}", Contador())
+        chaves = list(indice._entradas)
+        await em_andamento
+        return chaves
+
+    chaves = asyncio.run(cenario())
+    assert "lenta" in chaves  # em andamento nunca sai
+    assert chaves[-2:] == ["msg3", "msg4"]
+    assert "msg0" not in chaves
+    assert indice.stats()["evicted"] >= 2
+
+
+def test_ids_crescentes_e_com_no():
+    gerador = IdGenerator(node="w1")
+    ids = [gerador.next("recv") for _ in range(1000)]
+
+    assert len(set(ids)) == 1000
+    valores = [int(i.split("_")[1]) for i in ids]
+    assert valores == sorted(valores)
+    assert all(i.startswith("recv_") and i.endswith("_w1") for i in ids)
@@ -0,0 +1,147 @@
+import asyncio
+
+from jobs import PRIORIDADE_ALTA, ChatCoalescer, JobQueue
+
+
+class Atendente:
+    """Handler de teste: pega a rajada do chat, simula a geração e registra"""
+
+    def __init__(self, duracao=0.0):
+        self.duracao = duracao
+        self.coalescer = None
+        self.rajadas = []
+        self.ativos = set()
+        self.em_paralelo = False
+
+    async def __call__(self, job):
+        chat_id = job["chat_id"]
+        if chat_id in self.ativos:
+            self.em_paralelo = True
+        self.ativos.add(chat_id)
+        try:
+            mensagens = self.coalescer.take(chat_id)
+            await asyncio.sleep(self.duracao)
+            self.rajadas.append((chat_id, mensagens))
+        finally:
+            self.ativos.discard(chat_id)
+            self.coalescer.done(chat_id)
+
+
+def montar(duracao=0.0, janela=0.03, workers=4, max_size=100):
+    atendente = Atendente(duracao)
+    fila = JobQueue(atendente, workers=workers, max_size=max_size)
+    coalescer = ChatCoalescer(fila, window=lambda: janela)
+    atendente.coalescer = coalescer
+    return fila, coalescer, atendente
+
+
+def test_rajada_do_mesmo_chat_vira_um_job():
+    async def cenario():
+        fila, coalescer, atendente = montar()
+        fila.start()
+        for texto in ("oi", "quero um combo", "tem entrega?"):
+            coalescer.add("a", texto)
+        coalescer.add("b", "boa noite")
+        await asyncio.sleep(0.1)
+        await fila.stop()
+        return atendente.rajadas, coalescer.stats()
+
+    rajadas, stats = asyncio.run(cenario())
+    assert sorted(rajadas) == [("a", ["oi", "quero um combo", "tem entrega?"]), ("b", ["boa noite"])]
+    assert stats["jobs"] == 2
+    assert stats["coalesced"] == 2
+
+
+def test_mensagens_durante_a_geracao_formam_a_proxima_rajada_em_ordem():
+    async def cenario():
+        fila, coalescer, atendente = montar(duracao=0.05, janela=0.01)
+        fila.start()
+        coalescer.add("a", "m1")
+        await asyncio.sleep(0.03)  # m1 em geração
+        coalescer.add("a", "m2")
+        coalescer.add("a", "m3")
+        await asyncio.sleep(0.2)
+        await fila.stop()
+        return atendente
+
+    atendente = asyncio.run(cenario())
+    assert atendente.rajadas == [("a", ["m1"]), ("a", ["m2", "m3"])]
+    assert not atendente.em_paralelo
+
+
+def test_quem_nao_para_de_escrever_recebe_resposta_no_limite():
+    async def cenario():
+        fila, coalescer, atendente = montar(janela=0.02)
+        fila.start()
+        for i in range(12):  # a cada 0.01s: a janela nunca fecha sozinha
+            coalescer.add("a", f"m{i}")
+            await asyncio.sleep(0.01)
+        await asyncio.sleep(0.1)
+        await fila.stop()
+        return atendente.rajadas
+
+    rajadas = asyncio.run(cenario())
+    assert len(rajadas) >= 2  # limite de 3x a janela
+    assert sum((m for _, m in rajadas), []) == [f"m{i}" for i in range(12)]
+
+
+def test_rajada_adiada_junta_o_que_chegou_depois():
+    async def cenario():
+        fila, coalescer, atendente = montar(janela=0.01)
+        adiou = []
+
+        async def handler(job):
+            mensagens = coalescer.take(job["chat_id"])
+            if not adiou:
+                adiou.append(mensagens)
+                coalescer.defer(job["chat_id"], mensagens, 0.05)
+            else:
+                atendente.rajadas.append(mensagens)
+            coalescer.done(job["chat_id"])
+
+        fila.handler = handler
+        fila.start()
+        coalescer.add("a", "m1")
+        await asyncio.sleep(0.03)  # adiada
+        coalescer.add("a", "m2")
+        ocupado = coalescer.is_busy("a")
+        await asyncio.sleep(0.1)
+        await fila.stop()
+        return atendente.rajadas, ocupado, coalescer.stats()
+
+    rajadas, ocupado, stats = asyncio.run(cenario())
+    assert rajadas == [["m1", "m2"]]
+    assert ocupado
+    assert stats["deferred"] == 1
+    assert stats["deferred_chats"] == 0
+
+
+def test_fila_prioriza_e_mantem_fifo_na_mesma_prioridade():
+    ordem = []
+
+    async def handler(job):
+        ordem.append(job["n"])
+
+    async def cenario():
+        fila = JobQueue(handler, workers=1)
+        for n in range(3):
+            fila.submit({"n": n})
+        fila.submit({"n": "primeiro contato"}, priority=PRIORIDADE_ALTA)
+        await asyncio.sleep(0.01)
+        await fila.stop()
+
+    asyncio.run(cenario())
+    assert ordem == ["primeiro contato", 0, 1, 2]
+
+
+def test_fila_cheia_recusa_e_coalescer_conta_as_mensagens_perdidas():
+    async def cenario():
+        fila, coalescer, _ = montar(janela=0, max_size=1)
+        fila.submit({"chat_id": "ocupando"})  # sem workers: a fila fica cheia
+        coalescer.add("a", "m1")
+        return fila.stats(), coalescer.stats(), coalescer.is_busy("a")
+
+    stats_fila, stats_coalescer, ocupado = asyncio.run(cenario())
+    assert stats_fila["rejected"] == 1
+    assert stats_coalescer["rejected"] == 1
+    assert not ocupado
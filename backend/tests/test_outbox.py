@@ -0,0 +1,229 @@
+import asyncio
+
+from outbox import MemoryOutboxStore, Outbox, SQLiteOutboxStore
+from routing import ModelHealth
+
+
+class Bot:
+    """Sender falso: respostas programadas por message_id, sucesso no resto"""
+
+    def __init__(self, respostas=None):
+        self.respostas = {k: list(v) for k, v in (respostas or {}).items()}
+        self.enviadas = []  # (chat_id, message_id) na ordem das tentativas
+
+    async def __call__(self, chat_id, texto, message_id):
+        self.enviadas.append((chat_id, message_id))
+        await asyncio.sleep(0)
+        programadas = self.respostas.get(message_id)
+        if programadas:
+            return programadas.pop(0)
+        return {"success": True, "messageId": f"wa_{message_id}"}
+
+
+def criar(store=None, bot=None, resultados=None, **kwargs):
+    async def on_result(item, resultado):
+        resultados.append((item["id"], resultado.get("success"), item["attempts"]))
+
+    opcoes = {
+        "workers": 2,
+        "base_delay": 0.01,
+        "max_delay": 0.02,
+        "rate": 1000,
+        "burst": 1000,
+        "breaker": ModelHealth(failure_threshold=1000, cooldown=0.01, max_cooldown=0.01),
+        **kwargs,
+    }
+    return Outbox(
+        store or MemoryOutboxStore(), bot or Bot(),
+        on_result=on_result if resultados is not None else None, **opcoes
+    )
+
+
+async def esperar(condicao, timeout=2.0):
+    fim = asyncio.get_running_loop().time() + timeout
+    while not condicao():
+        assert asyncio.get_running_loop().time() < fim, "tempo esgotado"
+        await asyncio.sleep(0.005)
+
+
+def test_ordem_por_chat_mesmo_com_reenvio():
+    bot = Bot({"a1": [{"success": False, "status": 503, "error": "bot fora"}]})
+    resultados = []
+
+    async def cenario():
+        outbox = criar(bot=bot, resultados=resultados)
+        await outbox.start()
+        for message_id in ("a1", "b1", "a2", "b2", "a3"):
+            await outbox.enqueue(message_id[0], f"texto {message_id}", message_id)
+        await esperar(lambda: len(resultados) == 5)
+        await outbox.stop()
+        return outbox.stats()
+
+    stats = asyncio.run(cenario())
+    do_chat_a = [m for chat, m in bot.enviadas if chat == "a"]
+    assert do_chat_a == ["a1", "a1", "a2", "a3"]  # a2 só sai depois de a1 entregue
+    assert ("a1", True, 2) in resultados
+    assert stats["sent"] == 5
+    assert stats["retries"] == 1
+    assert stats["queued"] == 0
+
+
+def test_erro_4xx_nao_e_reenviado_e_libera_a_proxima():
+    bot = Bot({"m1": [{"success": False, "status": 400, "error": "número inválido"}]})
+    resultados = []
+
+    async def cenario():
+        outbox = criar(bot=bot, resultados=resultados)
+        await outbox.start()
+        await outbox.enqueue("c", "um", "m1")
+        await outbox.enqueue("c", "dois", "m2")
+        await esperar(lambda: len(resultados) == 2)
+        await outbox.stop()
+        return outbox.stats()
+
+    stats = asyncio.run(cenario())
+    assert resultados == [("m1", False, 1), ("m2", True, 1)]
+    assert stats["failed"] == 1
+    assert stats["retries"] == 0
+
+
+def test_desiste_depois_de_max_attempts():
+    falha = {"success": False, "error": "timeout"}  # sem status: falha de conexão
+    bot = Bot({"m1": [falha] * 10})
+    resultados = []
+
+    async def cenario():
+        outbox = criar(bot=bot, resultados=resultados, max_attempts=3)
+        await outbox.start()
+        await outbox.enqueue("c", "oi", "m1")
+        await esperar(lambda: resultados)
+        await outbox.stop()
+        return outbox.stats()
+
+    stats = asyncio.run(cenario())
+    assert resultados == [("m1", False, 3)]
+    assert stats["retries"] == 2
+    assert stats["failed"] == 1
+
+
+def test_fila_cheia_recusa_sem_gravar():
+    store = MemoryOutboxStore()
+
+    async def cenario():
+        outbox = criar(store=store, max_size=2)  # sem start: nada sai
+        aceitas = [await outbox.enqueue("c", "oi", f"m{i}") for i in range(3)]
+        return aceitas, outbox.stats(), await store.claim()
+
+    aceitas, stats, gravadas = asyncio.run(cenario())
+    assert aceitas == [True, True, False]
+    assert stats["rejected"] == 1
+    assert [item["id"] for item in gravadas] == ["m0", "m1"]
+
+
+def test_pendentes_saem_depois_do_restart_em_ordem(tmp_path):
+    path = tmp_path / "outbox.db"
+    bot = Bot()
+    resultados = []
+
+    async def cenario():
+        antes = criar(store=SQLiteOutboxStore(path, owner="w1"))
+        await antes.enqueue("c", "um", "m1")
+        await antes.enqueue("c", "dois", "m2")
+        await antes.stop()  # parou antes de enviar
+
+        depois = criar(store=SQLiteOutboxStore(path, owner="w1"), bot=bot, resultados=resultados)
+        await depois.start()
+        await esperar(lambda: len(resultados) == 2)
+        stats = depois.stats()
+        await depois.stop()
+        conferencia = SQLiteOutboxStore(path, owner="w1")
+        restantes = await conferencia.claim()
+        await conferencia.close()
+        return stats, restantes
+
+    stats, restantes = asyncio.run(cenario())
+    assert stats["restored"] == 2
+    assert bot.enviadas == [("c", "m1"), ("c", "m2")]
+    assert restantes == []
+
+
+def test_linhas_de_worker_vivo_nao_sao_adotadas(tmp_path):
+    path = tmp_path / "outbox.db"
+
+    async def cenario():
+        a = SQLiteOutboxStore(path, owner="a", owner_ttl=30)
+        b = SQLiteOutboxStore(path, owner="b", owner_ttl=30)
+        await a.add({"id": "m1", "chat_id": "c", "text": "oi"})
+        reivindicadas_a = await a.claim()
+        reivindicadas_b = await b.claim()
+        await a.release()  # parada limpa: b assume na hora
+        adotadas_b = await b.claim()
+        await a.close()
+        await b.close()
+        return reivindicadas_a, reivindicadas_b, adotadas_b
+
+    reivindicadas_a, reivindicadas_b, adotadas_b = asyncio.run(cenario())
+    assert [item["id"] for item in reivindicadas_a] == ["m1"]
+    assert reivindicadas_b == []
+    assert [item["id"] for item in adotadas_b] == ["m1"]
+
+
+class StoreComClaimLento(MemoryOutboxStore):
+    """claim() só responde quando o teste libera"""
+
+    def __init__(self):
+        super().__init__()
+        self.liberar = None
+
+    async def claim(self):
+        await self.liberar.wait()
+        return await super().claim()
+
+
+def test_enqueue_durante_claim_lento_nao_duplica():
+    store = StoreComClaimLento()
+    bot = Bot()
+    resultados = []
+
+    async def cenario():
+        store.liberar = asyncio.Event()
+        outbox = criar(store=store, bot=bot, resultados=resultados)
+        outbox._prontos = asyncio.Queue()
+        reivindicacao = asyncio.create_task(outbox._reivindicar("adopted"))
+        await asyncio.sleep(0)  # claim em andamento
+        await outbox.enqueue("c", "oi", "m1")  # gravada antes do claim responder
+        store.liberar.set()
+        await reivindicacao
+        fila = [item["id"] for item in outbox._filas["c"]]
+
+        await outbox.start()
+        await esperar(lambda: resultados)
+        await asyncio.sleep(0.05)
+        stats = outbox.stats()
+        await outbox.stop()
+        return fila, stats
+
+    fila, stats = asyncio.run(cenario())
+    assert fila == ["m1"]
+    assert bot.enviadas == [("c", "m1")]
+    assert resultados == [("m1", True, 1)]
+    assert stats["adopted"] == 0
+    assert stats["queued"] == 0
+
+
+def test_linha_adotada_entra_na_ordem_de_criacao():
+    store = MemoryOutboxStore()
+
+    async def cenario():
+        outbox = criar(store=store)  # sem start: nada sai
+        await outbox.enqueue("c", "um", "n1")
+        await outbox.enqueue("c", "dois", "n2")
+        # Linha antiga de um worker que caiu
+        await store.add({"id": "velha", "chat_id": "c", "text": "antes", "attempts": 0, "created_at": 1.0})
+        await outbox._reivindicar("adopted")
+        return [item["id"] for item in outbox._filas["c"]], outbox.stats()
+
+    fila, stats = asyncio.run(cenario())
+    assert fila == ["n1", "velha", "n2"]  # a primeira (em envio) não sai do lugar
+    assert stats["adopted"] == 1
+    assert stats["queued"] == 3
@@ -0,0 +1,94 @@
+import asyncio
+
+import pytest
+
+from ratelimit import KeyedRateLimiter, TokenBucket
+
+
+class Relogio:
+    def __init__(self):
+        self.agora = 1000.0
+
+    def __call__(self):
+        return self.agora
+
+
+@pytest.fixture
+def relogio(monkeypatch):
+    relogio = Relogio()
+    monkeypatch.setattr("ratelimit.time.monotonic", relogio)
+    return relogio
+
+
+def test_rajada_passa_e_depois_recusa(relogio):
+    bucket = TokenBucket(rate=2, burst=3)
+
+    assert [bucket.try_acquire() for _ in range(4)] == [True, True, True, False]
+    assert (bucket.allowed, bucket.denied) == (3, 1)
+
+
+def test_reabastece_na_taxa_configurada(relogio):
+    bucket = TokenBucket(rate=2, burst=3)
+    for _ in range(3):
+        bucket.try_acquire()
+
+    assert bucket.wait_time() == pytest.approx(0.5)
+    relogio.agora += 0.4
+    assert not bucket.try_acquire()
+    relogio.agora += 0.1
+    assert bucket.try_acquire()
+    assert not bucket.try_acquire()
+
+
+def test_parado_acumula_so_ate_o_burst(relogio):
+    bucket = TokenBucket(rate=2, burst=3)
+    for _ in range(3):
+        bucket.try_acquire()
+    relogio.agora += 3600
+
+    assert [bucket.try_acquire() for _ in range(4)] == [True, True, True, False]
+
+
+def test_taxa_zero_desliga_o_limite(relogio):
+    bucket = TokenBucket(rate=0, burst=1)
+    limitador = KeyedRateLimiter(rate=0, burst=1)
+
+    assert all(bucket.try_acquire() for _ in range(100))
+    assert bucket.wait_time() == 0
+    assert all(limitador.try_acquire("a") for _ in range(100))
+
+
+def test_acquire_espera_a_ficha_ou_desiste_no_timeout():
+    async def cenario():
+        bucket = TokenBucket(rate=50, burst=1)  # uma ficha a cada 20ms
+        bucket.try_acquire()
+        desistiu = not await bucket.acquire(timeout=0.005)
+        conseguiu = await bucket.acquire(timeout=0.2)
+        return desistiu, conseguiu
+
+    assert asyncio.run(cenario()) == (True, True)
+
+
+def test_um_bucket_por_chat(relogio):
+    limitador = KeyedRateLimiter(rate=1, burst=2)
+
+    assert [limitador.try_acquire("a") for _ in range(3)] == [True, True, False]
+    assert limitador.try_acquire("b")  # chat em loop não gasta a cota dos outros
+    assert limitador.wait_time("a") == pytest.approx(1.0)
+    assert limitador.wait_time("b") == 0
+    assert limitador.wait_time("desconhecido") == 0
+    relogio.agora += 1
+    assert limitador.try_acquire("a")
+
+
+def test_lru_esquece_o_chat_menos_recente(relogio):
+    limitador = KeyedRateLimiter(rate=1, burst=1, max_keys=2)
+    limitador.try_acquire("a")
+    limitador.try_acquire("b")
+    limitador.try_acquire("a")  # "a" volta a ser o mais recente
+    limitador.try_acquire("c")
+
+    assert limitador.stats()["tracked"] == 2
+    assert limitador.wait_time("b") == 0  # esquecido: volta com o bucket cheio
+    assert limitador.wait_time("a") > 0
+    assert limitador.wait_time("c") > 0
@@ -0,0 +1,77 @@
+import json
+
+from records import HISTORICO_MAX_ENTRADAS, Conversation, Message, como_dict
+
+CONVERSA = {
+    "chat_id": "5541999990000@s.whatsapp.net",
+    "mensagens": [
+        {
+            "id": "recv_1",
+            "from": "cliente",
+            "text": "Vocês entregam no Boqueirão?",
+            "timestamp": "2024-05-01T19:30:00.123456",
+            "whatsapp_id": "3EB0ABC",
+        },
+        {
+            "id": "sent_2",
+            "from": "bot",
+            "text": "Entregamos em toda Curitiba! 🍣",
+            "timestamp": "2024-05-01T19:30:05",
+            "status": "failed",
+            "erro_envio": "bot fora do ar",
+            "reacao": "👍",
+        },
+    ],
+    "humano_ativo": True,
+    "modo_humanizado": False,
+    "ultimo_humano": "2024-05-01T19:31:00",
+    "mensagem_inicial_enviada": True,
+    "objecoes_tratadas": ["preco"],
+    "historico_ia": [{"role": "user", "content": "Vocês entregam?", "tokens": 5}],
+    "resumo_ia": {"texto": "Cliente perguntou da entrega", "ate": 1},
+    "nome_cliente": "Ana",
+    "criado_em": "2024-05-01T19:29:59",
+    "campo_novo": {"x": 1},
+}
+
+
+def test_ida_e_volta_preserva_o_json():
+    conversa = Conversation.from_dict(json.loads(json.dumps(CONVERSA)))
+
+    assert conversa.to_dict() == CONVERSA
+    assert Conversation.from_dict(conversa.to_dict()).to_dict() == CONVERSA
+
+
+def test_campos_tipados_e_leitura_no_formato_antigo():
+    conversa = Conversation.from_dict(CONVERSA)
+    msg = conversa.mensagens[1]
+
+    assert isinstance(conversa.ultimo_humano, float)
+    assert conversa.get("ultimo_humano") == "2024-05-01T19:31:00"
+    assert conversa["nome_cliente"] == "Ana"
+    assert conversa.get("campo_novo") == {"x": 1}
+    assert msg.get("from") == "bot"
+    assert msg.get("timestamp") == "2024-05-01T19:30:05"
+    assert msg.get("reacao") == "👍"
+    assert msg.get("whatsapp_id", "nenhum") == "nenhum"
+
+
+def test_mensagem_minima_e_timestamp_inesperado():
+    assert Message.from_dict({"id": "m", "from": "bot", "text": "oi", "timestamp": None}).to_dict() == {
+        "id": "m", "from": "bot", "text": "oi", "timestamp": None
+    }
+    estranha = {"id": "m", "from": "bot", "text": "oi", "timestamp": "ontem"}
+    assert Message.from_dict(estranha).to_dict() == estranha
+
+
+def test_historico_ia_limitado():
+    dados = dict(CONVERSA, historico_ia=[{"role": "user", "content": str(i)} for i in range(100)])
+    conversa = Conversation.from_dict(dados)
+
+    assert len(conversa.historico_ia) == HISTORICO_MAX_ENTRADAS
+    assert conversa.to_dict()["historico_ia"][-1]["content"] == "99"
+
+
+def test_como_dict_aceita_registro_ou_dict():
+    assert como_dict(Conversation.from_dict(CONVERSA)) == CONVERSA
+    assert como_dict(CONVERSA) is CONVERSA
@@ -0,0 +1,178 @@
+import asyncio
+
+import pytest
+
+from routing import CandidatoIndisponivel, ModelHealth, ModelRouter
+
+A = ("openrouter", "a")
+B = ("openrouter", "b")
+G = ("gemini", "g")
+
+
+class Provedores:
+    """Modelos falsos: atraso e resposta (ou exceção) por modelo"""
+
+    def __init__(self, **comportamento):
+        self.comportamento = comportamento
+        self.chamados = []
+        self.cancelados = []
+
+    async def __call__(self, provider, model):
+        self.chamados.append(model)
+        atraso, resposta = self.comportamento[model]
+        try:
+            await asyncio.sleep(atraso)
+        except asyncio.CancelledError:
+            self.cancelados.append(model)
+            raise
+        if isinstance(resposta, Exception):
+            raise resposta
+        return resposta
+
+
+class Stream:
+    def __init__(self):
+        self.fechado = False
+
+    async def aclose(self):
+        self.fechado = True
+
+
+def test_hedge_vence_e_a_lenta_e_cancelada():
+    router = ModelRouter()
+    provedores = Provedores(a=(1.0, "lenta"), b=(0.01, "rápida"))
+
+    async def cenario():
+        resultado = await router.call([A, B], provedores, hedge_after=0.02)
+        await asyncio.sleep(0)  # deixa o cancelamento chegar na perdedora
+        return resultado
+
+    assert asyncio.run(cenario()) == ("rápida", B)
+    assert provedores.chamados == ["a", "b"]
+    assert provedores.cancelados == ["a"]
+    assert router.stats()["hedges_fired"] == 1
+    assert router.stats()["hedges_won"] == 1
+
+
+def test_perdedora_que_terminou_junto_tem_o_stream_fechado():
+    router = ModelRouter()
+    streams = {"a": Stream(), "b": Stream()}
+
+    async def cenario():
+        largada = asyncio.Event()
+
+        async def fn(provider, model):
+            await largada.wait()
+            return streams[model]
+
+        # O hedge dispara b; as duas terminam na mesma volta do event loop
+        asyncio.get_running_loop().call_later(0.05, largada.set)
+        resultado, candidato = await router.call([A, B], fn, hedge_after=0.01)
+        await asyncio.sleep(0.01)
+        return candidato
+
+    vencedor = asyncio.run(cenario())
+    perdedor = "b" if vencedor == A else "a"
+    assert not streams[vencedor[1]].fechado
+    assert streams[perdedor].fechado
+
+
+def test_failover_segue_a_ordem_da_cadeia():
+    router = ModelRouter()
+    provedores = Provedores(a=(0, RuntimeError("503")), b=(0, ""), g=(0, "do gemini"))
+
+    assert asyncio.run(router.call([A, B, G], provedores)) == ("do gemini", G)
+    assert provedores.chamados == ["a", "b", "g"]  # texto vazio também é falha
+    assert router.stats()["failovers"] == 2
+    assert router.health(B).errors == 1
+
+
+def test_todos_falham_e_max_attempts_limita():
+    router = ModelRouter()
+    provedores = Provedores(a=(0, RuntimeError("fora")), b=(0, RuntimeError("fora")), g=(0, "ok"))
+
+    with pytest.raises(ValueError, match="Todos os modelos falharam"):
+        asyncio.run(router.call([A, B, G], provedores, max_attempts=2))
+    assert provedores.chamados == ["a", "b"]
+
+
+def test_limite_local_nao_conta_como_falha():
+    router = ModelRouter(failure_threshold=1)
+    provedores = Provedores(a=(0, CandidatoIndisponivel("sem cota")), b=(0, "ok"))
+
+    assert asyncio.run(router.call([A, B], provedores)) == ("ok", B)
+    assert router.health(A).state == "closed"
+    assert router.health(A).errors == 0
+
+
+def test_falhas_seguidas_abrem_o_breaker_e_a_cadeia_pula_o_modelo():
+    router = ModelRouter(failure_threshold=2, cooldown=60)
+    provedores = Provedores(a=(0, RuntimeError("503")), b=(0, "ok"))
+
+    async def cenario():
+        for _ in range(2):
+            with pytest.raises(ValueError):
+                await router.call([A], provedores)
+        provedores.chamados.clear()
+        return await router.call([A, B], provedores, max_attempts=1)
+
+    assert asyncio.run(cenario()) == ("ok", B)
+    assert router.health(A).state == "open"
+    assert provedores.chamados == ["b"]  # a foi para o fim da fila
+    assert router.order([A, B]) == [B, A]
+
+
+class Relogio:
+    def __init__(self):
+        self.agora = 1000.0
+
+    def __call__(self):
+        return self.agora
+
+
+@pytest.fixture
+def relogio(monkeypatch):
+    relogio = Relogio()
+    monkeypatch.setattr("routing.time.monotonic", relogio)
+    return relogio
+
+
+def test_cooldown_passa_a_half_open_e_sucesso_fecha(relogio):
+    saude = ModelHealth(failure_threshold=2, cooldown=30, max_cooldown=600)
+    saude.record_failure("503")
+    assert saude.state == "closed"
+    saude.record_failure("503")
+    assert saude.state == "open"
+    assert not saude.available()
+
+    relogio.agora += 31
+    assert saude.state == "half_open"
+    assert saude.available()
+    saude.record_success(100)
+    assert saude.state == "closed"
+    assert saude.consecutive_failures == 0
+
+
+def test_falha_em_half_open_dobra_o_cooldown(relogio):
+    saude = ModelHealth(failure_threshold=1, cooldown=30, max_cooldown=100)
+    saude.record_failure("503")
+    relogio.agora += 31
+    assert saude.state == "half_open"
+
+    saude.record_failure("503 de novo")
+    assert saude.cooldown == 60
+    relogio.agora += 31
+    assert saude.state == "open"  # o cooldown antigo já teria passado
+    relogio.agora += 30
+    saude.record_failure("503")
+    assert saude.cooldown == 100  # teto
+
+
+def test_ordem_prefere_o_mais_rapido_mas_favorece_o_principal():
+    router = ModelRouter(preferencia=0.5)
+    router.health(A).record_success(3000)
+    router.health(B).record_success(2000)
+    router.health(G).record_success(1000)
+
+    # Principal conta 3000 * 0.5 = 1500: passa o b (2000), não o g (1000)
+    assert router.order([A, B, G]) == [G, A, B]
@@ -0,0 +1,198 @@
+import asyncio
+import sqlite3
+from datetime import datetime
+
+from records import Message
+from search import SearchIndex, fts_query, parse_query
+from storage import SQLiteStore
+
+
+def mensagem(msg_id, texto, autor="cliente", ts=1_700_000_000.0):
+    return {"id": msg_id, "from": autor, "text": texto, "timestamp": datetime.fromtimestamp(ts).isoformat()}
+
+
+def ids(resultados):
+    return [r["message"]["id"] for r in resultados]
+
+
+async def todas_as_paginas(indice, q, limit, **filtros):
+    paginas, cursor = [], None
+    while True:
+        resultados, cursor = await indice.search(q, limit=limit, cursor=cursor, **filtros)
+        paginas.append(ids(resultados))
+        if cursor is None:
+            return paginas
+
+
+def test_parse_query():
+    assert parse_query('Combo "Taxa de Entrega" golp* salmão') == (
+        ["combo", "taxa", "de", "entrega", "salmao"], ["golp"], [["taxa", "de", "entrega"]]
+    )
+    assert fts_query("golp* pix") == '"pix" AND "golp"*'
+    assert fts_query("?!") == ""
+
+
+def test_paginas_por_cursor_do_mais_novo_ao_mais_antigo():
+    async def cenario():
+        indice = SearchIndex()
+        for i in range(25):
+            indice.add(f"chat{i % 3}", mensagem(f"m{i}", f"combo número {i}", ts=1_700_000_000 + i))
+        indice.add("chat0", mensagem("x", "outra coisa"))
+        paginas = await todas_as_paginas(indice, "combo", limit=10)
+        await indice.close()
+        return paginas
+
+    paginas = asyncio.run(cenario())
+    assert [len(p) for p in paginas] == [10, 10, 5]
+    assert sum(paginas, []) == [f"m{i}" for i in range(24, -1, -1)]
+
+
+def test_filtros_frases_e_prefixos():
+    async def cenario():
+        indice = SearchIndex()
+        indice.add("a", mensagem("1", "Qual a taxa de entrega?", ts=100))
+        indice.add("a", mensagem("2", "A entrega tem taxa?", autor="bot", ts=200))
+        indice.add("b", mensagem("3", "Isso é GOLPE?", ts=300))
+        indice.add("b", Message("4", "humano", "Não é golpista não, pode confiar", 400.0))
+        resultados = [
+            ids((await indice.search('"taxa de entrega"'))[0]),
+            ids((await indice.search("taxa entrega"))[0]),
+            ids((await indice.search("taxa", autor="bot"))[0]),
+            ids((await indice.search("golp*"))[0]),
+            ids((await indice.search("golp*", chat_id="b", desde=350))[0]),
+            ids((await indice.search("", chat_id="a"))[0]),
+            ids((await indice.search(""))[0]),
+        ]
+        await indice.close()
+        return resultados
+
+    assert asyncio.run(cenario()) == [["1"], ["2", "1"], ["2"], ["4", "3"], ["4"], ["2", "1"], []]
+
+
+def test_remocao_e_limpeza_tiram_do_indice():
+    async def cenario():
+        indice = SearchIndex()
+        for chat_id in ("a", "b"):
+            for i in range(3):
+                indice.add(chat_id, mensagem(f"{chat_id}{i}", "pedido atrasado"))
+        indice.remove_chat("a")
+        depois_de_remover = ids((await indice.search("pedido"))[0])
+        tamanho = len(indice)
+        indice.add("a", mensagem("a9", "pedido novo"))
+        readicionada = ids((await indice.search("pedido", chat_id="a"))[0])
+        indice.clear()
+        vazio = (await indice.search("pedido"))[0]
+        await indice.close()
+        return depois_de_remover, tamanho, readicionada, vazio, len(indice)
+
+    depois_de_remover, tamanho, readicionada, vazio, final = asyncio.run(cenario())
+    assert depois_de_remover == ["b2", "b1", "b0"]
+    assert tamanho == 3
+    assert readicionada == ["a9"]
+    assert vazio == []
+    assert final == 0
+
+
+def test_repetidas_sao_ignoradas_e_cursor_vale_depois_do_restart(tmp_path):
+    path = tmp_path / "search.db"
+    conversa = {"chat_id": "c", "mensagens": [mensagem(f"m{i}", f"combo {i}") for i in range(5)]}
+
+    async def cenario():
+        indice = SearchIndex(path)
+        indice.add_conversa(conversa)
+        indice.add_conversa(conversa)  # evento repetido / reindexação
+        primeira, cursor = await indice.search("combo", limit=2)
+        assert not await indice.historico_indexado()
+        assert await indice.marcar_historico_indexado(0)
+        await indice.close()
+
+        reaberto = SearchIndex(path)
+        segunda, _ = await reaberto.search("combo", limit=2, cursor=cursor)
+        resultado = len(reaberto), await reaberto.historico_indexado(), ids(primeira), ids(segunda)
+        await reaberto.close()
+        return resultado
+
+    assert asyncio.run(cenario()) == (5, True, ["m4", "m3"], ["m2", "m1"])
+
+
+def test_cursor_invalido_recomeca_do_inicio():
+    async def cenario():
+        indice = SearchIndex()
+        indice.add("c", mensagem("m1", "combo"))
+        resultado = await indice.search("combo", cursor="abc.12")
+        await indice.close()
+        return resultado
+
+    assert asyncio.run(cenario()) == (
+        [{"chat_id": "c", "message": mensagem("m1", "combo")}], None
+    )
+
+
+def test_historico_percorrido_em_lotes(tmp_path):
+    async def cenario():
+        store = SQLiteStore(tmp_path / "conversas.db")
+        await store.save_many([
+            (f"chat{i:02d}", f'{{"chat_id": "chat{i:02d}", "mensagens": []}}', float(i), "{}")
+            for i in range(7)
+        ])
+        lotes, ultimo = [], None
+        while True:
+            pagina = await store.load_page(ultimo, 3)
+            if not pagina:
+                break
+            lotes.append([c["chat_id"] for c in pagina])
+            ultimo = pagina[-1]["chat_id"]
+        await store.close()
+        return lotes
+
+    assert asyncio.run(cenario()) == [
+        ["chat00", "chat01", "chat02"], ["chat03", "chat04", "chat05"], ["chat06"]
+    ]
+
+
+def test_erro_ao_gravar_nao_derruba_o_flush_em_segundo_plano(tmp_path, monkeypatch):
+    indice = SearchIndex(tmp_path / "search.db", flush_interval=0.01)
+    aplicar = indice._aplicar
+    falhas = []
+
+    def quebrado(ops):
+        if not falhas:
+            falhas.append(ops)
+            raise sqlite3.OperationalError("database is locked")
+        aplicar(ops)
+
+    def meta_quebrada(*args):
+        raise sqlite3.OperationalError("database is locked")
+
+    async def cenario():
+        await indice.marcar_historico_indexado(0)
+        monkeypatch.setattr(indice, "_aplicar", quebrado)
+        monkeypatch.setattr(indice, "_set_meta", meta_quebrada)  # a marca também não sai na hora
+        indice.start()
+        indice.add("c", mensagem("m1", "combo perdido"))
+        await asyncio.sleep(0.05)
+        indice.add("c", mensagem("m2", "combo novo"))
+        await asyncio.sleep(0.05)
+        vivo = not indice._task.done()
+        resultado = ids((await indice.search("combo"))[0])
+        marcado = await indice.historico_indexado()
+        await indice.close()
+        return vivo, resultado, marcado
+
+    vivo, resultado, marcado = asyncio.run(cenario())
+    assert vivo
+    assert resultado == ["m2"]
+    assert marcado is False  # apagada junto com o lote que deu certo
+    assert indice.stats()["errors"] == 1
+    assert indice.perdas == 1
+
+
+def test_fila_pendente_limitada():
+    indice = SearchIndex(max_backlog=3)
+    for i in range(5):
+        indice.add("c", mensagem(f"m{i}", "combo"))
+
+    assert len(indice._pendentes) == 3
+    assert indice.stats()["dropped"] == 2
+    assert indice.perdas == 2
+    assert asyncio.run(indice.marcar_historico_indexado(0)) is False
@@ -0,0 +1,107 @@
+import random
+
+from summaries import SummaryIndex
+
+
+def conversa(chat_id, ts, texto="oi"):
+    return {
+        "chat_id": chat_id,
+        "criado_em": "2026-01-01T00:00:00",
+        "mensagens": [{"id": f"{chat_id}-{ts}", "from": "cliente", "text": texto, "timestamp": ts}],
+    }
+
+
+def ts(n):
+    return f"2026-05-01T10:{n // 60:02d}:{n % 60:02d}"
+
+
+def todas_as_paginas(indice, limit):
+    vistos, cursor = [], None
+    while True:
+        pagina, cursor = indice.page(limit, cursor)
+        vistos += [r["chat_id"] for r in pagina]
+        if cursor is None:
+            return vistos
+
+
+def esperado(indice):
+    return [
+        r["chat_id"]
+        for r in sorted(
+            (indice.get(c) for c in list(indice._resumos)),
+            key=lambda r: (r.get("atualizado_em") or "", r["chat_id"]),
+            reverse=True,
+        )
+    ]
+
+
+def test_paginas_seguem_a_atividade_mais_recente_apos_muitas_escritas():
+    aleatorio = random.Random(7)
+    indice = SummaryIndex()
+    indice.load([{"chat_id": f"antigo{i}", "atualizado_em": ts(i)} for i in range(30)])
+    for passo in range(500):
+        chat = f"c{aleatorio.randrange(60)}"
+        if aleatorio.random() < 0.1:
+            indice.remove(chat)
+        else:
+            # Empates de timestamp desempatam pelo chat_id
+            indice.update(conversa(chat, ts(aleatorio.randrange(100, 140))))
+
+    assert todas_as_paginas(indice, 7) == esperado(indice)
+    assert todas_as_paginas(indice, 1000) == esperado(indice)
+
+
+def test_pagina_vazia_e_limite_exato():
+    indice = SummaryIndex()
+    assert indice.page(10) == ([], None)
+
+    for i in range(3):
+        indice.update(conversa(f"c{i}", ts(i)))
+    pagina, cursor = indice.page(3)
+    assert [r["chat_id"] for r in pagina] == ["c2", "c1", "c0"]
+    assert cursor is None
+
+
+def test_changes_since_traz_so_o_que_mudou_depois_da_versao():
+    indice = SummaryIndex()
+    indice.load([{"chat_id": "carregado", "atualizado_em": ts(0)}])
+    for i in range(5):
+        indice.update(conversa(f"c{i}", ts(i + 1)))
+    versao = indice.versao
+    indice.update(conversa("c1", ts(10), "de novo"))
+    indice.remove("c3")
+    indice.put({"chat_id": "remoto", "atualizado_em": ts(5)})
+    indice.update(conversa("c0", ts(11)))
+
+    alterados, removidos = indice.changes_since(versao)
+    assert [r["chat_id"] for r in alterados] == ["c0", "c1", "remoto"]
+    assert removidos == ["c3"]
+    assert indice.changes_since(indice.versao) == ([], [])
+    assert indice.changes_since(indice.versao + 1) is None
+
+    alterados, _ = indice.changes_since(0)
+    assert "carregado" not in [r["chat_id"] for r in alterados]
+
+
+def test_chat_removido_e_recriado_nao_aparece_como_removido():
+    indice = SummaryIndex()
+    indice.update(conversa("a", ts(1)))
+    versao = indice.versao
+    indice.remove("a")
+    indice.update(conversa("a", ts(2)))
+
+    alterados, removidos = indice.changes_since(versao)
+    assert [r["chat_id"] for r in alterados] == ["a"]
+    assert removidos == []
+    assert [r["chat_id"] for r in indice.page(10)[0]] == ["a"]
+
+
+def test_clear_zera_ordem_e_versoes():
+    indice = SummaryIndex()
+    indice.update(conversa("a", ts(1)))
+    epoch = indice.epoch
+    indice.clear()
+
+    assert indice.page(10) == ([], None)
+    assert indice.changes_since(0) == ([], [])
+    assert indice.epoch != epoch
@@ -11,6 +11,7 @@ const fs = require('fs');
 const path = require('path');
 const http = require('http');
 const axios = require('axios');
+const crypto = require('crypto');
 
 // Configuração
 const BACKEND_URL = process.env.BACKEND_URL || 'http://localhost:8001';
@@ -20,39 +21,73 @@ const PORT = process.env.PORT || 3001;
 let sock = null;
 let currentQR = null;
 let currentQRDataUrl = null;
+let currentQRHash = null;      // sha1 do data URL (mesmo hash do backend)
+let qrHashEnviado = null;      // último QR que o backend recebeu inteiro
 let connectionStatus = 'Aguardando conexão...';
 let isConnected = false;
 let phoneNumber = null;
-const mensagensProcessadas = new Set();
+// IDs já encaminhados (Baileys às vezes entrega a mesma mensagem duas vezes);
+// a deduplicação que vale é a do backend, aqui é só uma janela curta
+const mensagensProcessadas = new Map();  // id -> quando chegou (ms)
+const JANELA_MENSAGENS_MS = 10 * 60 * 1000;
 
 // Funções auxiliares
 function delay(ms) {
     return new Promise(resolve => setTimeout(resolve, ms));
 }
 
-async function notifyBackend(endpoint, data) {
-    try {
-        const response = await axios.post(`${BACKEND_URL}/api/webhook/${endpoint}`, data, {
-            timeout: 5000
-        });
-        return response.data;
-    } catch (error) {
-        if (error.code !== 'ECONNREFUSED') {
-            console.error(`Erro ao notificar backend: ${error.message}`);
+async function notifyBackend(endpoint, data, tentativas = 1) {
+    for (let tentativa = 1; tentativa <= tentativas; tentativa++) {
+        try {
+            const response = await axios.post(`${BACKEND_URL}/api/webhook/${endpoint}`, data, {
+                timeout: 5000
+            });
+            return response.data;
+        } catch (error) {
+            if (error.code !== 'ECONNREFUSED') {
+                console.error(`Erro ao notificar backend: ${error.message}`);
+            }
+            // Erro 4xx não melhora reenviando
+            const status = error.response?.status;
+            if (status && status < 500) return null;
+            if (tentativa < tentativas) await delay(1000 * 2 ** (tentativa - 1));
         }
-        return null;
     }
+    return null;
+}
+
+function jaProcessada(msgId) {
+    const agora = Date.now();
+    for (const [id, quando] of mensagensProcessadas) {
+        if (agora - quando < JANELA_MENSAGENS_MS) break;
+        mensagensProcessadas.delete(id);
+    }
+    if (mensagensProcessadas.has(msgId)) return true;
+    mensagensProcessadas.set(msgId, agora);
+    return false;
+}
+
+function hashQR(dataUrl) {
+    return dataUrl ? crypto.createHash('sha1').update(dataUrl).digest('hex') : null;
 }
 
 // Sincronizar status com backend periodicamente
-async function syncStatusWithBackend() {
+// O QR (imagem de ~10 KB) só vai inteiro quando é novo; no resto vai o hash
+async function syncStatusWithBackend(forcarQR = false) {
     const statusData = {
         connected: isConnected,
-        qr_code: currentQRDataUrl,
+        qr_hash: currentQRHash,
         status_text: connectionStatus,
         phone_number: phoneNumber
     };
-    await notifyBackend('status', statusData);
+    if (forcarQR || currentQRHash !== qrHashEnviado) {
+        statusData.qr_code = currentQRDataUrl;
+    }
+    const resposta = await notifyBackend('status', statusData);
+    if (!resposta) return;
+    if ('qr_code' in statusData) qrHashEnviado = currentQRHash;
+    // Backend reiniciou e não conhece o QR atual
+    if (resposta.need_qr && !forcarQR) await syncStatusWithBackend(true);
 }
 
 setInterval(syncStatusWithBackend, 5000);
@@ -93,6 +128,28 @@ async function enviarMensagemWhatsApp(chatId, mensagem) {
     }
 }
 
+// Envios recentes por message_id do backend: o reenvio de uma mensagem que
+// já saiu (resposta perdida por timeout) devolve o mesmo resultado
+const enviosRecentes = new Map();  // message_id -> { quando, promessa }
+
+function enviarUmaVez(messageId, chatId, mensagem) {
+    if (!messageId) return enviarMensagemWhatsApp(chatId, mensagem);
+    const agora = Date.now();
+    for (const [id, envio] of enviosRecentes) {
+        if (agora - envio.quando < JANELA_MENSAGENS_MS) break;
+        enviosRecentes.delete(id);
+    }
+    const anterior = enviosRecentes.get(messageId);
+    if (anterior) return anterior.promessa;
+    const promessa = enviarMensagemWhatsApp(chatId, mensagem).then(result => {
+        // Falha não fica guardada: o reenvio tenta de novo
+        if (!result.success) enviosRecentes.delete(messageId);
+        return result;
+    });
+    enviosRecentes.set(messageId, { quando: agora, promessa });
+    return promessa;
+}
+
 // Processamento de mensagens recebidas
 async function processarMensagem(msg) {
     try {
@@ -114,25 +171,19 @@ async function processarMensagem(msg) {
         }
         
         const msgId = msg.key.id;
-        if (mensagensProcessadas.has(msgId)) {
+        if (jaProcessada(msgId)) {
             return;
         }
-        mensagensProcessadas.add(msgId);
-        
-        if (mensagensProcessadas.size > 1000) {
-            const iterator = mensagensProcessadas.values();
-            for (let i = 0; i < 500; i++) {
-                mensagensProcessadas.delete(iterator.next().value);
-            }
-        }
         
         const chatId = msg.key.remoteJid;
         console.log(`\n\x1b[34m[CLIENTE ${chatId.split('@')[0]}] ${texto.substring(0, 100)}${texto.length > 100 ? '...' : ''}\x1b[0m`);
         
+        // Reenvio seguro: o backend processa cada message_id uma vez só
         const result = await notifyBackend('message', {
             chat_id: chatId,
-            message: texto
-        });
+            message: texto,
+            message_id: msgId
+        }, 3);
         
         if (result && result.response) {
             try {
@@ -148,6 +199,9 @@ async function processarMensagem(msg) {
             
             await sock.sendMessage(chatId, { text: result.response });
             console.log(`\x1b[32m[BOT] Resposta enviada para ${chatId.split('@')[0]}\x1b[0m`);
+        } else if (result && result.queued) {
+            // Resposta com IA chega depois pelo endpoint /send-message
+            console.log(`\x1b[36m[BOT] Resposta em processamento para ${chatId.split('@')[0]}\x1b[0m`);
         }
         
     } catch (error) {
@@ -174,7 +228,7 @@ const server = http.createServer(async (req, res) => {
         req.on('data', chunk => { body += chunk.toString(); });
         req.on('end', async () => {
             try {
-                const { chat_id, message } = JSON.parse(body);
+                const { chat_id, message, message_id } = JSON.parse(body);
                 
                 if (!chat_id || !message) {
                     res.writeHead(400, { 'Content-Type': 'application/json' });
@@ -182,9 +236,10 @@ const server = http.createServer(async (req, res) => {
                     return;
                 }
                 
-                const result = await enviarMensagemWhatsApp(chat_id, message);
+                const result = await enviarUmaVez(message_id, chat_id, message);
                 
-                res.writeHead(result.success ? 200 : 500, { 'Content-Type': 'application/json' });
+                // 503 = WhatsApp fora do ar: o backend reenvia depois
+                res.writeHead(result.success ? 200 : 503, { 'Content-Type': 'application/json' });
                 res.end(JSON.stringify(result));
             } catch (error) {
                 res.writeHead(400, { 'Content-Type': 'application/json' });
@@ -365,6 +420,7 @@ async function conectarWhatsApp() {
                     margin: 2,
                     errorCorrectionLevel: 'M'
                 });
+                currentQRHash = hashQR(currentQRDataUrl);
             } catch (e) {
                 console.error('Erro ao gerar QR data URL:', e);
             }
@@ -380,6 +436,7 @@ async function conectarWhatsApp() {
         if (connection === 'open') {
             currentQR = null;
             currentQRDataUrl = null;
+            currentQRHash = null;
             isConnected = true;
             connectionStatus = 'Conectado!';
             phoneNumber = sock.user?.id?.split(':')[0] || null;
@@ -399,6 +456,7 @@ async function conectarWhatsApp() {
             
             currentQR = null;
             currentQRDataUrl = null;
+            currentQRHash = null;
             isConnected = false;
             phoneNumber = null;
             
@@ -0,0 +1,90 @@
+"""
+Estado da conexão do WhatsApp (bot Node.js)
+
+O bot manda o status a cada poucos segundos. Só o que mudou de fato vira
+evento para os painéis, e o QR code (uma imagem em data URL de ~10 KB)
+é identificado pelo hash: vai uma vez por QR novo. No sync periódico o
+bot envia só `qr_hash`; se o backend não conhece aquele hash, responde
+pedindo o QR completo.
+"""
+import hashlib
+import uuid
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+CAMPOS = ("connected", "phone_number", "status_text")
+
+
+def hash_qr(qr_code: Optional[str]) -> Optional[str]:
+    """Mesmo hash calculado pelo bot.js (sha1 hex do data URL)"""
+    if not qr_code:
+        return None
+    return hashlib.sha1(qr_code.encode()).hexdigest()
+
+
+class WhatsAppState:
+    """Último status conhecido + diff de cada atualização recebida"""
+
+    def __init__(self):
+        self.estado: Dict[str, Any] = {
+            "connected": False,
+            "qr_code": None,
+            "qr_hash": None,
+            "phone_number": None,
+            "status_text": "Desconectado",
+        }
+        self.epoch = uuid.uuid4().hex[:8]  # ETag de antes de um restart nunca casa
+        self.versao = 0
+        self.stats_counters = {"updates": 0, "unchanged": 0, "changes": 0, "qr_requests": 0}
+
+    def aplicar(self, dados: Dict[str, Any]) -> Tuple[Dict[str, Any], bool]:
+        """(campos que mudaram, precisa do QR completo)"""
+        self.stats_counters["updates"] += 1
+        mudancas: Dict[str, Any] = {}
+        for campo in CAMPOS:
+            if campo in dados and dados[campo] != self.estado[campo]:
+                mudancas[campo] = dados[campo]
+
+        precisa_qr = False
+        if "qr_code" in dados:
+            novo_hash = hash_qr(dados["qr_code"])
+            if novo_hash != self.estado["qr_hash"]:
+                mudancas["qr_code"] = dados["qr_code"] or None
+                mudancas["qr_hash"] = novo_hash
+        elif "qr_hash" in dados and dados["qr_hash"] != self.estado["qr_hash"]:
+            if dados["qr_hash"]:
+                # QR novo que ainda não chegou inteiro: o bot reenvia com qr_code
+                precisa_qr = True
+                self.stats_counters["qr_requests"] += 1
+            else:
+                mudancas["qr_code"] = None
+                mudancas["qr_hash"] = None
+
+        if mudancas:
+            self.estado.update(mudancas)
+            self.versao += 1
+            self.stats_counters["changes"] += 1
+        else:
+            self.stats_counters["unchanged"] += 1
+        return mudancas, precisa_qr
+
+    def aplicar_lote(self, lote: Iterable[Dict[str, Any]]) -> Tuple[Dict[str, Any], bool]:
+        """Vários status em ordem; devolve o efeito combinado"""
+        mudancas: Dict[str, Any] = {}
+        precisa_qr = False
+        for dados in lote:
+            parcial, precisa = self.aplicar(dados)
+            mudancas.update(parcial)
+            precisa_qr = precisa_qr or precisa
+        # Valor final de cada campo alterado ao longo do lote
+        return {campo: self.estado[campo] for campo in mudancas}, precisa_qr
+
+    def etag(self, incluir_qr: bool = True) -> str:
+        return f'W/"wa-{self.epoch}.{self.versao}{"" if incluir_qr else ".noqr"}"'
+
+    def publico(self, incluir_qr: bool = True) -> Dict[str, Any]:
+        if incluir_qr:
+            return dict(self.estado)
+        return {campo: valor for campo, valor in self.estado.items() if campo != "qr_code"}
+
+    def stats(self) -> Dict:
+        return {"versao": self.versao, **self.stats_counters}
@@ -33,7 +33,8 @@ import {
   ExternalLink,
   Cpu,
   Zap,
-  Star
+  Star,
+  Search
 } from 'lucide-react';
 
 // ==================== CONFIGURAÇÃO ====================
@@ -57,6 +58,7 @@ const getWhatsAppBotUrl = () => {
 };
 
 const BACKEND_URL = getBackendUrl();
+const BACKEND_WS_URL = `${BACKEND_URL.replace(/^http/, 'ws')}/api/ws`;
 const WHATSAPP_BOT_URL = getWhatsAppBotUrl();
 
 // ==================== COMPONENTES ESTÁVEIS (fora do App) ====================
@@ -206,7 +208,12 @@ function App() {
   const [availableModels, setAvailableModels] = useState({ openrouter: {}, gemini: {} });
   const [conversas, setConversas] = useState([]);
   const [selectedChat, setSelectedChat] = useState(null);
+  const [chatMensagens, setChatMensagens] = useState([]);
+  // Texto parcial das respostas em streaming, por chat
+  const [parciais, setParciais] = useState({});
   const [newMessage, setNewMessage] = useState('');
+  const [termoBusca, setTermoBusca] = useState('');
+  const [resultadosBusca, setResultadosBusca] = useState(null);
   const [loading, setLoading] = useState(true);
   const [connectionError, setConnectionError] = useState(false);
   const [mobileMenuOpen, setMobileMenuOpen] = useState(false);
@@ -228,6 +235,9 @@ function App() {
   const messagesContainerRef = useRef(null);
   const lastMessageCountRef = useRef(0);
   const userScrolledUpRef = useRef(false);
+  const versaoConversasRef = useRef(null);
+  const wsConnectedRef = useRef(false);
+  const selectedChatIdRef = useRef(null);
 
   // Detectar PWA
   useEffect(() => {
@@ -359,24 +369,206 @@ function App() {
     }
   }, []);
 
-  // Buscar conversas
+  // Buscar conversas (resumos; depois da primeira carga, só o que mudou)
   const fetchConversas = useCallback(async () => {
     try {
-      const response = await fetch(`${BACKEND_URL}/api/conversas`);
+      const since = versaoConversasRef.current;
+      const url = since
+        ? `${BACKEND_URL}/api/conversas/resumo?limit=500&since=${encodeURIComponent(since)}`
+        : `${BACKEND_URL}/api/conversas/resumo?limit=500`;
+      const response = await fetch(url);
       if (response.ok) {
         const data = await response.json();
-        const newConversas = data.conversas || [];
-        setConversas(newConversas);
+        versaoConversasRef.current = data.versao;
         
-        if (selectedChat) {
-          const updated = newConversas.find(c => c.chat_id === selectedChat.chat_id);
-          if (updated) setSelectedChat(updated);
+        if (data.delta && data.conversas.length === 0 && data.removidas.length === 0) {
+          return;
         }
+        
+        setConversas(prev => {
+          if (!data.delta) return data.conversas;
+          const alteradas = new Set(data.conversas.map(c => c.chat_id));
+          const removidas = new Set(data.removidas);
+          const restantes = prev.filter(c => !alteradas.has(c.chat_id) && !removidas.has(c.chat_id));
+          return [...data.conversas, ...restantes];
+        });
+        
+        setSelectedChat(current => {
+          if (!current) return current;
+          if (data.delta && data.removidas.includes(current.chat_id)) return null;
+          return data.conversas.find(c => c.chat_id === current.chat_id) || current;
+        });
       }
     } catch (err) {
       console.error('Erro conversas:', err);
     }
-  }, [selectedChat]);
+  }, []);
+  
+  // Buscar mensagens da conversa aberta (incremental a partir da última recebida)
+  const fetchMensagens = useCallback(async (chatId, depoisDe) => {
+    try {
+      const url = depoisDe
+        ? `${BACKEND_URL}/api/conversa/${encodeURIComponent(chatId)}/mensagens?limit=500&depois_de=${encodeURIComponent(depoisDe)}`
+        : `${BACKEND_URL}/api/conversa/${encodeURIComponent(chatId)}/mensagens?limit=200`;
+      const response = await fetch(url);
+      if (response.ok) {
+        const data = await response.json();
+        setChatMensagens(prev => depoisDe && !data.reinicio ? [...prev, ...data.mensagens] : data.mensagens);
+      }
+    } catch (err) {
+      console.error('Erro mensagens:', err);
+    }
+  }, []);
+  
+  useEffect(() => {
+    selectedChatIdRef.current = selectedChat?.chat_id || null;
+    setChatMensagens([]);
+    if (selectedChat?.chat_id) {
+      fetchMensagens(selectedChat.chat_id);
+    }
+    // eslint-disable-next-line react-hooks/exhaustive-deps
+  }, [selectedChat?.chat_id, fetchMensagens]);
+  
+  useEffect(() => {
+    if (!selectedChat?.chat_id || chatMensagens.length === 0) return;
+    const ultima = chatMensagens[chatMensagens.length - 1];
+    if (selectedChat.ultima_mensagem?.id && selectedChat.ultima_mensagem.id !== ultima.id) {
+      fetchMensagens(selectedChat.chat_id, ultima.id);
+    }
+    // eslint-disable-next-line react-hooks/exhaustive-deps
+  }, [selectedChat?.versao]);
+
+  // Aplicar o resumo atualizado de um chat vindo de um evento
+  const aplicarResumo = useCallback((resumo) => {
+    if (!resumo) return;
+    setConversas(prev => [resumo, ...prev.filter(c => c.chat_id !== resumo.chat_id)]);
+    setSelectedChat(current => (current?.chat_id === resumo.chat_id ? resumo : current));
+  }, []);
+
+  // WebSocket com sequência de eventos: ao reconectar pede só o que perdeu (resume)
+  useEffect(() => {
+    let ws = null;
+    let closed = false;
+    let retryTimer = null;
+    let retryDelay = 1000;
+    let epoch = null;
+    let lastSeq = null;
+
+    const handleEvent = (ev) => {
+      if (ev.seq !== undefined && lastSeq !== null && ev.seq <= lastSeq && ev.type !== 'init') return;
+      if (ev.seq !== undefined) lastSeq = ev.seq;
+
+      switch (ev.type) {
+        case 'init':
+          epoch = ev.epoch;
+          versaoConversasRef.current = ev.versao;
+          setConversas(ev.conversas || []);
+          setSelectedChat(current => (
+            current ? (ev.conversas || []).find(c => c.chat_id === current.chat_id) || current : current
+          ));
+          setStatus(prev => ({ ...prev, whatsapp: ev.status, outbox: ev.outbox || prev.outbox }));
+          break;
+        case 'resumed':
+          epoch = ev.epoch;
+          break;
+        case 'message_received':
+        case 'message_sent':
+          if (selectedChatIdRef.current === ev.chat_id && ev.message) {
+            setChatMensagens(prev => (
+              prev.some(m => m.id === ev.message.id) ? prev : [...prev, ev.message]
+            ));
+          }
+          aplicarResumo(ev.resumo);
+          break;
+        case 'message_status':
+          // Fila de saída entregou (ou desistiu de) uma mensagem do bot/atendente
+          if (selectedChatIdRef.current === ev.chat_id) {
+            setChatMensagens(prev => prev.map(m => (
+              m.id === ev.message_id
+                ? { ...m, status: ev.status, whatsapp_id: ev.whatsapp_id, erro_envio: ev.error || undefined }
+                : m
+            )));
+          }
+          aplicarResumo(ev.resumo);
+          break;
+        case 'message_partial':
+          setParciais(prev => {
+            const proximo = { ...prev };
+            if (ev.done || !ev.text) delete proximo[ev.chat_id];
+            else proximo[ev.chat_id] = ev.text;
+            return proximo;
+          });
+          break;
+        case 'outbox_stats':
+          // Card "Fila de envio": o /api/status só é consultado com o WebSocket caído
+          setStatus(prev => ({ ...prev, outbox: ev.outbox }));
+          break;
+        case 'human_takeover':
+        case 'bot_resumed':
+          aplicarResumo(ev.resumo);
+          break;
+        case 'conversa_removida':
+          setConversas(prev => prev.filter(c => c.chat_id !== ev.chat_id));
+          setSelectedChat(current => (current?.chat_id === ev.chat_id ? null : current));
+          break;
+        case 'conversas_limpas':
+          setConversas([]);
+          setSelectedChat(null);
+          break;
+        case 'status_update':
+          // Só os campos que mudaram; o QR vem uma vez por código novo
+          setStatus(prev => ({ ...prev, whatsapp: { ...prev.whatsapp, ...ev.status } }));
+          setWhatsappBotStatus(prev => ({
+            connected: 'connected' in ev.status ? ev.status.connected : prev.connected,
+            qr: 'qr_code' in ev.status ? ev.status.qr_code : prev.qr,
+            status: 'status_text' in ev.status ? ev.status.status_text : prev.status
+          }));
+          break;
+        case 'config_updated':
+          fetchConfig();
+          fetchStatus();
+          break;
+        default:
+          break;
+      }
+    };
+
+    const connect = () => {
+      const resume = epoch && lastSeq !== null ? `?epoch=${epoch}&resume=${lastSeq}` : '';
+      ws = new WebSocket(`${BACKEND_WS_URL}${resume}`);
+      ws.onopen = () => {
+        wsConnectedRef.current = true;
+        retryDelay = 1000;
+        setConnectionError(false);
+      };
+      ws.onmessage = (e) => {
+        try {
+          handleEvent(JSON.parse(e.data));
+        } catch (err) {
+          console.error('Erro evento:', err);
+        }
+      };
+      ws.onclose = () => {
+        wsConnectedRef.current = false;
+        if (!closed) {
+          retryTimer = setTimeout(connect, retryDelay);
+          retryDelay = Math.min(retryDelay * 2, 30000);
+        }
+      };
+    };
+
+    connect();
+    const pingTimer = setInterval(() => {
+      if (ws && ws.readyState === WebSocket.OPEN) ws.send(JSON.stringify({ type: 'ping' }));
+    }, 25000);
+
+    return () => {
+      closed = true;
+      clearTimeout(retryTimer);
+      clearInterval(pingTimer);
+      if (ws) ws.close();
+    };
+  }, [aplicarResumo, fetchConfig, fetchStatus]);
 
   useEffect(() => {
     fetchStatus();
@@ -385,7 +577,9 @@ function App() {
     fetchConversas();
     fetchWhatsAppBotStatus();
     
+    // Polling só como fallback enquanto o WebSocket estiver desconectado
     const interval = setInterval(() => {
+      if (wsConnectedRef.current) return;
       fetchStatus();
       fetchConversas();
       fetchWhatsAppBotStatus();
@@ -396,7 +590,7 @@ function App() {
 
   // Auto-scroll inteligente - só rola se tiver nova mensagem E usuário não estiver vendo histórico
   useEffect(() => {
-    const currentCount = selectedChat?.mensagens?.length || 0;
+    const currentCount = chatMensagens.length;
     const previousCount = lastMessageCountRef.current;
     
     // Só faz scroll se tiver nova mensagem e usuário não tiver scrollado para cima
@@ -405,7 +599,7 @@ function App() {
     }
     
     lastMessageCountRef.current = currentCount;
-  }, [selectedChat?.mensagens?.length]);
+  }, [chatMensagens.length]);
   
   // Resetar flag quando mudar de conversa
   useEffect(() => {
@@ -495,6 +689,29 @@ function App() {
     }
   }, []);
 
+  // Busca no histórico (espera o operador parar de digitar)
+  useEffect(() => {
+    const termo = termoBusca.trim();
+    if (!termo) {
+      setResultadosBusca(null);
+      return undefined;
+    }
+    const timer = setTimeout(async () => {
+      try {
+        const res = await fetch(`${BACKEND_URL}/api/search?q=${encodeURIComponent(termo)}&limit=30`);
+        if (res.ok) setResultadosBusca((await res.json()).results);
+      } catch (err) {
+        console.error('Erro na busca:', err);
+      }
+    }, 250);
+    return () => clearTimeout(timer);
+  }, [termoBusca]);
+
+  const abrirResultado = useCallback((resultado) => {
+    const conversa = conversas.find(c => c.chat_id === resultado.chat_id);
+    setSelectedChat(conversa || { chat_id: resultado.chat_id, nome_cliente: resultado.nome_cliente || resultado.chat_id });
+  }, [conversas]);
+
   // Enviar mensagem
   const sendMessage = useCallback(async () => {
     if (!newMessage.trim() || !selectedChat) return;
@@ -633,7 +850,7 @@ function App() {
       )}
       
       {/* Stats Cards */}
-      <div className="grid grid-cols-1 sm:grid-cols-3 gap-4 mb-6">
+      <div className="grid grid-cols-1 sm:grid-cols-2 lg:grid-cols-4 gap-4 mb-6">
         <div className="bg-gray-800 rounded-2xl p-4 lg:p-6 border border-gray-700">
           <div className="flex items-center justify-between">
             <div>
@@ -677,6 +894,27 @@ function App() {
             </div>
           </div>
         </div>
+        
+        <div className="bg-gray-800 rounded-2xl p-4 lg:p-6 border border-gray-700">
+          <div className="flex items-center justify-between">
+            <div>
+              <p className="text-gray-400 text-xs lg:text-sm">Fila de envio</p>
+              <p className="text-lg lg:text-xl font-bold mt-1 text-white">{status.outbox?.queued ?? 0}</p>
+              {status.outbox && (
+                <p className="text-gray-500 text-xs mt-1">
+                  {status.outbox.breaker?.state === 'open'
+                    ? 'Bot indisponível, aguardando'
+                    : `${status.outbox.sent} enviadas · ${status.outbox.failed} falhas`}
+                </p>
+              )}
+            </div>
+            <div className={`w-10 h-10 lg:w-12 lg:h-12 rounded-xl flex items-center justify-center ${
+              status.outbox?.breaker?.state === 'open' ? 'bg-yellow-500/20' : 'bg-blue-500/20'
+            }`}>
+              <Send size={20} className={status.outbox?.breaker?.state === 'open' ? 'text-yellow-400' : 'text-blue-400'} />
+            </div>
+          </div>
+        </div>
       </div>
       
       {/* QR Code Section */}
@@ -743,10 +981,42 @@ function App() {
         <div className="p-4 border-b border-gray-700">
           <h3 className="font-bold text-white">Conversas</h3>
           <p className="text-sm text-gray-400">{conversas.length} ativas</p>
+          <div className="mt-3 relative">
+            <Search size={14} className="absolute left-3 top-1/2 -translate-y-1/2 text-gray-500" />
+            <input
+              type="search"
+              value={termoBusca}
+              onChange={(e) => setTermoBusca(e.target.value)}
+              placeholder='Buscar mensagens ("frase", prefixo*)'
+              className="w-full bg-gray-800 border border-gray-700 rounded-lg pl-8 pr-3 py-2 text-sm text-white placeholder-gray-500 focus:outline-none focus:border-red-500"
+              data-testid="busca-mensagens"
+            />
+          </div>
         </div>
         
         <div className="flex-1 overflow-y-auto overscroll-contain">
-          {conversas.length === 0 ? (
+          {resultadosBusca !== null ? (
+            resultadosBusca.length === 0 ? (
+              <div className="p-8 text-center text-gray-500 text-sm">Nenhuma mensagem encontrada</div>
+            ) : (
+              resultadosBusca.map((resultado) => (
+                <div
+                  key={resultado.message.id}
+                  className="p-4 border-b border-gray-800 hover:bg-gray-800 transition-colors cursor-pointer"
+                  onClick={() => abrirResultado(resultado)}
+                >
+                  <div className="flex items-center justify-between">
+                    <p className="font-medium truncate text-white text-sm">{resultado.nome_cliente || resultado.chat_id}</p>
+                    <span className="text-xs text-gray-500">{formatTime(resultado.message.timestamp)}</span>
+                  </div>
+                  <p className="text-xs text-gray-400 line-clamp-2">
+                    {resultado.message.from === 'cliente' ? '' : resultado.message.from === 'bot' ? '🤖 ' : '🧑 '}
+                    {resultado.message.text}
+                  </p>
+                </div>
+              ))
+            )
+          ) : conversas.length === 0 ? (
             <div className="p-8 text-center text-gray-500">
               <MessageCircle size={48} className="mx-auto mb-4 opacity-50" />
               <p>Nenhuma conversa</p>
@@ -774,7 +1044,7 @@ function App() {
                       )}
                     </div>
                     <p className="text-xs text-gray-400 truncate">
-                      {conversa.mensagens?.slice(-1)[0]?.text || 'Nova conversa'}
+                      {conversa.ultima_mensagem?.text || 'Nova conversa'}
                     </p>
                   </div>
                 </div>
@@ -831,7 +1101,7 @@ function App() {
               onScroll={handleMessagesScroll}
               className="flex-1 overflow-y-auto p-4 space-y-3 overscroll-contain"
             >
-              {selectedChat.mensagens?.map((msg, idx) => (
+              {chatMensagens.map((msg, idx) => (
                 <div key={msg.id || idx} className={`flex ${msg.from === 'cliente' ? 'justify-start' : 'justify-end'}`}>
                   <div className={`max-w-[85%] lg:max-w-[70%] rounded-2xl px-4 py-2 ${
                     msg.from === 'cliente'
@@ -846,11 +1116,28 @@ function App() {
                     }`}>
                       <Clock size={10} />
                       {formatTime(msg.timestamp)}
-                      {msg.from !== 'cliente' && <CheckCheck size={12} className="ml-1" />}
+                      {msg.from !== 'cliente' && (
+                        msg.status === 'pending'
+                          ? <RefreshCw size={12} className="ml-1 animate-spin" title="Na fila de envio" />
+                          : msg.status === 'failed' || msg.erro_envio
+                            ? <AlertCircle size={12} className="ml-1 text-yellow-300" title={msg.erro_envio || 'Falha no envio'} />
+                            : <CheckCheck size={12} className="ml-1" />
+                      )}
                     </div>
                   </div>
                 </div>
               ))}
+              {parciais[selectedChat.chat_id] && (
+                <div className="flex justify-end">
+                  <div className="max-w-[85%] lg:max-w-[70%] rounded-2xl px-4 py-2 bg-red-500/60 text-white">
+                    <p className="whitespace-pre-wrap text-sm">{parciais[selectedChat.chat_id]}</p>
+                    <div className="flex items-center justify-end gap-1 mt-1 text-xs text-white/70">
+                      <Bot size={10} />
+                      digitando...
+                    </div>
+                  </div>
+                </div>
+              )}
               <div ref={messagesEndRef} />
             </div>
             
@@ -223,7 +223,7 @@ Write-Host ""
 Write-Host "  Pasta de instalacao: $InstallPath" -ForegroundColor White
 Write-Host ""
 Write-Host "  PROXIMOS PASSOS:" -ForegroundColor Yellow
-Write-Host "  1. Copie os arquivos server.py e bot.js para as pastas" -ForegroundColor White
+Write-Host "  1. Copie o conteudo de backend (server.py, modulos .py e prompts) e o bot.js para as pastas" -ForegroundColor White
 Write-Host "  2. Execute o backend:" -ForegroundColor White
 Write-Host "     cd $backendPath" -ForegroundColor Gray
 Write-Host "     .\venv\Scripts\Activate.ps1" -ForegroundColor Gray